@@ -0,0 +1,56 @@
+"""Append-only journal of the task results of a batch run, to resume it."""
+import os
+import json
+
+from xml_analyzer import AnalysisResult
+
+
+class BatchJournal:
+    """Per-task results of a batch run, appended to a JSON lines file.
+
+    Every finished task is written as one line and flushed to disk at
+    once, so a run that is killed loses at most the tasks in flight.
+    Opening the journal of an interrupted run loads the results recorded
+    so far in `results`; the batch loops recompute their aggregates from
+    them and only run the tasks missing. A line cut short by the
+    interruption is ignored, and its task runs again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        complete = True
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    complete = line.endswith('\n')
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    task = entry.pop('task')
+                    self.results[task] = AnalysisResult(**entry)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, 'a')
+        if not complete:
+            # end the cut line, so that it stays apart from the next one
+            self.file.write('\n')
+
+    def __contains__(self, task):
+        return task in self.results
+
+    def __len__(self):
+        return len(self.results)
+
+    def append(self, task, result):
+        """Record `result`, an AnalysisResult, as the result of `task`."""
+        self.results[task] = result
+        entry = dict(result._asdict(), task=task)
+        self.file.write(json.dumps(entry) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,354 @@
+"""Batch run loop shared by the TTC and PRM batch run scripts."""
+import os
+import random
+import argparse
+from collections import deque, namedtuple
+from functools import partial
+from multiprocessing import Pool, Value, current_process
+
+import xml_analyzer
+import surrogate_sim
+from random_state import load_random_state, seed_task, sumo_seed
+from result_store import ResultStore
+from batch_journal import BatchJournal
+from step_profiler import StepProfiler
+
+NUM_TASKS = 1000
+HORIZON = 600
+EMISSION_PATH = './emission/'
+NETWORK_NAME = 'cross_road_network'
+# seconds to wait for SUMO to complete its output files
+OUTPUT_TIMEOUT = 60
+
+# outputs of a simulated task, before analysis; `result` and `trajectory`
+# are only set with online metrics, `profile` with --profile
+TaskOutputs = namedtuple('TaskOutputs', ['task', 'emission_location', 'random_state', 'result', 'trajectory',
+                                         'profile'])
+
+# per-process state of the pool workers, set by init_worker
+_worker = {}
+
+
+def create_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--delete_all_xml', '-a', help="delete all xml", default=False)
+    parser.add_argument('--delete_uncollision_xml', '-u', help="delete uncollision xml", default=False)
+    parser.add_argument('--max_log', '-m', help="max log", default=2147483647)
+    parser.add_argument('--workers', '-w', help="number of parallel worker processes", type=int, default=1)
+    parser.add_argument('--online_metrics', '-o', action='store_true',
+                        help="collect metrics while simulating instead of writing and parsing xml")
+    parser.add_argument('--snapshot', '-s', action='store_true',
+                        help="read vehicle state from a per-step snapshot in the env")
+    parser.add_argument('--simulator', help="traci, or numpy for the surrogate simulator "
+                                            "(implies --online_metrics)", default='traci')
+    parser.add_argument('--net_cache', '-n', action='store_true',
+                        help="reuse the cached netconvert output of the network")
+    parser.add_argument('--result_store', '-r', help="directory of a result store to append the "
+                                                     "results to, instead of keeping the xml", default=None)
+    parser.add_argument('--trajectory_every', help="steps between the trajectory samples of the "
+                                                   "result store", type=int, default=10)
+    parser.add_argument('--master_seed', help="derive the seeds of every task from this (non-negative) "
+                                              "seed and the task id", type=int, default=None)
+    parser.add_argument('--journal', '-j', help="journal file of the task results, to resume an "
+                                                "interrupted batch from", default=None)
+    parser.add_argument('--analysis_workers', help="analyze the outputs of finished tasks in a pool of "
+                                                   "that many processes while the next ones simulate",
+                        type=int, default=0)
+    parser.add_argument('--analysis_queue', help="maximum number of tasks waiting for analysis with "
+                                                 "--analysis_workers", type=int, default=4)
+    parser.add_argument('--batch_controllers', '-b', action='store_true',
+                        help="evaluate the controllers of the same class together on arrays")
+    parser.add_argument('--profile', '-p', help="time the phases of the env steps, and save the "
+                                                "profile of the batch to this JSON file", default=None)
+    return parser
+
+
+def uses_online_metrics(args):
+    return args.online_metrics or args.simulator == surrogate_sim.SIMULATOR
+
+
+def env_options(args):
+    """Return the optional env parameters selected on the command line."""
+    return {
+        'use_snapshot': args.snapshot,
+        'trajectory_every': args.trajectory_every if args.result_store and uses_online_metrics(args) else 0,
+        'profile_steps': bool(args.profile),
+        'batch_controllers': args.batch_controllers,
+    }
+
+
+class BatchStats:
+    """Running success/collision/duration/brake time aggregates of a batch."""
+
+    def __init__(self):
+        self.tasks = 0
+        self.collisions = 0
+        self.successes = 0
+        self.sum_brake_time = 0
+        self.sum_duration = 0
+
+    def add(self, result):
+        self.tasks += 1
+        if result.has_collision:
+            self.collisions += 1
+        if result.is_success:
+            self.successes += 1
+            self.sum_brake_time += result.brake_time
+            self.sum_duration += result.duration
+
+    def __str__(self):
+        return 'Task #{0}, success rate {1}%, collision rate {2}%, avg duration {3}, avg brake time {4}'.format(
+            self.tasks,
+            self.successes * 100.0 / self.tasks,
+            self.collisions * 100.0 / self.tasks,
+            "NAN" if self.successes == 0 else self.sum_duration / self.successes,
+            "NAN" if self.successes == 0 else self.sum_brake_time / self.successes)
+
+
+def wait_for_outputs(env, emission_location):
+    """Wait until SUMO has completed the output files of the run of `env`.
+
+    Flow closes the TraCI connection when the run terminates, and SUMO then
+    writes the end of its output files and exits, so waiting for the SUMO
+    process is enough; the closing tags of the files are checked as well,
+    for simulations whose process is not known.
+    """
+    sumo_proc = getattr(env.k.simulation, 'sumo_proc', None)
+    if sumo_proc is not None:
+        sumo_proc.wait(OUTPUT_TIMEOUT)
+    xml_analyzer.wait_complete(emission_location, OUTPUT_TIMEOUT)
+
+
+def analyze_outputs(env, emission_location):
+    """Analyze the output files of the run of `env` as soon as SUMO has completed them."""
+    wait_for_outputs(env, emission_location)
+    return xml_analyzer.analyze(emission_location)
+
+
+def remove_outputs(emission_location):
+    for suffix in ['-summary.xml', '-tripinfo.xml', '-emission.xml', '-seed']:
+        try:
+            os.remove(emission_location + suffix)
+        except Exception:
+            pass
+
+
+def simulate_task(cross_road_experiment, task, args, emission_path=EMISSION_PATH, network_name=NETWORK_NAME):
+    """Simulate a single task and return its TaskOutputs.
+
+    With `args.online_metrics` SUMO writes no output files and the metrics
+    are taken from the env at the end of the run; otherwise the outputs are
+    complete on return, and left to analyze_task.
+
+    With `args.master_seed` the python, numpy and SUMO seeds of the task are
+    derived from the master seed and the task id, and the seed file only
+    holds that pair; otherwise it holds python's random state.
+    """
+    online_metrics = uses_online_metrics(args)
+    seeds = None
+    if args.master_seed is not None:
+        seeds = seed_task(args.master_seed, task)
+    exp = cross_road_experiment(render=False, network_name=network_name,
+                                emission_path=None if online_metrics else emission_path,
+                                env_options=env_options(args), simulator=args.simulator,
+                                net_cache=args.net_cache, seed=sumo_seed(seeds))
+    # flow only creates the emission directory when SUMO writes outputs
+    # there, and the seed file goes there in any case
+    os.makedirs(emission_path, exist_ok=True)
+    emission_location = os.path.join(emission_path, exp.env.network.name)
+    print('Task #{0}, emission location {1}'
+          .format(task + 1, emission_location), flush=True)
+    random_state = seeds if seeds is not None else load_random_state()
+    with open(emission_location + '-seed', "w") as seed_file:
+        seed_file.write(random_state.__str__())
+    exp.run(1, HORIZON)
+    profile = exp.env.profiler.to_dict() if args.profile else None
+    if online_metrics:
+        return TaskOutputs(task, emission_location, random_state,
+                           exp.env.episode_result, exp.env.metrics.trajectory, profile)
+    wait_for_outputs(exp.env, emission_location)
+    return TaskOutputs(task, emission_location, random_state, None, None, profile)
+
+
+def analyze_task(outputs, args, kept_logs):
+    """Analyze the TaskOutputs of a simulated task and remove its output files if need be.
+
+    `kept_logs` counts the runs whose output files were kept, and is shared
+    between workers so that `--max_log` holds for the whole batch.
+
+    With `args.result_store` the random state and a downsampled trajectory
+    are returned as the `record` of the task, for the result store, and the
+    output files are removed.
+    """
+    task, emission_location, random_state, result, trajectory, profile = outputs
+    if result is None:
+        result = xml_analyzer.analyze(emission_location)
+
+    record = None
+    if args.result_store:
+        if trajectory is None:
+            trajectory = xml_analyzer.trajectory(emission_location + '-emission.xml', args.trajectory_every)
+        record = random_state, trajectory
+
+    with kept_logs.get_lock():
+        delete = args.result_store or args.delete_all_xml or \
+            (args.delete_uncollision_xml and not result.has_collision) or \
+            (kept_logs.value >= int(args.max_log))
+        if not delete:
+            kept_logs.value += 1
+    if delete:
+        remove_outputs(emission_location)
+    return task, emission_location, result, record, profile
+
+
+def run_task(cross_road_experiment, task, args, kept_logs, emission_path=EMISSION_PATH, network_name=NETWORK_NAME):
+    """Simulate and analyze a single task, see simulate_task and analyze_task."""
+    outputs = simulate_task(cross_road_experiment, task, args, emission_path, network_name)
+    return analyze_task(outputs, args, kept_logs)
+
+
+def init_worker(cross_road_experiment, args, kept_logs):
+    """Set up a pool worker to run tasks of `cross_road_experiment` with run_worker_task.
+
+    Each worker writes to its own emission directory, under a network name
+    of its own.
+    """
+    # forked workers inherit the parent's random state, reseed them so that
+    # every worker draws a different sequence of scenes
+    random.seed()
+    worker_id = current_process()._identity[0]
+    _worker['cross_road_experiment'] = cross_road_experiment
+    _worker['args'] = args
+    _worker['kept_logs'] = kept_logs
+    _worker['emission_path'] = os.path.join(EMISSION_PATH, 'worker-{0}'.format(worker_id), '')
+    _worker['network_name'] = '{0}_{1}'.format(NETWORK_NAME, worker_id)
+    os.makedirs(_worker['emission_path'], exist_ok=True)
+
+
+def run_worker_task(task, **experiment_kwargs):
+    """Run `task` in a worker set up by init_worker and return the run_task result.
+
+    `experiment_kwargs` are passed on to the cross_road_experiment of the
+    worker, e.g. controller_params.
+    """
+    cross_road_experiment = _worker['cross_road_experiment']
+    if experiment_kwargs:
+        cross_road_experiment = partial(cross_road_experiment, **experiment_kwargs)
+    return run_task(cross_road_experiment, task, _worker['args'], _worker['kept_logs'],
+                    _worker['emission_path'], _worker['network_name'])
+
+
+def _init_analysis_worker(args, kept_logs):
+    _worker['args'] = args
+    _worker['kept_logs'] = kept_logs
+
+
+def _analyze_worker_task(outputs):
+    return analyze_task(outputs, _worker['args'], _worker['kept_logs'])
+
+
+def pipelined_tasks(cross_road_experiment, tasks, args, analysis_pool):
+    """Simulate `tasks` one by one while `analysis_pool` analyzes the finished ones.
+
+    Each task simulates under a network name of its own, so that its output
+    files stay untouched by the next tasks until analyzed. At most
+    `args.analysis_queue` tasks wait for analysis, which bounds the output
+    files on disk; the next simulation waits for the oldest analysis when
+    the queue is full. Yields the run_task results in task order.
+    """
+    pending = deque()
+    for task in tasks:
+        network_name = '{0}_task{1}'.format(NETWORK_NAME, task)
+        outputs = simulate_task(cross_road_experiment, task, args, network_name=network_name)
+        pending.append(analysis_pool.apply_async(_analyze_worker_task, (outputs, )))
+        while pending and (len(pending) >= args.analysis_queue or pending[0].ready()):
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _journal_results(journal, results):
+    """Append the (task, result) pairs of `results` to `journal`, and empty it."""
+    for task, result in results:
+        journal.append(task, result)
+    del results[:]
+
+
+def batch_run(cross_road_experiment, args, num_tasks=NUM_TASKS):
+    """Run `num_tasks` tasks and print the running aggregates after each.
+
+    With `args.workers > 1` tasks run in a process pool, each worker writing
+    to its own emission directory under a network name of its own, and the
+    results are merged here in completion order. With `args.result_store`
+    they are also appended to a ResultStore in that directory.
+
+    With `args.journal` every result is also appended to a BatchJournal, and
+    a batch started again with the same journal recomputes its aggregates
+    from the tasks recorded there and only runs the others. With a result
+    store too, the results are journaled once the store has written their
+    records, so that a killed run leaves no task journaled but not stored.
+
+    With `args.analysis_workers > 0` and a single worker, the outputs of the
+    tasks are analyzed in a pool of that many processes while the next
+    tasks simulate, see pipelined_tasks. With several workers, simulations
+    and analyses of different workers already overlap.
+
+    With `args.profile` the step profiles of the tasks are merged, and the
+    merged profile is printed and saved to that file at the end.
+    """
+    os.makedirs(EMISSION_PATH, exist_ok=True)
+    location_file = os.path.join(EMISSION_PATH, 'fail_runs')
+    kept_logs = Value('i', 0)
+    stats = BatchStats()
+    store = ResultStore(args.result_store) if args.result_store else None
+    journal = BatchJournal(args.journal) if args.journal else None
+    profiler = StepProfiler() if args.profile else None
+    unjournaled = []
+
+    tasks = range(num_tasks)
+    if journal is not None:
+        for task in tasks:
+            if task in journal:
+                stats.add(journal.results[task])
+        tasks = [task for task in tasks if task not in journal]
+        if stats.tasks:
+            print('Resumed from {0}: {1}'.format(args.journal, stats), flush=True)
+
+    if args.workers > 1:
+        pool = Pool(args.workers, initializer=init_worker, initargs=(cross_road_experiment, args, kept_logs))
+        results = pool.imap_unordered(run_worker_task, tasks)
+    elif args.analysis_workers > 0 and not uses_online_metrics(args):
+        pool = Pool(args.analysis_workers, initializer=_init_analysis_worker, initargs=(args, kept_logs))
+        results = pipelined_tasks(cross_road_experiment, tasks, args, pool)
+    else:
+        pool = None
+        results = (run_task(cross_road_experiment, task, args, kept_logs) for task in tasks)
+
+    try:
+        for task, emission_location, result, record, profile in results:
+            stats.add(result)
+            if profiler is not None:
+                profiler.merge(profile)
+            if store is not None:
+                store.add(task, result, *record)
+            if journal is not None:
+                unjournaled.append((task, result))
+                if store is None or not store.tasks:
+                    _journal_results(journal, unjournaled)
+            if result.has_collision and store is None:
+                with open(location_file, 'a') as f:
+                    f.write(emission_location)
+                    f.write('\n')
+            print(stats, flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if store is not None:
+            store.close()
+        if journal is not None:
+            _journal_results(journal, unjournaled)
+            journal.close()
+        if profiler is not None:
+            print(profiler.summary(), flush=True)
+            profiler.save(args.profile)
+    return stats
@@ -0,0 +1,235 @@
+"""Benchmarks of the intersection envs and of the XML analysis.
+
+Measures the steps per second of CrossRoadAccelEnv with the TTC and PRM
+controllers, the reset latency, the latency of CrossRoadRLAccelEnv.get_state
+by number of vehicles, and the throughput of xml_analyzer.analyze on
+synthetic emission files. The results are saved as JSON, and `--compare`
+prints the ratios to an earlier result file.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --simulator numpy --xml_sizes 10 100 1000 --compare bench.json
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+from flow.core.params import SumoParams, EnvParams
+from flow.controllers import RLController
+
+import xml_analyzer
+import ttc_single_journey
+import prm_single_journey
+from rl_env import CrossRoadRLAccelEnv, ADDITIONAL_ENV_PARAMS
+from cross_road_network import CrossRoadNetwork
+from sumo_parameters import get_net_params, get_initial_config, get_vehicle_params
+
+# vehicle counts are grouped in buckets of this size for get_state latencies
+VEHICLE_BUCKET = 5
+
+
+def _latency_stats(seconds):
+    seconds = np.asarray(seconds)
+    return {
+        'count': len(seconds),
+        'mean_ms': float(seconds.mean() * 1000),
+        'p50_ms': float(np.percentile(seconds, 50) * 1000),
+        'p99_ms': float(np.percentile(seconds, 99) * 1000),
+    }
+
+
+def bench_env_steps(cross_road_experiment, simulator, steps):
+    """Return the steps per second and the reset latency of a traditional env."""
+    exp = cross_road_experiment(render=False, emission_path=None, simulator=simulator)
+    env = exp.env
+    resets = []
+    try:
+        start = time.perf_counter()
+        env.reset()
+        resets.append(time.perf_counter() - start)
+        step_time = 0
+        for _ in range(steps):
+            start = time.perf_counter()
+            _, _, done, _ = env.step(None)
+            step_time += time.perf_counter() - start
+            if done:
+                start = time.perf_counter()
+                env.reset()
+                resets.append(time.perf_counter() - start)
+    finally:
+        env.terminate()
+    return {
+        'steps': steps,
+        'steps_per_sec': steps / step_time,
+        'reset': _latency_stats(resets),
+    }
+
+
+def bench_get_state(simulator, steps, inflow_probabilities):
+    """Return the get_state latencies of the RL env by number of vehicles.
+
+    The env runs with random actions at each inflow probability, so that
+    the number of vehicles in the network covers a range of values.
+    """
+    latencies = {}
+    for inflow_probability in inflow_probabilities:
+        network = CrossRoadNetwork(
+            name='benchmark',
+            vehicles=get_vehicle_params(RLController, {}, True),
+            net_params=get_net_params(inflow_probability=inflow_probability),
+            initial_config=get_initial_config()
+        )
+        env_params = EnvParams(horizon=600, warmup_steps=150, additional_params=ADDITIONAL_ENV_PARAMS)
+        sim_params = SumoParams(render=False, sim_step=0.1, restart_instance=True, emission_path=None)
+        env = CrossRoadRLAccelEnv(env_params, sim_params, network, simulator)
+        try:
+            env.reset()
+            for _ in range(steps):
+                _, _, done, _ = env.step(np.random.randint(4))
+                num_vehicles = len(env.k.vehicle.get_ids())
+                start = time.perf_counter()
+                env.get_state()
+                bucket = num_vehicles // VEHICLE_BUCKET * VEHICLE_BUCKET
+                latencies.setdefault(bucket, []).append(time.perf_counter() - start)
+                if done:
+                    env.reset()
+        finally:
+            env.terminate()
+    return {'{0}-{1}'.format(bucket, bucket + VEHICLE_BUCKET - 1): _latency_stats(latencies[bucket])
+            for bucket in sorted(latencies)}
+
+
+def write_synthetic_outputs(emission_location, size_mb, num_vehicles=20):
+    """Write SUMO-like summary, tripinfo and emission files, the latter of about `size_mb` MB."""
+    with open(emission_location + '-summary.xml', 'w') as f:
+        f.write('<summary>\n')
+        f.write('    <step time="0.10" loaded="1" inserted="1" running="1" waiting="0" ended="0" '
+                'arrived="0" collisions="0" teleports="0" halting="0" stopped="0" meanWaitingTime="0.00" '
+                'meanTravelTime="-1.00" meanSpeed="10.00" meanSpeedRelative="0.50" duration="1"/>\n')
+        f.write('</summary>\n')
+    with open(emission_location + '-tripinfo.xml', 'w') as f:
+        f.write('<tripinfos>\n')
+        f.write('    <tripinfo id="SN_flow.0" depart="15.10" departLane="SS2M_0" departPos="0.00" '
+                'departSpeed="10.00" departDelay="0.00" arrival="27.60" arrivalLane="M2NN_0" '
+                'arrivalPos="100.00" arrivalSpeed="12.00" duration="12.50" routeLength="200.00" '
+                'waitingTime="0.00" waitingCount="0" stopTime="0.00" timeLoss="1.20" rerouteNo="0" '
+                'devices="tripinfo_SN_flow.0 emissions_SN_flow.0" vType="av" speedFactor="1.00" vaporized=""/>\n')
+        f.write('</tripinfos>\n')
+    vehicle = ('        <vehicle id="WE_flow.{0}" eclass="HBEFA3/PC_G_EU4" CO2="2624.72" CO="164.78" '
+               'HC="0.81" NOx="1.20" PMx="0.07" fuel="1.13" electricity="0.00" noise="69.09" '
+               'route="routeWE" type="human" waiting="0.00" lane="W2M_0" pos="{1:.2f}" '
+               'speed="{2:.2f}" angle="90.00" x="{1:.2f}" y="101.60"/>\n')
+    target = size_mb * 1024 * 1024
+    with open(emission_location + '-emission.xml', 'w') as f:
+        f.write('<emission-export>\n')
+        step = 0
+        while f.tell() < target:
+            lines = ['    <timestep time="{0:.2f}">\n'.format(step * 0.1)]
+            for i in range(num_vehicles):
+                lines.append(vehicle.format(i, (step + 10 * i) % 200 * 1.0, 10 + (step + i) % 5))
+            lines.append('    </timestep>\n')
+            f.write(''.join(lines))
+            step += 1
+        f.write('</emission-export>\n')
+
+
+def bench_xml_analyzer(sizes_mb):
+    """Return the throughput of xml_analyzer.analyze on synthetic files of `sizes_mb` MB."""
+    results = {}
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        for size_mb in sizes_mb:
+            emission_location = os.path.join(directory, 'benchmark_{0}'.format(size_mb))
+            write_synthetic_outputs(emission_location, size_mb)
+            size = sum(os.path.getsize(emission_location + suffix) for suffix in xml_analyzer.OUTPUT_ROOTS)
+            start = time.perf_counter()
+            xml_analyzer.analyze(emission_location)
+            seconds = time.perf_counter() - start
+            results['{0}MB'.format(size_mb)] = {
+                'bytes': size,
+                'seconds': seconds,
+                'mb_per_sec': size / 1024.0 / 1024.0 / seconds,
+            }
+            for suffix in xml_analyzer.OUTPUT_ROOTS:
+                os.remove(emission_location + suffix)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def machine_info():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.realpath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, prefix + key + '.')
+        else:
+            yield prefix + key, value
+
+
+def compare(results, baseline):
+    """Print the ratio of every measurement of `results` to the same one in `baseline`."""
+    old = dict(_flatten(baseline['results']))
+    for key, value in _flatten(results['results']):
+        if key in old and isinstance(value, float) and old[key]:
+            print('{0:<50} {1:>12.4f} {2:>12.4f} {3:>8.3f}x'.format(key, old[key], value, value / old[key]))
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Benchmarks of the intersection envs and the XML analysis")
+    parser.add_argument('--simulator', help="traci, or numpy for the surrogate simulator", default='traci')
+    parser.add_argument('--steps', help="env steps per benchmark", type=int, default=3000)
+    parser.add_argument('--inflow_probabilities', help="inflow probabilities of the get_state benchmark",
+                        type=float, nargs='+', default=[0.1, 0.3, 0.5])
+    parser.add_argument('--xml_sizes', help="sizes in MB of the synthetic emission files",
+                        type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--skip', help="benchmarks to skip: ttc, prm, get_state, xml",
+                        nargs='+', default=[])
+    parser.add_argument('--output', '-o', help="JSON file to save the results to", default='benchmark.json')
+    parser.add_argument('--compare', '-c', help="JSON result file to compare the results with", default=None)
+    return parser
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    results = {}
+    if 'ttc' not in args.skip:
+        results['ttc_env'] = bench_env_steps(ttc_single_journey.cross_road_experiment, args.simulator, args.steps)
+        print('ttc_env', results['ttc_env'], flush=True)
+    if 'prm' not in args.skip:
+        results['prm_env'] = bench_env_steps(prm_single_journey.cross_road_experiment, args.simulator, args.steps)
+        print('prm_env', results['prm_env'], flush=True)
+    if 'get_state' not in args.skip:
+        results['rl_get_state'] = bench_get_state(args.simulator, args.steps, args.inflow_probabilities)
+        print('rl_get_state', results['rl_get_state'], flush=True)
+    if 'xml' not in args.skip:
+        results['xml_analyzer'] = bench_xml_analyzer(args.xml_sizes)
+        print('xml_analyzer', results['xml_analyzer'], flush=True)
+
+    output = {'machine': machine_info(), 'simulator': args.simulator, 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
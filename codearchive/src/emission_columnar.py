@@ -0,0 +1,151 @@
+"""Streaming conversion of SUMO emission files into memory-mappable columns.
+
+A converted emission file is a directory holding one raw little-endian
+`<column>.bin` file per attribute of the `<vehicle>` elements, plus the
+`time` of their timestep, and a `meta.json` giving the number of rows,
+the dtype of each column and the dictionaries of the string columns. The
+numeric attributes are stored as float32 and the time as float64; the
+string attributes (id, lane, route, ...) as uint32 codes into their
+dictionary. `meta.json` is written last, so a directory without it is an
+incomplete conversion.
+
+    python emission_columnar.py emission/cross_road_network-emission.xml
+"""
+import os
+import sys
+import json
+
+import numpy as np
+
+from xml_analyzer import _iter_elements
+
+STRING_ATTRIBUTES = ('id', 'eclass', 'route', 'type', 'lane', 'edge')
+TIME_DTYPE = np.dtype('<f8')
+NUMERIC_DTYPE = np.dtype('<f4')
+CODE_DTYPE = np.dtype('<u4')
+META_FILE = 'meta.json'
+
+
+def columnar_path(emission_path):
+    """Return the directory of the columns of `emission_path`, the XML path without its suffix."""
+    return os.path.splitext(emission_path)[0]
+
+
+class _ColumnWriter:
+
+    def __init__(self, directory, name, dtype, dictionary=None):
+        self.dtype = dtype
+        self.dictionary = dictionary
+        self.values = []
+        self.file = open(os.path.join(directory, name + '.bin'), 'wb')
+
+    def append(self, value):
+        if self.dictionary is not None:
+            value = self.dictionary.setdefault(value, len(self.dictionary))
+        self.values.append(value)
+
+    def flush(self):
+        np.asarray(self.values, dtype=self.dtype).tofile(self.file)
+        self.values = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def convert(emission_path, directory=None, chunk_rows=65536):
+    """Convert the emission file at `emission_path` into columns in `directory`.
+
+    The XML is read incrementally and the columns are written every
+    `chunk_rows` rows, so memory stays bounded by a chunk and the string
+    dictionaries whatever the size of the file. The columns are those of
+    the first vehicle; a vehicle missing one of them gets NaN, or the empty
+    string. Returns the directory, columnar_path(emission_path) by default.
+    """
+    directory = directory or columnar_path(emission_path)
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    dictionaries = {}
+    writers = {}
+    rows = 0
+    try:
+        for timestep in _iter_elements(emission_path, 'timestep'):
+            time = float(timestep.attrib['time'])
+            for vehicle in timestep:
+                if not writers:
+                    writers['time'] = _ColumnWriter(directory, 'time', TIME_DTYPE)
+                    for name in vehicle.attrib:
+                        if name in STRING_ATTRIBUTES:
+                            dictionaries[name] = {}
+                            writers[name] = _ColumnWriter(directory, name, CODE_DTYPE, dictionaries[name])
+                        else:
+                            writers[name] = _ColumnWriter(directory, name, NUMERIC_DTYPE)
+                writers['time'].append(time)
+                for name, writer in writers.items():
+                    if name == 'time':
+                        continue
+                    value = vehicle.attrib.get(name)
+                    if writer.dictionary is not None:
+                        writer.append('' if value is None else value)
+                    else:
+                        writer.append(np.nan if value is None else float(value))
+                rows += 1
+                if rows % chunk_rows == 0:
+                    for writer in writers.values():
+                        writer.flush()
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    meta = {
+        'rows': rows,
+        'columns': {name: writer.dtype.str for name, writer in writers.items()},
+        'dictionaries': {name: sorted(dictionary, key=dictionary.get) for name, dictionary in dictionaries.items()},
+    }
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return directory
+
+
+class ColumnarEmission:
+    """The columns of a converted emission file, memory-mapped.
+
+    `emission[name]` is the read-only memmap of column `name`, holding the
+    codes of a string column; `strings(name)` decodes them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        self.rows = meta['rows']
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in meta['columns'].items()}
+        self.dictionaries = {name: np.array(values) for name, values in meta['dictionaries'].items()}
+        self._columns = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self.dtypes
+
+    def __getitem__(self, name):
+        if name not in self._columns:
+            if self.rows == 0:
+                self._columns[name] = np.zeros(0, dtype=self.dtypes[name])
+            else:
+                self._columns[name] = np.memmap(os.path.join(self.directory, name + '.bin'),
+                                                dtype=self.dtypes[name], mode='r', shape=(self.rows, ))
+        return self._columns[name]
+
+    def strings(self, name):
+        """Return the decoded values of string column `name`."""
+        return self.dictionaries[name][self[name]]
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(convert(path))
@@ -0,0 +1,73 @@
+"""Online collection of the metrics otherwise computed by xml_analyzer."""
+from xml_analyzer import AnalysisResult, BRAKE_DECEL
+
+
+class EpisodeMetrics:
+    """Accumulate collision, AV duration and brake time while simulating.
+
+    The env calls `update` after every simulation step with the collision
+    flag it already computed, and the metrics are read from kernel state
+    only, so the runs need no emission, summary or tripinfo output.
+
+    With `trajectory_every > 0` the (time, id, x, y, speed) of every vehicle
+    is also recorded in `trajectory` every that many steps.
+    """
+
+    def __init__(self, sim_step, trajectory_every=0):
+        self.sim_step = sim_step
+        self.trajectory_every = trajectory_every
+        self.reset()
+
+    def reset(self):
+        self.last_speed = {}
+        self.brake_time = 0
+        self.collision = False
+        self.av_depart = None
+        self.av_arrival = None
+        self.trajectory = []
+
+    def update(self, env, crash):
+        time = env.time_counter * self.sim_step
+        av_present = False
+        snapshot = getattr(env, 'snapshot', None)
+        if snapshot is not None:
+            vehicles = zip(snapshot.ids, snapshot.types, snapshot.speed)
+        else:
+            vehicle = env.k.vehicle
+            vehicles = ((veh_id, vehicle.get_type(veh_id), vehicle.get_speed(veh_id))
+                        for veh_id in vehicle.get_ids())
+        if self.trajectory_every > 0 and env.time_counter % self.trajectory_every == 0:
+            self._record_trajectory(env, time)
+        for veh_id, veh_type, speed in vehicles:
+            if veh_type == "av":
+                av_present = True
+                if self.av_depart is None:
+                    self.av_depart = time
+                continue
+            if speed < self.last_speed.get(veh_id, 0) - BRAKE_DECEL * self.sim_step:
+                self.brake_time += self.sim_step
+            self.last_speed[veh_id] = speed
+        if not av_present and self.av_depart is not None and self.av_arrival is None:
+            self.av_arrival = time
+        self.collision = self.collision or crash
+
+    def _record_trajectory(self, env, time):
+        snapshot = getattr(env, 'snapshot', None)
+        if snapshot is not None:
+            for i, veh_id in enumerate(snapshot.ids):
+                x, y, _ = snapshot.orientation[i]
+                self.trajectory.append((time, veh_id, x, y, snapshot.speed[i]))
+        else:
+            vehicle = env.k.vehicle
+            for veh_id in vehicle.get_ids():
+                x, y, _ = vehicle.get_orientation(veh_id)
+                self.trajectory.append((time, veh_id, x, y, vehicle.get_speed(veh_id)))
+
+    def result(self):
+        """Return the metrics of the episode so far as an AnalysisResult."""
+        duration = None
+        if self.av_arrival is not None:
+            duration = self.av_arrival - self.av_depart
+        brake_time = self.brake_time / len(self.last_speed) if len(self.last_speed) else 0
+        is_success = duration is not None and not self.collision
+        return AnalysisResult(self.collision, is_success, duration, brake_time)
@@ -0,0 +1,72 @@
+"""On-disk cache of the netconvert output of the networks of this repo."""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+from flow.core.params import VehicleParams, InitialConfig
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'net_cache')
+
+NETCONVERT_OPTIONS = ['--no-internal-links', 'false', '--no-turnarounds', 'true']
+
+
+def network_key(nodes, edges):
+    """Return the content hash of a network geometry."""
+    content = json.dumps({'nodes': nodes, 'edges': edges, 'netconvert': NETCONVERT_OPTIONS},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _write_xml(path, root_tag, tag, elements):
+    root = ET.Element(root_tag)
+    for attributes in elements:
+        ET.SubElement(root, tag, {k: str(v) for k, v in attributes.items()})
+    ET.ElementTree(root).write(path)
+
+
+def _generate(nodes, edges, net_path):
+    # build in a private directory and move the result into place
+    # atomically, so processes populating the same entry never see a
+    # partial file
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(net_path))
+    try:
+        nod_path = os.path.join(tmp_dir, 'net.nod.xml')
+        edg_path = os.path.join(tmp_dir, 'net.edg.xml')
+        tmp_net_path = os.path.join(tmp_dir, 'net.net.xml')
+        _write_xml(nod_path, 'nodes', 'node', nodes)
+        _write_xml(edg_path, 'edges', 'edge', edges)
+        subprocess.check_call(['netconvert', '--node-files', nod_path, '--edge-files', edg_path,
+                               '--output-file', tmp_net_path] + NETCONVERT_OPTIONS,
+                              stdout=subprocess.DEVNULL)
+        os.replace(tmp_net_path, net_path)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def cached_net_params(network_class, net_params, cache_dir=CACHE_DIR):
+    """Point `net_params.template` to the cached .net.xml of the network.
+
+    The .net.xml only depends on the nodes and edges that `network_class`
+    specifies for `net_params`, so it is keyed by their hash and generated
+    with netconvert on first use. With a template set, flow reads the net
+    file instead of running netconvert when it (re)starts the simulation;
+    routes, inflows and vehicle types are still written by flow for every
+    run, as they are cheap to generate.
+    """
+    network = network_class('net_cache', VehicleParams(), net_params, InitialConfig())
+    nodes = network.specify_nodes(net_params)
+    edges = network.specify_edges(net_params)
+    os.makedirs(cache_dir, exist_ok=True)
+    net_path = os.path.join(cache_dir, network_key(nodes, edges) + '.net.xml')
+    if not os.path.exists(net_path):
+        _generate(nodes, edges, net_path)
+    net_params.template = net_path
+    return net_params
@@ -0,0 +1,133 @@
+"""Compact storage of the observations of CrossRoadRLAccelEnv in the DQN replay buffer.
+
+This needs an RLlib whose DQN trainer samples through a replay optimizer,
+`ray.rllib.optimizers.SyncReplayOptimizer`, as in the ray 0.7 and 0.8
+releases used with Flow; later RLlib versions build DQN as an execution
+plan, which has no replay optimizer to give the buffers to.
+"""
+import collections
+
+import numpy as np
+
+from ray.rllib.optimizers.replay_buffer import ReplayBuffer, PrioritizedReplayBuffer
+
+from rl_env import X_PIXEL, Y_PIXEL
+
+# bounds of the channels of a grid cell of get_state: velocity cos/sin and
+# speed, relative to the speed limit that humans may exceed a little, then
+# heading / 360 and ttc / 20
+CHANNEL_BOUNDS = [(-1.25, 1.25), (-1.25, 1.25), (0.0, 1.25), (0.0, 1.0), (0.0, 1.0)]
+# valid flag and cell indices of a row of the sparse observation, exact
+# with a step of 1
+SPARSE_INDEX_BOUNDS = [(0.0, 1.0), (0.0, 255.0), (0.0, 255.0)]
+# the rl vehicle's velocity cos/sin and the global ttc
+SCALAR_BOUNDS = [(-1.25, 1.25), (-1.25, 1.25), (0.0, 1.0)]
+CODECS = ('float32', 'float16', 'uint8')
+
+
+class ObservationCodec:
+    """Encode observations into `dtype`, one of CODECS, and decode them into float32.
+
+    uint8 quantizes each value into 255 steps between the bounds of its
+    channel, 254 for signed channels so that zero is exact, and clips
+    values beyond them; the floats just cast. `max_cells` > 0 selects the
+    layout of the sparse observations of that many cells.
+    """
+
+    def __init__(self, dtype='uint8', max_cells=0):
+        if dtype not in CODECS:
+            raise ValueError('Unknown observation codec \'{}\''.format(dtype))
+        self.dtype = np.dtype(dtype)
+        if max_cells > 0:
+            cells = (SPARSE_INDEX_BOUNDS + CHANNEL_BOUNDS) * max_cells
+        else:
+            cells = CHANNEL_BOUNDS * (X_PIXEL * Y_PIXEL)
+        bounds = np.array(cells + SCALAR_BOUNDS)
+        self.low = bounds[:, 0]
+        self.high = bounds[:, 1]
+        levels = np.where(self.low < 0, 254, 255)
+        self.scale = (self.high - self.low) / levels
+        self.levels = levels
+
+    def encode(self, obs):
+        obs = np.asarray(obs)
+        if self.dtype != np.uint8:
+            return obs.astype(self.dtype)
+        codes = np.rint((np.clip(obs, self.low, self.high) - self.low) / self.scale)
+        return np.minimum(codes, self.levels).astype(np.uint8)
+
+    def decode(self, encoded):
+        """Decode an encoded observation, or a batch of them stacked on the first axis."""
+        if self.dtype != np.uint8:
+            return encoded.astype(np.float32)
+        return (self.low + encoded * self.scale).astype(np.float32)
+
+
+class _CompactStorage:
+    """Replay buffer storing the observations encoded by an ObservationCodec.
+
+    The next observation of a transition is the observation of a later
+    one, so the last `intern_size` encoded observations are kept by
+    content, and an observation already among them is stored as a
+    reference to the same array instead of a copy.
+    """
+
+    def __init__(self, size, codec, intern_size=64, **kwargs):
+        super().__init__(size, **kwargs)
+        self.codec = codec
+        self.intern_size = intern_size
+        self._interned = collections.OrderedDict()
+
+    def _intern(self, obs):
+        encoded = self.codec.encode(obs)
+        key = encoded.tobytes()
+        if key in self._interned:
+            self._interned.move_to_end(key)
+            return self._interned[key]
+        self._interned[key] = encoded
+        if len(self._interned) > self.intern_size:
+            self._interned.popitem(last=False)
+        return encoded
+
+    def add(self, obs_t, action, reward, obs_tp1, done, weight):
+        super().add(self._intern(obs_t), action, reward, self._intern(obs_tp1), done, weight)
+
+    def _encode_sample(self, idxes):
+        obses_t, actions, rewards, obses_tp1, dones = super()._encode_sample(idxes)
+        return self.codec.decode(obses_t), actions, rewards, self.codec.decode(obses_tp1), dones
+
+
+class CompactReplayBuffer(_CompactStorage, ReplayBuffer):
+    pass
+
+
+class CompactPrioritizedReplayBuffer(_CompactStorage, PrioritizedReplayBuffer):
+    pass
+
+
+def compact_replay_trainer(trainer_class, dtype='uint8', max_cells=0):
+    """Return a subclass of the DQN `trainer_class` whose replay buffers encode the observations into `dtype`.
+
+    `max_cells` is that of sparse observations, 0 for dense ones. The
+    replay optimizer creates its buffers on the first samples, so its
+    factory is replaced once the trainer is set up.
+    """
+    codec = ObservationCodec(dtype, max_cells)
+
+    class CompactReplayTrainer(trainer_class):
+
+        def _init(self, config, env_creator):
+            super()._init(config, env_creator)
+            if not hasattr(getattr(self, 'optimizer', None), 'replay_buffers'):
+                raise RuntimeError('The compact replay buffers need a DQN trainer with a replay optimizer, '
+                                   'this RLlib version has none; set REPLAY_OBS_CODEC to None')
+            if config['prioritized_replay']:
+                def new_buffer():
+                    return CompactPrioritizedReplayBuffer(config['buffer_size'], codec,
+                                                          alpha=config['prioritized_replay_alpha'])
+            else:
+                def new_buffer():
+                    return CompactReplayBuffer(config['buffer_size'], codec)
+            self.optimizer.replay_buffers = collections.defaultdict(new_buffer)
+
+    return CompactReplayTrainer
@@ -0,0 +1,292 @@
+"""Offline rendering of recorded episodes into videos, without SUMO.
+
+The vehicle positions, angles and speeds of an episode, read from an
+emission file, its columns (see emission_columnar), or the trajectory of
+a task of a result store, are rasterized into top-down frames of the
+intersection with NumPy. The frames of all episodes are split into
+segments of `segment_frames` frames, rendered and encoded in a pool of
+processes, and the segments of each episode are then concatenated into
+its video.
+
+    python offline_renderer.py --result_store results/ --outcome collision --workers 8
+    python offline_renderer.py --emission emission/cross_road_network-emission.xml
+"""
+import os
+import shutil
+import argparse
+import tempfile
+import subprocess
+from collections import namedtuple
+from multiprocessing import Pool
+
+import numpy as np
+
+from xml_analyzer import _iter_elements
+from result_store import ResultReader
+from emission_columnar import ColumnarEmission
+from video_encoder import VideoEncoder
+
+# rows of an episode, sorted by time; angle in degrees clockwise from north
+# as in SUMO
+Episode = namedtuple('Episode', ['time', 'vehicle', 'x', 'y', 'angle', 'speed'])
+
+LENGTH = 200
+LANE_WIDTH = 3.2
+VEHICLE_LENGTH = 5.0
+VEHICLE_WIDTH = 1.8
+MAX_SPEED = 20.0
+
+BACKGROUND_COLOR = (60, 110, 60)
+ROAD_COLOR = (90, 90, 90)
+MARKING_COLOR = (220, 220, 220)
+# colors are bgr, the pixel format of VideoEncoder; the av is red, and the
+# humans go from orange when stopped to white at MAX_SPEED
+AV_COLOR = (40, 40, 230)
+STOPPED_COLOR = np.array((0, 160, 240))
+MOVING_COLOR = np.array((235, 235, 235))
+
+
+def _is_av(vehicle):
+    return np.char.startswith(vehicle.astype(str), 'SN_flow')
+
+
+def load_emission(path):
+    """Return the Episode of an emission file, or of its columns if `path` is a directory."""
+    if os.path.isdir(path):
+        emission = ColumnarEmission(path)
+        return Episode(np.asarray(emission['time']), emission.strings('id'),
+                       *(np.asarray(emission[name], dtype=float) for name in ('x', 'y', 'angle', 'speed')))
+    rows = []
+    for timestep in _iter_elements(path, 'timestep'):
+        time = float(timestep.attrib['time'])
+        for vehicle in timestep:
+            attrib = vehicle.attrib
+            rows.append((time, attrib['id'], float(attrib['x']), float(attrib['y']),
+                         float(attrib['angle']), float(attrib['speed'])))
+    return _episode(rows)
+
+
+def load_task(reader, task):
+    """Return the Episode of `task` of a result store, read by `reader`, a ResultReader.
+
+    The store keeps no angles, so each vehicle is headed along its
+    displacement between samples, and keeps its last heading while it
+    stands still.
+    """
+    trajectory = reader.trajectory(task)
+    time, vehicle, x, y, speed = (trajectory[name] for name in ('time', 'vehicle', 'x', 'y', 'speed'))
+    vehicle = vehicle.astype(str)
+    angle = np.zeros(len(trajectory))
+    order = np.lexsort((time, vehicle))
+    heading = 0.0
+    for current, following in zip(order, np.append(order[1:], -1)):
+        if following >= 0 and vehicle[following] == vehicle[current]:
+            dx, dy = x[following] - x[current], y[following] - y[current]
+            if dx * dx + dy * dy > 1e-6:
+                heading = np.degrees(np.arctan2(dx, dy)) % 360
+        angle[current] = heading
+    return _episode(zip(time.astype(float), vehicle, x.astype(float), y.astype(float), angle, speed.astype(float)))
+
+
+def _episode(rows):
+    rows = sorted(rows, key=lambda row: row[0])
+    if not rows:
+        return Episode(*(np.zeros(0) for _ in Episode._fields))
+    time, vehicle, x, y, angle, speed = zip(*rows)
+    return Episode(np.array(time), np.array(vehicle), np.array(x), np.array(y), np.array(angle), np.array(speed))
+
+
+def intersection_center(episode, length=LENGTH):
+    """Return the (x, y) position of the middle of the intersection in the coordinates of `episode`.
+
+    The av drives north through it and the humans east and west, so the
+    median x of the av and median y of the humans give it to within half
+    a lane; without them, netconvert's offset of `length` is assumed.
+    """
+    av = _is_av(episode.vehicle)
+    center_x = np.median(episode.x[av]) if av.any() else length
+    center_y = np.median(episode.y[~av]) if (~av).any() else length
+    return center_x, center_y
+
+
+class Rasterizer:
+    """Draw top-down frames of the intersection, `view` meters around `center`, at `scale` pixels per meter."""
+
+    def __init__(self, center, view=60.0, scale=4.0):
+        self.center = center
+        self.view = view
+        self.scale = scale
+        self.size = int(2 * view * scale)
+        self.background = self._background()
+
+    def _pixels(self, x, y):
+        """Return the (column, row) pixel coordinates of positions in meters."""
+        return ((x - self.center[0] + self.view) * self.scale,
+                (self.center[1] + self.view - y) * self.scale)
+
+    def _background(self):
+        image = np.empty((self.size, self.size, 3), dtype=np.uint8)
+        image[:] = BACKGROUND_COLOR
+        middle = self.size / 2.0
+        half_road = LANE_WIDTH * self.scale
+        low, high = int(round(middle - half_road)), int(round(middle + half_road))
+        image[low:high, :] = ROAD_COLOR
+        image[:, low:high] = ROAD_COLOR
+        # dashed center lines outside the junction
+        dashes = (np.arange(self.size) // int(3 * self.scale)) % 2 == 0
+        outside = np.abs(np.arange(self.size) - middle) > half_road
+        line = int(middle)
+        image[line, dashes & outside] = MARKING_COLOR
+        image[dashes & outside, line] = MARKING_COLOR
+        return image
+
+    def draw(self, x, y, angle, speed, av):
+        """Return the frame of vehicles at (x, y) in meters, heading `angle` degrees clockwise from north."""
+        frame = self.background.copy()
+        columns, rows = self._pixels(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        radians = np.radians(angle)
+        # heading in image coordinates, rows growing southwards
+        forward = np.stack([np.sin(radians), -np.cos(radians)], axis=1)
+        fraction = np.clip(np.asarray(speed, dtype=float) / MAX_SPEED, 0, 1)[:, None]
+        colors = (STOPPED_COLOR * (1 - fraction) + MOVING_COLOR * fraction).astype(np.uint8)
+        colors[np.asarray(av, dtype=bool)] = AV_COLOR
+        half_length = VEHICLE_LENGTH / 2 * self.scale
+        half_width = VEHICLE_WIDTH / 2 * self.scale
+        # the body extends a vehicle length behind the position
+        reach = int(np.ceil(np.hypot(2 * half_length, half_width)))
+        for column, row, (fx, fy), color in zip(columns, rows, forward, colors):
+            c0, c1 = max(int(column) - reach, 0), min(int(column) + reach + 1, self.size)
+            r0, r1 = max(int(row) - reach, 0), min(int(row) + reach + 1, self.size)
+            if c0 >= c1 or r0 >= r1:
+                continue
+            dr, dc = np.mgrid[r0:r1, c0:c1]
+            dc = dc + 0.5 - column
+            dr = dr + 0.5 - row
+            along = dc * fx + dr * fy
+            across = dc * fy - dr * fx
+            # SUMO positions are the front bumper
+            inside = (along <= 0) & (along >= -2 * half_length) & (np.abs(across) <= half_width)
+            frame[r0:r1, c0:c1][inside] = color
+        return frame
+
+
+def frame_times(episode):
+    return np.unique(episode.time)
+
+
+def _render_segment(episode, center, view, scale, start, stop, path, fps):
+    """Render frames `start` to `stop` of `episode` into the video at `path`."""
+    rasterizer = Rasterizer(center, view, scale)
+    times = frame_times(episode)
+    bounds = np.searchsorted(episode.time, times[start:stop + 1], side='left')
+    if stop >= len(times):
+        bounds = np.append(bounds, len(episode.time))
+    av = _is_av(episode.vehicle)
+    with VideoEncoder(path, fps=fps) as encoder:
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            encoder.write(rasterizer.draw(episode.x[low:high], episode.y[low:high], episode.angle[low:high],
+                                          episode.speed[low:high], av[low:high]))
+    return path
+
+
+def _render_segment_job(job):
+    return _render_segment(*job)
+
+
+def concat_videos(paths, path, ffmpeg='ffmpeg'):
+    """Concatenate the videos at `paths`, of identical encodings, into `path` without re-encoding."""
+    if len(paths) == 1:
+        shutil.move(paths[0], path)
+        return
+    list_path = path + '.txt'
+    with open(list_path, 'w') as f:
+        for segment in paths:
+            f.write("file '{0}'\n".format(os.path.abspath(segment)))
+    try:
+        subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                               '-i', list_path, '-c', 'copy', path])
+    finally:
+        os.remove(list_path)
+    for segment in paths:
+        os.remove(segment)
+
+
+def render_episodes(episodes, workers=1, view=60.0, scale=4.0, speed=1.0, segment_frames=100):
+    """Render `episodes`, a dict of video path to Episode, in a pool of `workers` processes.
+
+    The frame rate plays the episodes `speed` times faster than real time.
+    Returns the paths of the videos.
+    """
+    segments_directory = tempfile.mkdtemp(prefix='offline-renderer-')
+    jobs = []
+    segments = {}
+    for path, episode in episodes.items():
+        times = frame_times(episode)
+        if len(times) == 0:
+            print('{0}: empty episode, skipped'.format(path), flush=True)
+            continue
+        step = np.median(np.diff(times)) if len(times) > 1 else 0.1
+        fps = max(1, int(round(speed / step)))
+        center = intersection_center(episode)
+        segments[path] = []
+        for start in range(0, len(times), segment_frames):
+            segment = os.path.join(segments_directory, '{0}-{1}.mp4'.format(len(jobs), start))
+            segments[path].append(segment)
+            jobs.append((episode, center, view, scale, start, start + segment_frames, segment, fps))
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        if pool is not None:
+            for _ in pool.imap_unordered(_render_segment_job, jobs):
+                pass
+        else:
+            for job in jobs:
+                _render_segment_job(job)
+        for path, paths in segments.items():
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            concat_videos(paths, path)
+            print('Video saved to {0}'.format(path), flush=True)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        shutil.rmtree(segments_directory, ignore_errors=True)
+    return list(segments)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Render recorded episodes into videos, without SUMO")
+    parser.add_argument('--emission', help="emission files, or their emission_columnar directories",
+                        nargs='+', default=[])
+    parser.add_argument('--result_store', help="result store directory to render tasks of", default=None)
+    parser.add_argument('--tasks', help="ids of the tasks of the result store to render", type=int, nargs='+',
+                        default=None)
+    parser.add_argument('--outcome', help="render the tasks of the result store with this outcome",
+                        choices=['collision', 'success', 'timeout'], default='collision')
+    parser.add_argument('--max_videos', help="maximum number of tasks to render", type=int, default=50)
+    parser.add_argument('--output', '-o', help="directory of the videos", default='videos')
+    parser.add_argument('--workers', '-w', help="number of rendering processes", type=int,
+                        default=os.cpu_count())
+    parser.add_argument('--view', help="meters shown around the intersection", type=float, default=60.0)
+    parser.add_argument('--scale', help="pixels per meter", type=float, default=4.0)
+    parser.add_argument('--speed', help="playback speed, relative to real time", type=float, default=1.0)
+    parser.add_argument('--segment_frames', help="frames rendered by each job", type=int, default=100)
+    return parser
+
+
+if __name__ == "__main__":
+    args = create_parser().parse_args()
+    episodes = {}
+    for path in args.emission:
+        name = os.path.basename(os.path.normpath(path))
+        name = name[:-len('.xml')] if name.endswith('.xml') else name
+        episodes[os.path.join(args.output, name + '.mp4')] = load_emission(path)
+    if args.result_store:
+        reader = ResultReader(args.result_store)
+        tasks = args.tasks
+        if tasks is None:
+            tasks = reader.select(args.outcome)[:args.max_videos]
+        for task in tasks:
+            episodes[os.path.join(args.output, 'task{0}.mp4'.format(task))] = load_task(reader, task)
+    render_episodes(episodes, args.workers, args.view, args.scale, args.speed, args.segment_frames)
@@ -0,0 +1,214 @@
+"""Parallel sweep of the controller parameters and the inflow probability.
+
+Runs the batch tasks of every configuration of a search space, a grid or
+random samples of it, in a process pool, and stops early the
+configurations whose collision rate is already clearly worse than the
+best one's. Every configuration runs the same task ids, whose seeds are
+derived from `--master_seed` (0 by default), so that they are compared on
+the same scenes. The batch run options apply to every task, except those
+of the batch loop itself: --result_store, --journal, --profile and
+--analysis_workers are rejected.
+
+    python param_sweep.py ttc --param ttc_threshold=3,3.5,4,4.5,5 --param inflow_probability=0.1,0.3
+    python param_sweep.py prm --search random --samples 20 --param t_c=4:8 --param d_s=40:70 -o
+"""
+import os
+import json
+import random
+import argparse
+import itertools
+from ast import literal_eval
+from collections import deque
+from multiprocessing import Pool, Value
+
+import batch_runner
+import ttc_single_journey
+import prm_single_journey
+
+EXPERIMENTS = {
+    'ttc': ttc_single_journey.cross_road_experiment,
+    'prm': prm_single_journey.cross_road_experiment,
+}
+# z of the two-sided 95% confidence intervals of the collision rates
+Z = 1.96
+
+
+def _value(text):
+    try:
+        return literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parse_param(text):
+    """Parse `name=v1,v2,...` into (name, [values]), or `name=low:high` into (name, (low, high))."""
+    name, _, values = text.partition('=')
+    if not name or not values:
+        raise argparse.ArgumentTypeError('Expected name=v1,v2,... or name=low:high, got \'{}\''.format(text))
+    if ':' in values:
+        low, high = values.split(':')
+        return name, (float(low), float(high))
+    return name, [_value(value) for value in values.split(',')]
+
+
+def grid_configs(space):
+    """Return every combination of the values of `space`, a dict of name to list of values."""
+    for name, values in space.items():
+        if isinstance(values, tuple):
+            raise ValueError('Range of \'{}\' can only be sampled, use --search random'.format(name))
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_configs(space, samples, rng=random):
+    """Return `samples` configurations drawn from `space`.
+
+    A list of values is sampled uniformly, a (low, high) range uniformly
+    between its bounds.
+    """
+    return [{name: rng.uniform(*values) if isinstance(values, tuple) else rng.choice(values)
+             for name, values in space.items()} for _ in range(samples)]
+
+
+def wilson_interval(count, tasks, z=Z):
+    """Return the Wilson score interval of a rate of `count` out of `tasks`."""
+    if tasks == 0:
+        return 0.0, 1.0
+    rate = count / tasks
+    center = (rate + z * z / (2 * tasks)) / (1 + z * z / tasks)
+    half_width = z / (1 + z * z / tasks) * (rate * (1 - rate) / tasks + z * z / (4 * tasks * tasks)) ** 0.5
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+class SweepConfig:
+    """A configuration of the sweep and the running aggregates of its tasks."""
+
+    def __init__(self, params):
+        self.params = params
+        self.stats = batch_runner.BatchStats()
+        self.stopped = False
+
+    def interval(self):
+        return wilson_interval(self.stats.collisions, self.stats.tasks)
+
+    def to_dict(self):
+        stats = self.stats
+        return {
+            'params': self.params,
+            'tasks': stats.tasks,
+            'collisions': stats.collisions,
+            'successes': stats.successes,
+            'collision_rate': stats.collisions / stats.tasks if stats.tasks else None,
+            'collision_interval': self.interval(),
+            'avg_duration': stats.sum_duration / stats.successes if stats.successes else None,
+            'avg_brake_time': stats.sum_brake_time / stats.successes if stats.successes else None,
+            'stopped': self.stopped,
+        }
+
+
+def early_stop(configs, min_tasks):
+    """Stop the configurations whose collision rate is clearly worse than the best one's.
+
+    Among the configurations with at least `min_tasks` results, the best
+    is the one with the lowest upper bound of the collision rate interval;
+    those whose lower bound lies above it are stopped. Returns the newly
+    stopped configurations.
+    """
+    ready = [config for config in configs if config.stats.tasks >= min_tasks]
+    if not ready:
+        return []
+    best_upper = min(config.interval()[1] for config in ready)
+    stopped = [config for config in ready if not config.stopped and config.interval()[0] > best_upper]
+    for config in stopped:
+        config.stopped = True
+    return stopped
+
+
+def _run_sweep_task(config_id, params, task):
+    controller_params = {name: value for name, value in params.items() if name != 'inflow_probability'}
+    kwargs = {'inflow_probability': params['inflow_probability']} if 'inflow_probability' in params else {}
+    _, _, result, _, _ = batch_runner.run_worker_task(task, controller_params=controller_params, **kwargs)
+    return config_id, result
+
+
+def sweep(controller, configs, args):
+    """Run `args.tasks` tasks of each of `configs` in a pool of `args.workers` processes.
+
+    The tasks are submitted task id by task id, across the configurations
+    still running, with at most two per worker in flight, so that all
+    configurations progress together and the tasks of a stopped one are
+    not submitted. Returns the SweepConfig of each configuration.
+    """
+    configs = [SweepConfig(params) for params in configs]
+    kept_logs = Value('i', 0)
+    pool = Pool(args.workers, initializer=batch_runner.init_worker,
+                initargs=(EXPERIMENTS[controller], args, kept_logs))
+    pending = deque()
+
+    def collect():
+        config_id, result = pending.popleft().get()
+        config = configs[config_id]
+        config.stats.add(result)
+        print('Config #{0} {1}: {2}'.format(config_id, config.params, config.stats), flush=True)
+        for stopped in early_stop(configs, args.min_tasks):
+            print('Config #{0} {1} stopped, collision rate interval {2}'
+                  .format(configs.index(stopped), stopped.params, stopped.interval()), flush=True)
+
+    try:
+        for task in range(args.tasks):
+            for config_id, config in enumerate(configs):
+                if config.stopped:
+                    continue
+                pending.append(pool.apply_async(_run_sweep_task, (config_id, config.params, task)))
+                while pending and (len(pending) >= 2 * args.workers or pending[0].ready()):
+                    collect()
+        while pending:
+            collect()
+    finally:
+        pool.terminate()
+    return configs
+
+
+def create_parser():
+    parser = batch_runner.create_parser("Parallel sweep of the controller parameters")
+    parser.add_argument('controller', help="controller to sweep", choices=sorted(EXPERIMENTS))
+    parser.add_argument('--param', help="swept parameter, name=v1,v2,... or name=low:high for random "
+                                        "search; inflow_probability or a controller parameter",
+                        type=parse_param, action='append', required=True)
+    parser.add_argument('--search', help="grid, or random samples of the space", choices=['grid', 'random'],
+                        default='grid')
+    parser.add_argument('--samples', help="configurations of a random search", type=int, default=20)
+    parser.add_argument('--tasks', help="tasks per configuration", type=int, default=200)
+    parser.add_argument('--min_tasks', help="tasks of a configuration before it can be stopped early",
+                        type=int, default=30)
+    parser.add_argument('--output', help="JSON file to save the results to", default='sweep.json')
+    parser.set_defaults(workers=os.cpu_count(), delete_all_xml=True, master_seed=0)
+    return parser
+
+
+def parse_args(parser, args=None):
+    """Parse the sweep options, rejecting the batch run options that the sweep does not implement."""
+    args = parser.parse_args(args)
+    for option, value in (('--result_store', args.result_store), ('--journal', args.journal),
+                          ('--profile', args.profile), ('--analysis_workers', args.analysis_workers)):
+        if value:
+            parser.error('{0} is not supported by the sweep'.format(option))
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args(create_parser())
+    space = dict(args.param)
+    if args.search == 'grid':
+        configs = grid_configs(space)
+    else:
+        configs = random_configs(space, args.samples)
+    results = sweep(args.controller, configs, args)
+
+    results.sort(key=lambda config: (config.stopped, config.interval()[1]))
+    for config in results:
+        low, high = config.interval()
+        print('{0} collision rate [{1:.4f}, {2:.4f}]{3} {4}'.format(
+            config.params, low, high, ' stopped' if config.stopped else '', config.stats))
+    with open(args.output, 'w') as f:
+        json.dump([config.to_dict() for config in results], f, indent=2)
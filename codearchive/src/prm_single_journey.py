@@ -1,60 +1,77 @@
 import os
-from random_state import load_random_state
+from random_state import load_random_state, sumo_seed
 from flow.core.params import SumoParams, EnvParams
 from flow.core.experiment import Experiment
 from flow.controllers import PRMController
 from ttc_env import CrossRoadAccelEnv, ADDITIONAL_ENV_PARAMS
 
 from cross_road_network import CrossRoadNetwork
+from network_cache import cached_net_params
 from sumo_parameters import get_net_params, get_initial_config, get_vehicle_params
 
 
-def cross_road_experiment(render=None):
-    """ Parameters & Returns: tutorials/tutorial05_networks.ipynb """
-    vehicles = get_vehicle_params(PRMController, {
-        "t_c": 6.0,
-        "d_s": 55.0,
-        "lambda_a": 1,
-        "r_go": 0.1,
-        "max_accel": 2.0,
-        "max_deaccel": 4.5,
-        "desire_v": 20.0,
-        "d_nudge": 10.0,
-        "discount": 0.2,
-        "debug": False,
-    })
+CONTROLLER_PARAMS = {
+    "t_c": 6.0,
+    "d_s": 55.0,
+    "lambda_a": 1,
+    "r_go": 0.1,
+    "max_accel": 2.0,
+    "max_deaccel": 4.5,
+    "desire_v": 20.0,
+    "d_nudge": 10.0,
+    "discount": 0.2,
+    "debug": False,
+}
+INFLOW_PROBABILITY = 0.3
+
+
+def cross_road_experiment(render=None, emission_path="./emission/", network_name="cross_road_network",
+                          env_options=None, simulator='traci', net_cache=False, seed=None,
+                          controller_params=None, inflow_probability=INFLOW_PROBABILITY):
+    """ Parameters & Returns: tutorials/tutorial05_networks.ipynb
+
+    `env_options` holds optional env parameters (see OPTIONAL_ENV_PARAMS),
+    `simulator='numpy'` runs the env on the NumPy surrogate,
+    `net_cache` reuses the cached netconvert output of the network, and
+    `seed` seeds SUMO's random number generator. `controller_params`
+    overrides some of the CONTROLLER_PARAMS of the av.
+    """
+    vehicles = get_vehicle_params(PRMController, dict(CONTROLLER_PARAMS, **(controller_params or {})))
 
     env_params = EnvParams(
         warmup_steps=150,
-        additional_params=ADDITIONAL_ENV_PARAMS,
+        additional_params=dict(ADDITIONAL_ENV_PARAMS, **(env_options or {})),
     )
-    net_params = get_net_params(inflow_probability=0.3)
+    net_params = get_net_params(inflow_probability=inflow_probability)
+    if net_cache:
+        cached_net_params(CrossRoadNetwork, net_params)
     sumo_params = SumoParams(
         render=True,
-        emission_path="./emission/",
-        summary_path="./emission/",
-        tripinfo_path="./emission/",
+        emission_path=emission_path,
+        summary_path=emission_path,
+        tripinfo_path=emission_path,
         sim_step=0.1,
-        restart_instance=True
+        restart_instance=True,
+        seed=seed
     )
     if render is not None:
         sumo_params.render = render
     initial_config = get_initial_config()
 
     network = CrossRoadNetwork(
-        name="cross_road_network",
+        name=network_name,
         vehicles=vehicles,
         net_params=net_params,
         initial_config=initial_config
     )
 
-    env = CrossRoadAccelEnv(env_params, sumo_params, network)
+    env = CrossRoadAccelEnv(env_params, sumo_params, network, simulator)
     return Experiment(env)
 
 
 if __name__ == "__main__":
     random_state = load_random_state()
-    exp = cross_road_experiment()
+    exp = cross_road_experiment(seed=sumo_seed(random_state))
     emission_location = os.path.join(exp.env.sim_params.emission_path, exp.env.network.name)
     print(emission_location + '-emission.xml')
     with open(emission_location + '-seed', "w") as seed_file:
@@ -1,12 +1,61 @@
 import random
+import hashlib
 from ast import literal_eval
+from collections import namedtuple
+
+import numpy as np
+
+
+class TaskSeeds(namedtuple('TaskSeeds', ['master_seed', 'task', 'python', 'numpy', 'sumo'])):
+    """Seeds of task `task` of a batch run with master seed `master_seed`.
+
+    Its string, as written to seed files, is just the `master_seed task`
+    pair the seeds are derived from.
+    """
+
+    def __str__(self):
+        return '{0} {1}'.format(self.master_seed, self.task)
+
+
+def derive_seeds(master_seed, task):
+    """Derive the python, numpy and SUMO seeds of `task` from `master_seed`.
+
+    The seeds are taken from a hash of the pair, so they are the same on
+    every platform and python version, and independent between tasks.
+    """
+    digest = hashlib.sha256('{0} {1}'.format(master_seed, task).encode('utf-8')).digest()
+    python_seed, numpy_seed, sumo_seed = (int.from_bytes(digest[i:i + 4], 'little') for i in (0, 4, 8))
+    # SUMO reads --seed as a signed int
+    return TaskSeeds(master_seed, task, python_seed, numpy_seed, sumo_seed & 0x7fffffff)
+
+
+def seed_task(master_seed, task):
+    """Seed python's random and numpy's global generator for `task`, return its TaskSeeds."""
+    seeds = derive_seeds(master_seed, task)
+    random.seed(seeds.python)
+    np.random.seed(seeds.numpy)
+    return seeds
+
+
+def sumo_seed(random_state):
+    """Return the SUMO seed of a load_random_state() result, None if it has none."""
+    return random_state.sumo if isinstance(random_state, TaskSeeds) else None
 
 
 def load_random_state(seed_file=None):
+    """Return the random state, restored from `seed_file` if given.
+
+    A seed file holds either the `master_seed task` pair of a task, which
+    is seeded again with seed_task and returned as TaskSeeds, or the full
+    random.getstate() tuple of python's random.
+    """
     if not seed_file:
         return random.getstate()
     with open(seed_file) as f:
         s = f.readline()
-        random_state_saved = literal_eval(s)
-        random.setstate(random_state_saved)
+    if not s.startswith('('):
+        master_seed, task = s.split()
+        return seed_task(int(master_seed), int(task))
+    random_state_saved = literal_eval(s)
+    random.setstate(random_state_saved)
     return random_state_saved
@@ -0,0 +1,162 @@
+"""Chunked columnar store of the task results of batch runs."""
+import os
+import glob
+
+import numpy as np
+
+from random_state import TaskSeeds, derive_seeds
+
+# python's random.getstate() of a Mersenne Twister: 624 state words plus
+# the position in the state
+RANDOM_STATE_WORDS = 625
+
+TASK_DTYPE = np.dtype([
+    ('task', 'i8'),
+    ('has_collision', '?'),
+    ('is_success', '?'),
+    ('duration', 'f8'),
+    ('brake_time', 'f8'),
+    ('random_state', 'u4', (RANDOM_STATE_WORDS,)),
+    ('gauss_next', 'f8'),
+    ('master_seed', 'i8'),
+])
+
+TRAJECTORY_DTYPE = np.dtype([
+    ('task', 'i8'),
+    ('time', 'f4'),
+    ('vehicle', 'S24'),
+    ('x', 'f4'),
+    ('y', 'f4'),
+    ('speed', 'f4'),
+])
+
+OUTCOMES = ('collision', 'success', 'timeout')
+
+
+def _chunk_path(directory, chunk):
+    return os.path.join(directory, 'chunk-{0:05d}.npz'.format(chunk))
+
+
+class ResultStore:
+    """Append task results to chunked NPZ files in `directory`.
+
+    Each task is a record of TASK_DTYPE holding its metrics and the python
+    random state, or the (non-negative) master seed, it ran with, and any
+    number of TRAJECTORY_DTYPE rows of downsampled vehicle trajectory. Records are buffered and written every
+    `chunk_size` tasks as one compressed `chunk-<n>.npz`, with the task
+    records and the trajectory rows in separate arrays, so that reading
+    the index never decompresses trajectories. Writing to a directory that
+    already holds chunks appends new ones after them.
+    """
+
+    def __init__(self, directory, chunk_size=1000):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+        self.chunk = len(glob.glob(os.path.join(directory, 'chunk-*.npz')))
+        self.tasks = []
+        self.trajectories = []
+
+    def add(self, task, result, random_state, trajectory=()):
+        """Buffer the result of `task`.
+
+        `random_state` is the random.getstate() or the TaskSeeds the task
+        ran with, and `trajectory` an iterable of (time, id, x, y, speed)
+        rows.
+        """
+        if isinstance(random_state, TaskSeeds):
+            words, gauss_next, master_seed = 0, None, random_state.master_seed
+        else:
+            (version, words, gauss_next), master_seed = random_state, -1
+        self.tasks.append((task, result.has_collision, result.is_success,
+                           np.nan if result.duration is None else result.duration,
+                           result.brake_time, words,
+                           np.nan if gauss_next is None else gauss_next, master_seed))
+        self.trajectories.append(np.array([(task, ) + tuple(row) for row in trajectory],
+                                          dtype=TRAJECTORY_DTYPE))
+        if len(self.tasks) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.tasks:
+            return
+        path = _chunk_path(self.directory, self.chunk)
+        # a hidden name outside the chunk-*.npz pattern, so that a chunk cut
+        # short by a kill is never counted or read as one
+        tmp_path = os.path.join(self.directory, '.tmp-' + os.path.basename(path))
+        np.savez_compressed(tmp_path,
+                            tasks=np.array(self.tasks, dtype=TASK_DTYPE),
+                            trajectory=np.concatenate(self.trajectories))
+        os.replace(tmp_path, path)
+        self.chunk += 1
+        self.tasks = []
+        self.trajectories = []
+
+    def close(self):
+        self.flush()
+
+
+class ResultReader:
+    """Index of the tasks of a ResultStore directory, by task id and outcome.
+
+    `tasks` holds the records of all chunks, sorted by task id; the
+    trajectories are only read from the chunk of the task asked for.
+    """
+
+    def __init__(self, directory):
+        self.paths = sorted(glob.glob(os.path.join(directory, 'chunk-*.npz')))
+        tasks = []
+        chunks = []
+        for chunk, path in enumerate(self.paths):
+            with np.load(path) as data:
+                tasks.append(data['tasks'])
+            chunks.append(np.full(len(tasks[-1]), chunk))
+        tasks = np.concatenate(tasks) if tasks else np.zeros(0, dtype=TASK_DTYPE)
+        chunks = np.concatenate(chunks) if chunks else np.zeros(0, dtype=int)
+        order = np.argsort(tasks['task'], kind='stable')
+        self.tasks = tasks[order]
+        self.chunks = chunks[order]
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def outcomes(self):
+        """Return the outcome of each record of `tasks`, one of OUTCOMES."""
+        outcome = np.full(len(self.tasks), 'timeout', dtype='U9')
+        outcome[self.tasks['is_success']] = 'success'
+        outcome[self.tasks['has_collision']] = 'collision'
+        return outcome
+
+    def select(self, outcome):
+        """Return the ids of the tasks of `outcome`, one of OUTCOMES."""
+        if outcome not in OUTCOMES:
+            raise ValueError('Unknown outcome \'{}\''.format(outcome))
+        return self.tasks['task'][self.outcomes() == outcome]
+
+    def _position(self, task):
+        i = np.searchsorted(self.tasks['task'], task)
+        if i == len(self.tasks) or self.tasks['task'][i] != task:
+            raise KeyError('Task {} not in the store'.format(task))
+        return i
+
+    def record(self, task):
+        return self.tasks[self._position(task)]
+
+    def random_state(self, task):
+        """Return the random.getstate() tuple or the TaskSeeds `task` ran with."""
+        record = self.record(task)
+        if record['master_seed'] >= 0:
+            return derive_seeds(int(record['master_seed']), task)
+        gauss_next = None if np.isnan(record['gauss_next']) else float(record['gauss_next'])
+        return 3, tuple(int(word) for word in record['random_state']), gauss_next
+
+    def write_seed_file(self, task, path):
+        """Write the random state of `task` to a seed file for load_random_state."""
+        with open(path, 'w') as seed_file:
+            seed_file.write(self.random_state(task).__str__())
+
+    def trajectory(self, task):
+        """Return the TRAJECTORY_DTYPE rows of `task`."""
+        with np.load(self.paths[self.chunks[self._position(task)]]) as data:
+            trajectory = data['trajectory']
+        return trajectory[trajectory['task'] == task]
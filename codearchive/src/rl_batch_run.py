@@ -16,8 +16,9 @@ import argparse
 import gym
 import numpy as np
 import os
-import time
 import sys
+from copy import copy
+from collections import deque, namedtuple
 
 import ray
 try:
@@ -30,7 +31,9 @@ from flow.utils.registry import make_create_env
 from flow.utils.rllib import get_flow_params
 from flow.utils.rllib import get_rllib_config
 from flow.utils.rllib import get_rllib_pkl
-import xml_analyzer
+import sparse_obs_model  # registers the model of the sparse observations
+from batch_runner import BatchStats, analyze_outputs
+from batch_journal import BatchJournal
 
 
 EXAMPLE_USAGE = """
@@ -40,171 +43,176 @@ example usage:
 Here the arguments are:
 1 - the path to the simulation results
 2 - the number of the checkpoint
+
+or, to evaluate several checkpoints in parallel:
+    python ./rl_batch_run.py --result_dir /ray_results/experiment_dir/result_dir \
+        --checkpoints 5 10 15 --num_rollouts 100 --num_actors 8
 """
 
 
-def visualizer_rllib(args):
-    """Visualizer for RLlib experiments.
+RolloutResult = namedtuple('RolloutResult', ['emission_location', 'reward', 'mean_speed', 'std_speed',
+                                             'outflow', 'inflow', 'metrics'])
+
 
-    This function takes args (see function create_parser below for
-    more detailed information on what information can be fed to this
-    visualizer), and renders the experiment associated with it.
+class RolloutEvaluator:
+    """Evaluator for RLlib experiments.
+
+    The config, agent and env of the checkpoint given by args (see function
+    create_parser below for more detailed information on what information
+    can be fed to this evaluator) are loaded once, and `rollout` then runs
+    one episode with them at each call. Call `close` to terminate the env
+    and release the Ray resources of the agent.
     """
-    result_dir = args.result_dir if args.result_dir[-1] != '/' \
-        else args.result_dir[:-1]
-
-    config = get_rllib_config(result_dir)
-
-    # check if we have a multiagent environment but in a
-    # backwards compatible way
-    if config.get('multiagent', {}).get('policies', None):
-        multiagent = True
-        pkl = get_rllib_pkl(result_dir)
-        config['multiagent'] = pkl['multiagent']
-    else:
-        multiagent = False
-
-    # Run on only one cpu for rendering purposes
-    config['num_workers'] = 0
-
-    flow_params = get_flow_params(config)
-
-    # hack for old pkl files
-    # TODO(ev) remove eventually
-    sim_params = flow_params['sim']
-    setattr(sim_params, 'num_clients', 1)
-
-    # Determine agent and checkpoint
-    config_run = config['env_config']['run'] if 'run' in config['env_config'] \
-        else None
-    if args.run and config_run:
-        if args.run != config_run:
-            print('visualizer_rllib.py: error: run argument '
-                  + '\'{}\' passed in '.format(args.run)
-                  + 'differs from the one stored in params.json '
-                  + '\'{}\''.format(config_run))
+
+    def __init__(self, args):
+        self.args = args
+        result_dir = args.result_dir if args.result_dir[-1] != '/' \
+            else args.result_dir[:-1]
+        self.result_dir = result_dir
+
+        config = get_rllib_config(result_dir)
+
+        # check if we have a multiagent environment but in a
+        # backwards compatible way
+        if config.get('multiagent', {}).get('policies', None):
+            self.multiagent = True
+            pkl = get_rllib_pkl(result_dir)
+            config['multiagent'] = pkl['multiagent']
+        else:
+            self.multiagent = False
+        self.config = config
+
+        # Run on only one cpu for rendering purposes
+        config['num_workers'] = 0
+
+        flow_params = get_flow_params(config)
+
+        # hack for old pkl files
+        # TODO(ev) remove eventually
+        sim_params = flow_params['sim']
+        setattr(sim_params, 'num_clients', 1)
+
+        # Determine agent and checkpoint
+        config_run = config['env_config']['run'] if 'run' in config['env_config'] \
+            else None
+        if args.run and config_run:
+            if args.run != config_run:
+                print('visualizer_rllib.py: error: run argument '
+                      + '\'{}\' passed in '.format(args.run)
+                      + 'differs from the one stored in params.json '
+                      + '\'{}\''.format(config_run))
+                sys.exit(1)
+        if args.run:
+            agent_cls = get_agent_class(args.run)
+        elif config_run:
+            agent_cls = get_agent_class(config_run)
+        else:
+            print('visualizer_rllib.py: error: could not find flow parameter '
+                  '\'run\' in params.json, '
+                  'add argument --run to provide the algorithm or model used '
+                  'to train the results\n e.g. '
+                  'python ./visualizer_rllib.py /tmp/ray/result_dir 1 --run PPO')
             sys.exit(1)
-    if args.run:
-        agent_cls = get_agent_class(args.run)
-    elif config_run:
-        agent_cls = get_agent_class(config_run)
-    else:
-        print('visualizer_rllib.py: error: could not find flow parameter '
-              '\'run\' in params.json, '
-              'add argument --run to provide the algorithm or model used '
-              'to train the results\n e.g. '
-              'python ./visualizer_rllib.py /tmp/ray/result_dir 1 --run PPO')
-        sys.exit(1)
-
-    sim_params.restart_instance = True
-    dir_path = os.path.dirname(os.path.realpath(__file__))
-    emission_path = '{0}/emission/'.format(dir_path)
-    sim_params.emission_path = emission_path if args.gen_emission else None
-    sim_params.summary_path = emission_path if args.gen_emission else None
-    sim_params.tripinfo_path = emission_path if args.gen_emission else None
-
-    # pick your rendering mode
-    if args.render_mode == 'sumo_web3d':
-        sim_params.num_clients = 2
-        sim_params.render = False
-    elif args.render_mode == 'drgb':
-        sim_params.render = 'drgb'
-        sim_params.pxpm = 4
-    elif args.render_mode == 'sumo_gui':
-        sim_params.render = False  # will be set to True below
-    elif args.render_mode == 'no_render':
-        sim_params.render = False
-    if args.save_render:
-        if args.render_mode != 'sumo_gui':
+
+        sim_params.restart_instance = True
+        dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.emission_path = '{0}/emission/'.format(dir_path)
+        sim_params.emission_path = self.emission_path if args.gen_emission else None
+        sim_params.summary_path = self.emission_path if args.gen_emission else None
+        sim_params.tripinfo_path = self.emission_path if args.gen_emission else None
+
+        # pick your rendering mode
+        if args.render_mode == 'sumo_web3d':
+            sim_params.num_clients = 2
+            sim_params.render = False
+        elif args.render_mode == 'drgb':
             sim_params.render = 'drgb'
             sim_params.pxpm = 4
-        sim_params.save_render = True
-
-    # Create and register a gym+rllib env
-    create_env, env_name = make_create_env(params=flow_params, version=0)
-    register_env(env_name, create_env)
-
-    # check if the environment is a single or multiagent environment, and
-    # get the right address accordingly
-    # single_agent_envs = [env for env in dir(flow.envs)
-    #                      if not env.startswith('__')]
-
-    # if flow_params['env_name'] in single_agent_envs:
-    #     env_loc = 'flow.envs'
-    # else:
-    #     env_loc = 'flow.envs.multiagent'
-
-    # Start the environment with the gui turned on and a path for the
-    # emission file
-    env_params = flow_params['env']
-    env_params.restart_instance = False
-    if args.evaluate:
-        env_params.evaluate = True
-
-    # lower the horizon if testing
-    if args.horizon:
-        config['horizon'] = args.horizon
-        env_params.horizon = args.horizon
-
-    # create the agent that will be used to compute the actions
-    agent = agent_cls(env=env_name, config=config)
-    checkpoint = result_dir + '/checkpoint_' + args.checkpoint_num
-    checkpoint = checkpoint + '/checkpoint-' + args.checkpoint_num
-    agent.restore(checkpoint)
-
-    if hasattr(agent, "local_evaluator") and \
-            os.environ.get("TEST_FLAG") != 'True':
-        env = agent.local_evaluator.env
-    else:
-        env = gym.make(env_name)
-
-    if args.render_mode == 'sumo_gui':
-        env.sim_params.render = True  # set to True after initializing agent and env
-
-    if multiagent:
-        rets = {}
-        # map the agent id to its policy
-        policy_map_fn = config['multiagent']['policy_mapping_fn'].func
-        for key in config['multiagent']['policies'].keys():
-            rets[key] = []
-    else:
-        rets = []
-
-    if config['model']['use_lstm']:
-        use_lstm = True
-        if multiagent:
-            state_init = {}
-            # map the agent id to its policy
-            policy_map_fn = config['multiagent']['policy_mapping_fn'].func
-            size = config['model']['lstm_cell_size']
-            for key in config['multiagent']['policies'].keys():
-                state_init[key] = [np.zeros(size, np.float32),
-                                   np.zeros(size, np.float32)]
+        elif args.render_mode == 'sumo_gui':
+            sim_params.render = False  # will be set to True below
+        elif args.render_mode == 'no_render':
+            sim_params.render = False
+        if args.save_render:
+            if args.render_mode != 'sumo_gui':
+                sim_params.render = 'drgb'
+                sim_params.pxpm = 4
+            sim_params.save_render = True
+
+        # Create and register a gym+rllib env
+        create_env, env_name = make_create_env(params=flow_params, version=0)
+        register_env(env_name, create_env)
+
+        # Start the environment with the gui turned on and a path for the
+        # emission file
+        env_params = flow_params['env']
+        env_params.restart_instance = False
+        if args.evaluate:
+            env_params.evaluate = True
+
+        # lower the horizon if testing
+        if args.horizon:
+            config['horizon'] = args.horizon
+            env_params.horizon = args.horizon
+        self.env_params = env_params
+
+        # create the agent that will be used to compute the actions
+        self.agent = agent_cls(env=env_name, config=config)
+        self.restore(args.checkpoint_num)
+
+        if hasattr(self.agent, "local_evaluator") and \
+                os.environ.get("TEST_FLAG") != 'True':
+            self.env = self.agent.local_evaluator.env
         else:
-            state_init = [
-                np.zeros(config['model']['lstm_cell_size'], np.float32),
-                np.zeros(config['model']['lstm_cell_size'], np.float32)
-            ]
-    else:
-        use_lstm = False
-
-    # if restart_instance, don't restart here because env.reset will restart later
-    if not sim_params.restart_instance:
-        env.restart_simulation(sim_params=sim_params, render=sim_params.render)
-
-    # Simulate and collect metrics
-    final_outflows = []
-    final_inflows = []
-    mean_speed = []
-    std_speed = []
-    for i in range(args.num_rollouts):
+            self.env = gym.make(env_name)
+
+        if args.render_mode == 'sumo_gui':
+            self.env.sim_params.render = True  # set to True after initializing agent and env
+
+        if self.multiagent:
+            # map the agent id to its policy
+            self.policy_map_fn = config['multiagent']['policy_mapping_fn'].func
+
+        self.use_lstm = config['model']['use_lstm']
+
+        # if restart_instance, don't restart here because env.reset will restart later
+        if not sim_params.restart_instance:
+            self.env.restart_simulation(sim_params=sim_params, render=sim_params.render)
+
+    def restore(self, checkpoint_num):
+        """Load the weights of checkpoint `checkpoint_num` of the result dir into the agent."""
+        checkpoint = self.result_dir + '/checkpoint_' + checkpoint_num
+        checkpoint = checkpoint + '/checkpoint-' + checkpoint_num
+        self.agent.restore(checkpoint)
+        self.checkpoint_num = checkpoint_num
+
+    def _state_init(self):
+        size = self.config['model']['lstm_cell_size']
+        if self.multiagent:
+            return {key: [np.zeros(size, np.float32), np.zeros(size, np.float32)]
+                    for key in self.config['multiagent']['policies'].keys()}
+        return [np.zeros(size, np.float32), np.zeros(size, np.float32)]
+
+    def rollout(self):
+        """Simulate one episode and return its RolloutResult.
+
+        With `args.gen_emission` SUMO is closed at the end of the episode,
+        so that its output files are complete, and the metrics are
+        analyzed from them; otherwise they are read from the env. The
+        simulation restarts at the next reset.
+        """
+        agent = self.agent
+        env = self.env
+        multiagent = self.multiagent
+        use_lstm = self.use_lstm
+        state_init = self._state_init() if use_lstm else None
+
         vel = []
         state = env.reset()
         if multiagent:
-            ret = {key: [0] for key in rets.keys()}
+            ret = {key: [0] for key in self.config['multiagent']['policies'].keys()}
         else:
             ret = 0
-        for _ in range(env_params.horizon):
+        for _ in range(self.env_params.horizon):
             vehicles = env.unwrapped.k.vehicle
             vel.append(np.mean(vehicles.get_speed(vehicles.get_ids())))
             if multiagent:
@@ -214,16 +222,16 @@ def visualizer_rllib(args):
                         action[agent_id], state_init[agent_id], logits = \
                             agent.compute_action(
                             state[agent_id], state=state_init[agent_id],
-                            policy_id=policy_map_fn(agent_id))
+                            policy_id=self.policy_map_fn(agent_id))
                     else:
                         action[agent_id] = agent.compute_action(
-                            state[agent_id], policy_id=policy_map_fn(agent_id))
+                            state[agent_id], policy_id=self.policy_map_fn(agent_id))
             else:
                 action = agent.compute_action(state)
             state, reward, done, _ = env.step(action)
             if multiagent:
                 for actor, rew in reward.items():
-                    ret[policy_map_fn(actor)][0] += rew
+                    ret[self.policy_map_fn(actor)][0] += rew
             else:
                 ret += reward
             if multiagent and done['__all__']:
@@ -231,22 +239,113 @@ def visualizer_rllib(args):
             if not multiagent and done:
                 break
 
-        if multiagent:
-            for key in rets.keys():
-                rets[key].append(ret[key])
-        else:
-            rets.append(ret)
         outflow = vehicles.get_outflow_rate(500)
-        final_outflows.append(outflow)
         inflow = vehicles.get_inflow_rate(500)
-        final_inflows.append(inflow)
-        mean_speed.append(np.mean(vel))
-        std_speed.append(np.std(vel))
+        emission_location = os.path.join(self.emission_path, env.network.name)
+        if self.args.gen_emission:
+            # SUMO completes its output files when it closes
+            env.unwrapped.k.close()
+            metrics = analyze_outputs(env.unwrapped, emission_location)
+        else:
+            metrics = env.unwrapped.episode_result
+        return RolloutResult(emission_location, ret, np.mean(vel), np.std(vel), outflow, inflow, metrics)
+
+    def close(self):
+        # terminate the environment
+        self.env.unwrapped.terminate()
+        self.agent.stop()
+
+
+@ray.remote
+class EvaluatorActor:
+    """Ray actor holding one RolloutEvaluator, i.e. one env and policy replica."""
+
+    def __init__(self, args):
+        self.evaluator = RolloutEvaluator(args)
+
+    def rollout(self, checkpoint_num):
+        """Run one episode with the policy of `checkpoint_num` and return its metrics."""
+        if checkpoint_num != self.evaluator.checkpoint_num:
+            self.evaluator.restore(checkpoint_num)
+        return self.evaluator.rollout().metrics
 
-    # terminate the environment
-    env.unwrapped.terminate()
+    def close(self):
+        self.evaluator.close()
 
-    emission_location = os.path.join(emission_path, env.network.name)
+
+def checkpoint_nums(result_dir):
+    """Return the numbers of all checkpoints saved in `result_dir`, in order."""
+    return sorted((name[len('checkpoint_'):] for name in os.listdir(result_dir)
+                   if name.startswith('checkpoint_')), key=int)
+
+
+def evaluate_checkpoints(args, checkpoints, journal=None):
+    """Run `args.num_rollouts` rollouts of each checkpoint on `args.num_actors` actors.
+
+    The actors share a queue of rollouts ordered by checkpoint, so each
+    actor only restores the weights of a checkpoint when its next rollout
+    belongs to another one; the agent and env are built once per actor.
+    Results are streamed back as rollouts finish, and the running
+    aggregates of the checkpoint are printed after each. The metrics are
+    collected online, since the actors would otherwise share emission file
+    names. With a BatchJournal `journal`, rollout `i` of checkpoint `c` is
+    recorded there as task `'c/i'`, and the rollouts it already holds are
+    counted without being run again.
+
+    Returns
+    -------
+    dict
+        the BatchStats of each checkpoint number
+    """
+    stats = {checkpoint: BatchStats() for checkpoint in checkpoints}
+    pending = deque()
+    for checkpoint in checkpoints:
+        for i in range(args.num_rollouts):
+            task = '{0}/{1}'.format(checkpoint, i)
+            if journal is not None and task in journal:
+                stats[checkpoint].add(journal.results[task])
+            else:
+                pending.append((checkpoint, task))
+    if not pending:
+        return stats
+    actor_args = copy(args)
+    actor_args.checkpoint_num = checkpoints[0]
+    actor_args.gen_emission = False
+    actors = [EvaluatorActor.remote(actor_args) for _ in range(min(args.num_actors, len(pending)))]
+
+    running = {}
+    for actor in actors:
+        checkpoint, task = pending.popleft()
+        running[actor.rollout.remote(checkpoint)] = actor, checkpoint, task
+    try:
+        while running:
+            ready, _ = ray.wait(list(running), num_returns=1)
+            actor, checkpoint, task = running.pop(ready[0])
+            result = ray.get(ready[0])
+            stats[checkpoint].add(result)
+            if journal is not None:
+                journal.append(task, result)
+            print('Checkpoint {0}: {1}'.format(checkpoint, stats[checkpoint]), flush=True)
+            if pending:
+                checkpoint, task = pending.popleft()
+                running[actor.rollout.remote(checkpoint)] = actor, checkpoint, task
+    finally:
+        ray.get([actor.close.remote() for actor in actors])
+    return stats
+
+
+def visualizer_rllib(args):
+    """Visualizer for RLlib experiments.
+
+    Runs `args.num_rollouts` rollouts with a RolloutEvaluator and returns the
+    emission location of the last one.
+    """
+    evaluator = RolloutEvaluator(args)
+    try:
+        for i in range(args.num_rollouts):
+            emission_location = evaluator.rollout().emission_location
+    finally:
+        evaluator.close()
     return emission_location
 
 
@@ -302,63 +401,82 @@ def create_parser():
         '--horizon',
         type=int,
         help='Specifies the horizon.')
+    parser.add_argument(
+        '--checkpoints',
+        type=str,
+        nargs='+',
+        help='Evaluates these checkpoint numbers of the result dir in '
+             'parallel, num_rollouts each, or all of them with \'all\'.')
+    parser.add_argument(
+        '--num_actors',
+        type=int,
+        default=1,
+        help='The number of Ray actors running rollouts with --checkpoints.')
+    parser.add_argument(
+        '--journal',
+        type=str,
+        help='Appends the result of every rollout to this journal file, '
+             'and resumes the interrupted run it records.')
     return parser
 
 
 if __name__ == '__main__':
     parser = create_parser()
     args = parser.parse_args()
-    args.result_dir = "/path/to/ray_results/xxx_training/XXX_CrossRoadRLAccelEnv-xxxxx"
-    args.checkpoint_num = "100"
-    args.horizon = 600
+    args.result_dir = args.result_dir or "/path/to/ray_results/xxx_training/XXX_CrossRoadRLAccelEnv-xxxxx"
+    args.checkpoint_num = args.checkpoint_num or "100"
+    args.horizon = args.horizon or 600
     args.render_mode = "no_render"
     args.gen_emission = True
+
+    if args.checkpoints:
+        ray.init(num_cpus=args.num_actors)
+        checkpoints = args.checkpoints
+        if checkpoints == ['all']:
+            checkpoints = checkpoint_nums(args.result_dir)
+        journal = BatchJournal(args.journal) if args.journal else None
+        results = evaluate_checkpoints(args, checkpoints, journal)
+        if journal is not None:
+            journal.close()
+        for checkpoint in checkpoints:
+            print('Checkpoint {0}: {1}'.format(checkpoint, results[checkpoint]), flush=True)
+        sys.exit(0)
+
     ray.init(num_cpus=1)
 
     location_file = './emission/fail_runs'
     log_file = './batch_run.log'
-    collisions = 0
-    successes = 0
-    sum_brake_time = 0
-    sum_duration = 0
+    stats = BatchStats()
     success_log = 0
-    with open(log_file, 'w') as f_log:
-        pass
+    tasks = range(100)
+    journal = BatchJournal(args.journal) if args.journal else None
+    if journal is not None:
+        for task in tasks:
+            if task in journal:
+                stats.add(journal.results[task])
+        tasks = [task for task in tasks if task not in journal]
+    if not stats.tasks:
+        with open(log_file, 'w') as f_log:
+            pass
 
-    for task in range(100):
-        emission_location = visualizer_rllib(args)
+    evaluator = RolloutEvaluator(args)
+    for task in tasks:
+        rollout = evaluator.rollout()
+        emission_location = rollout.emission_location
         print('Task #{0}, emission location {1}'
               .format(task + 1, emission_location), flush=True)
-        retry = 0
-        time_to_retry = 0.1
-        while True:
-            try:
-                has_collision = xml_analyzer.has_collision(emission_location + '-summary.xml')
-                duration = xml_analyzer.get_duration(emission_location + '-tripinfo.xml')
-                is_success = duration is not None
-                brake_time = xml_analyzer.avg_brake_time(emission_location + '-emission.xml')
-            except Exception as e:
-                time.sleep(time_to_retry)
-                retry += 1
-                print('parse error, retry {0}'.format(retry), flush=True)
-                time_to_retry *= 2
-                if retry > 10:
-                    raise e
-                continue
-            break
+        result = rollout.metrics
+        stats.add(result)
+        if journal is not None:
+            journal.append(task, result)
+        has_collision = result.has_collision
         if has_collision:
-            is_success = False
-            collisions += 1
             try:
                 with open(location_file, 'a') as f:
                     f.write(emission_location)
                     f.write('\n')
             except Exception as e:
                 print(e, flush=True)
-        if is_success:
-            successes += 1
-            sum_brake_time += brake_time
-            sum_duration += duration
         try:
             if args.delete_all_xml or \
                     (args.delete_uncollision_xml and not has_collision) or \
@@ -372,13 +490,7 @@ if __name__ == '__main__':
         except Exception:
             pass
 
-        to_print = 'Task #{0}, success rate {1}%, collision rate {2}%, avg duration {3}, avg brake time {4}'.format(
-            task + 1,
-            successes * 100.0 / (task + 1),
-            collisions * 100.0 / (task + 1),
-            "NAN" if successes == 0 else sum_duration / successes,
-            "NAN" if successes == 0 else sum_brake_time / successes
-        )
+        to_print = str(stats)
         print(to_print, flush=True)
         try:
             with open(log_file, 'a') as f_log:
@@ -386,3 +498,6 @@ if __name__ == '__main__':
                 f_log.write('\n')
         except Exception as e:
             print(e, flush=True)
+    evaluator.close()
+    if journal is not None:
+        journal.close()
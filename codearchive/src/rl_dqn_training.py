@@ -2,7 +2,11 @@ import platform
 from cross_road_network import CrossRoadNetwork
 from flow.core.params import SumoParams, EnvParams
 from flow.controllers import RLController
-from rl_env import CrossRoadRLAccelEnv, ADDITIONAL_ENV_PARAMS
+from rl_env import CrossRoadRLAccelEnv, ADDITIONAL_ENV_PARAMS, OPTIONAL_ENV_PARAMS
+from vec_env import CrossRoadVecEnv
+from network_cache import cached_net_params
+from sparse_obs_model import SPARSE_GRID_MODEL
+from obs_codec import compact_replay_trainer
 import json
 
 import ray
@@ -19,16 +23,27 @@ from sumo_parameters import get_net_params, get_initial_config, get_vehicle_para
 if __name__ == "__main__":
     network_name = CrossRoadNetwork
     name = "dqn_training"
+    # read the network from the netconvert output cache instead of
+    # regenerating it at every SUMO restart, see network_cache.py
+    NET_CACHE = False
     net_params = get_net_params(inflow_probability=0.3)
+    if NET_CACHE:
+        cached_net_params(CrossRoadNetwork, net_params)
     initial_config = get_initial_config()
     vehicles = get_vehicle_params(RLController, {}, True)
 
     sumo_params = SumoParams(render=False, sim_step=0.1, restart_instance=True)
     HORIZON = 600
+    # episodes restored from the post-warmup state before restarting SUMO,
+    # 0 restarts SUMO for every episode
+    WARM_STATE_EPISODES = 0
+    # 'sparse' observations only list the occupied cells of the grid, which
+    # the model turns back into the grid, see sparse_obs_model.py
+    OBS_MODE = 'dense'
     env_params = EnvParams(
         horizon=HORIZON,
         warmup_steps=150,
-        additional_params=ADDITIONAL_ENV_PARAMS,
+        additional_params=dict(ADDITIONAL_ENV_PARAMS, warm_state_episodes=WARM_STATE_EPISODES, obs_mode=OBS_MODE),
     )
     env_name = CrossRoadRLAccelEnv
     flow_params = dict(
@@ -46,6 +61,8 @@ if __name__ == "__main__":
     flow_params_for_test['veh'] = get_vehicle_params(RLController, {}, False)
 
     N_CPUS = 2
+    # envs stepped in lockstep by each rollout worker, see vec_env.py
+    N_ENVS_PER_WORKER = 1
 
     N_ROLLOUTS = 20
 
@@ -59,6 +76,8 @@ if __name__ == "__main__":
     config["train_batch_size"] = HORIZON * N_ROLLOUTS
     config["gamma"] = 0.999
     config["horizon"] = HORIZON
+    if OBS_MODE == 'sparse':
+        config["model"]["custom_model"] = SPARSE_GRID_MODEL
     # config["log_level"] = "DEBUG"
 
     # DQN Specific Configs
@@ -67,6 +86,10 @@ if __name__ == "__main__":
     config["prioritized_replay"] = True
     config["lr"] = 0.001
     config["buffer_size"] = 500000
+    # dtype the replay buffer stores the observations in: 'float32', or the
+    # lossy 'float16' and 'uint8', see obs_codec.py; None keeps rllib's
+    # float64 buffers
+    REPLAY_OBS_CODEC = 'float32'
 
     # save the flow params for replay
     flow_json = json.dumps(flow_params_for_test, cls=FlowParamsEncoder, sort_keys=True,
@@ -79,11 +102,18 @@ if __name__ == "__main__":
     create_env, gym_name = make_create_env(params=flow_params, version=0)
 
     # Register as rllib env with Gym
-    register_env(gym_name, create_env)
+    if N_ENVS_PER_WORKER > 1:
+        register_env(gym_name, lambda env_config: CrossRoadVecEnv(flow_params, N_ENVS_PER_WORKER))
+    else:
+        register_env(gym_name, create_env)
+
+    max_cells = OPTIONAL_ENV_PARAMS['max_cells'] if OBS_MODE == 'sparse' else 0
+    trainer = DQNTrainer if REPLAY_OBS_CODEC is None else \
+        compact_replay_trainer(DQNTrainer, REPLAY_OBS_CODEC, max_cells)
 
     trials = run_experiments({
         flow_params["exp_tag"]: {
-            "run": alg_run,
+            "run": trainer,
             "env": gym_name,
             "config": {
                 **config
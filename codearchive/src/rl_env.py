@@ -9,12 +9,22 @@ from gym.spaces.box import Box
 
 import numpy as np
 
+from episode_metrics import EpisodeMetrics
+from vehicle_snapshot import VehicleSnapshot
+import surrogate_sim
+from warm_state import WarmState
+from step_profiler import StepProfiler
+import batched_controllers
+
 RL_ACCEL = [-4.0, -2.0, 0.0, 2.0]
 X_OBSERVE_METER = 80
 Y_OBSERVE_METER = 20
 X_PIXEL = 20
 Y_PIXEL = 10
 INF = 1E20
+# values of a cell of the sparse observation: valid flag, x and y indices in
+# the grid, then the five channels of the dense grid
+SPARSE_CELL_SIZE = 8
 
 ADDITIONAL_ENV_PARAMS = {
     'max_accel': 2.5,
@@ -27,10 +37,51 @@ ADDITIONAL_ENV_PARAMS = {
     'low_speed_threshold': 1.0,
 }
 
+# parameters that may be left out of env_params.additional_params
+OPTIONAL_ENV_PARAMS = {
+    # read vehicle state from a per-step VehicleSnapshot
+    'use_snapshot': False,
+    # reuse a simulation state saved after warmup for this many episodes
+    # before restarting SUMO, see warm_state.WarmState
+    'warm_state_episodes': 0,
+    # record the vehicle trajectories in the episode metrics every this
+    # many steps, see episode_metrics.EpisodeMetrics
+    'trajectory_every': 0,
+    # time the phases of step and reset, see step_profiler.StepProfiler
+    'profile_steps': False,
+    # evaluate the controllers of the controlled vehicles class by class on
+    # arrays, see batched_controllers.get_actions
+    'batch_controllers': False,
+    # 'dense' grid observation, or 'sparse' list of the occupied cells of
+    # the grid padded to 'max_cells' cells, see CrossRoadRLAccelEnv.get_state
+    'obs_mode': 'dense',
+    'max_cells': 32,
+}
+
+
+def densify_observation(obs):
+    """Return the dense observation of a sparse one, or of a batch of them stacked on the first axis."""
+    obs = np.asarray(obs)
+    batch_shape = obs.shape[:-1]
+    obs = obs.reshape((-1, obs.shape[-1]))
+    cells = obs[:, :-3].reshape((len(obs), -1, SPARSE_CELL_SIZE))
+    dense = np.zeros((len(obs), X_PIXEL * Y_PIXEL, 5), dtype=obs.dtype)
+    dense[:, :, 4] = 1
+    sample, cell = np.nonzero(cells[:, :, 0])
+    index = (cells[sample, cell, 1] * Y_PIXEL + cells[sample, cell, 2]).astype(int)
+    dense[sample, index] = cells[sample, cell, 3:]
+    dense = np.concatenate([dense.reshape((len(obs), -1)), obs[:, -3:]], axis=1)
+    return dense.reshape(batch_shape + dense.shape[-1:])
+
 
 class CrossRoadRLAccelEnv(Env):
 
     def __init__(self, env_params, sim_params, network, simulator='traci'):
+        """See parent class.
+
+        With `simulator='numpy'` the env runs on the NumPy surrogate of
+        surrogate_sim instead of SUMO.
+        """
         for p in ADDITIONAL_ENV_PARAMS.keys():
             if p not in env_params.additional_params:
                 raise KeyError(
@@ -39,14 +90,42 @@ class CrossRoadRLAccelEnv(Env):
         self.continuous_low_speed = 0
         self.prev_pos = dict()
         self.absolute_position = dict()
-        if sim_params.emission_path is not None:
+        self.metrics = EpisodeMetrics(sim_params.sim_step, env_params.additional_params.get(
+            'trajectory_every', OPTIONAL_ENV_PARAMS['trajectory_every']))
+        self.obs_mode = env_params.additional_params.get('obs_mode', OPTIONAL_ENV_PARAMS['obs_mode'])
+        if self.obs_mode == 'sparse':
+            self.max_cells = env_params.additional_params.get('max_cells', OPTIONAL_ENV_PARAMS['max_cells'])
+            self.obs_buffer = np.empty(self.max_cells * SPARSE_CELL_SIZE + 3)
+        elif self.obs_mode == 'dense':
+            self.obs_buffer = np.empty(X_PIXEL * Y_PIXEL * 5 + 3)
+        else:
+            raise ValueError('Unknown observation mode \'{}\''.format(self.obs_mode))
+        self.snapshot = None
+        if env_params.additional_params.get('use_snapshot', OPTIONAL_ENV_PARAMS['use_snapshot']):
+            self.snapshot = VehicleSnapshot()
+        self.colored_ids = set()
+        self.profiler = StepProfiler(env_params.additional_params.get(
+            'profile_steps', OPTIONAL_ENV_PARAMS['profile_steps']))
+        self.batch_controllers = env_params.additional_params.get(
+            'batch_controllers', OPTIONAL_ENV_PARAMS['batch_controllers'])
+        self.warm_state = None
+        warm_state_episodes = env_params.additional_params.get(
+            'warm_state_episodes', OPTIONAL_ENV_PARAMS['warm_state_episodes'])
+        if warm_state_episodes > 0 and simulator != surrogate_sim.SIMULATOR:
+            self.warm_state = WarmState(warm_state_episodes)
+        # VideoEncoder the rendered frames are written to, if any
+        self.video_encoder = None
+        if sim_params.emission_path is not None and getattr(sim_params, 'save_render', False):
             self.path = sim_params.emission_path
             if self.path[-1] != '/':
                 self.path += '/'
             self.path += 'pics'
             ensure_dir(self.path)
 
-        super().__init__(env_params, sim_params, network, simulator)
+        if simulator == surrogate_sim.SIMULATOR:
+            surrogate_sim.init_env(self, env_params, sim_params, network)
+        else:
+            super().__init__(env_params, sim_params, network, simulator)
 
     @property
     def action_space(self):
@@ -59,7 +138,7 @@ class CrossRoadRLAccelEnv(Env):
         return Box(
             low=-INF,
             high=INF,
-            shape=(X_PIXEL * Y_PIXEL * 5 + 3, ),
+            shape=self.obs_buffer.shape,
             dtype=np.float32)
 
     def _apply_rl_actions(self, rl_chose):
@@ -86,12 +165,27 @@ class CrossRoadRLAccelEnv(Env):
         return -np.exp(min(self.continuous_low_speed * np.log(penalty_base), 20.0))
 
     def get_state(self):
-        """See class definition."""
-        velocity_cos = np.zeros((X_PIXEL, Y_PIXEL))
-        velocity_sin = np.zeros((X_PIXEL, Y_PIXEL))
-        ttc = np.ones((X_PIXEL, Y_PIXEL))
-        velocity_real = np.zeros((X_PIXEL, Y_PIXEL))
-        heading_angle = np.zeros((X_PIXEL, Y_PIXEL))
+        """See class definition.
+
+        The observation is a (X_PIXEL, Y_PIXEL, 5) grid around the rl vehicle,
+        holding per cell velocity cos/sin, speed, heading and ttc, flattened
+        and followed by the rl vehicle's velocity cos/sin and the global ttc.
+        It is filled in place in a buffer reused between calls.
+
+        With the 'sparse' obs_mode, the grid is replaced by `max_cells` rows
+        of SPARSE_CELL_SIZE values, one per occupied cell: a valid flag of
+        1, the x and y indices of the cell and its five channels; the other
+        rows are zero. When more cells are occupied, those of lowest ttc are
+        kept. densify_observation turns it back into the dense observation.
+        """
+        obs = self.obs_buffer
+        sparse = self.obs_mode == 'sparse'
+        if sparse:
+            obs[:-3] = 0
+        else:
+            grid = obs[:X_PIXEL * Y_PIXEL * 5].reshape((X_PIXEL, Y_PIXEL, 5))
+            grid[:, :, :4] = 0
+            grid[:, :, 4] = 1
         global_ttc = 1.0
         len_rl_ids = len(self.k.vehicle.get_rl_ids())
         ori_rl = (0., 0., 0.)
@@ -105,42 +199,78 @@ class CrossRoadRLAccelEnv(Env):
             )
         else: # len_rl_ids == 1
             rl_id = self.k.vehicle.get_rl_ids()[0]
-            ori_rl = self.k.vehicle.get_orientation(rl_id)
-            speed_rl = self.k.vehicle.get_speed(rl_id)
+            if self.snapshot is not None:
+                ori_rl = self.snapshot.orientation[self.snapshot.index[rl_id]]
+                speed_rl = self.snapshot.speed[self.snapshot.index[rl_id]]
+            else:
+                ori_rl = self.k.vehicle.get_orientation(rl_id)
+                speed_rl = self.k.vehicle.get_speed(rl_id)
             if speed_rl < self.env_params.additional_params['low_speed_threshold']:
                 self.continuous_low_speed += 1
             else:
                 self.continuous_low_speed = 0
-            for veh_id in self.k.vehicle.get_ids():
-                if veh_id != rl_id:
-                    ori_veh = self.k.vehicle.get_orientation(veh_id)
-                    speed_veh = self.k.vehicle.get_speed(veh_id)
-                    x_diff = int(np.floor((ori_veh[0] - ori_rl[0] + 1.20) / X_OBSERVE_METER * X_PIXEL + X_PIXEL / 2))
-                    y_diff = int(np.floor((ori_veh[1] - ori_rl[1] + 1.20) / Y_OBSERVE_METER * Y_PIXEL))
-                    if x_diff < 0 or x_diff >= X_PIXEL or y_diff < 0 or y_diff >= Y_PIXEL:
-                        continue
-                    velocity = speed_veh / self.k.network.max_speed()
-                    angle = ori_veh[2] / 180.0 * np.pi
-                    velocity_real[x_diff, y_diff] = max(velocity_real[x_diff, y_diff], velocity)
-                    velocity_cos[x_diff, y_diff] = velocity * np.cos(angle)
-                    velocity_sin[x_diff, y_diff] = velocity * np.sin(angle)
-                    heading_angle[x_diff, y_diff] = ori_veh[2] / 360.0
-                    calc_ttc = min(car_ttc(ori_rl, ori_veh, speed_rl, speed_veh), 20) / 20
-                    ttc[x_diff, y_diff] = min(ttc[x_diff, y_diff], calc_ttc)
-                    global_ttc = min(global_ttc, calc_ttc)
-        velocity_cos = np.reshape(velocity_cos, (X_PIXEL, Y_PIXEL, 1))
-        velocity_sin = np.reshape(velocity_sin, (X_PIXEL, Y_PIXEL, 1))
-        velocity_real = np.reshape(velocity_real, (X_PIXEL, Y_PIXEL, 1))
-        heading_angle = np.reshape(heading_angle, (X_PIXEL, Y_PIXEL, 1))
-        ttc = np.reshape(ttc, (X_PIXEL, Y_PIXEL, 1))
-        ret = np.concatenate([velocity_cos, velocity_sin, velocity_real, heading_angle, ttc], axis=2)
-        ret = np.reshape(ret, (X_PIXEL * Y_PIXEL * 5, ))
+            if self.snapshot is not None:
+                others = np.arange(len(self.snapshot.ids)) != self.snapshot.index[rl_id]
+                ori = self.snapshot.orientation[others]
+                speed_veh = self.snapshot.speed[others]
+            else:
+                veh_ids = [veh_id for veh_id in self.k.vehicle.get_ids() if veh_id != rl_id]
+                ori = np.array([self.k.vehicle.get_orientation(veh_id) for veh_id in veh_ids],
+                               dtype=float).reshape((-1, 3))
+                speed_veh = np.array([self.k.vehicle.get_speed(veh_id) for veh_id in veh_ids], dtype=float)
+            if len(ori) > 0:
+                x_diff = np.floor((ori[:, 0] - ori_rl[0] + 1.20) / X_OBSERVE_METER * X_PIXEL + X_PIXEL / 2).astype(int)
+                y_diff = np.floor((ori[:, 1] - ori_rl[1] + 1.20) / Y_OBSERVE_METER * Y_PIXEL).astype(int)
+                visible = np.flatnonzero((x_diff >= 0) & (x_diff < X_PIXEL) & (y_diff >= 0) & (y_diff < Y_PIXEL))
+                if len(visible) > 0:
+                    x_diff = x_diff[visible]
+                    y_diff = y_diff[visible]
+                    velocity = speed_veh[visible] / self.k.network.max_speed()
+                    angle = ori[visible, 2] / 180.0 * np.pi
+                    calc_ttc = np.array([car_ttc(ori_rl, ori[i], speed_rl, speed_veh[i]) for i in visible])
+                    calc_ttc = np.minimum(calc_ttc, 20) / 20
+                    if sparse:
+                        self._fill_sparse_cells(obs[:-3].reshape((self.max_cells, SPARSE_CELL_SIZE)), x_diff, y_diff,
+                                                velocity, angle, ori[visible, 2] / 360.0, calc_ttc)
+                    else:
+                        # plain assignment keeps the last vehicle of a cell, as
+                        # max/min reductions do for the speed and ttc channels
+                        grid[x_diff, y_diff, 0] = velocity * np.cos(angle)
+                        grid[x_diff, y_diff, 1] = velocity * np.sin(angle)
+                        np.maximum.at(grid[:, :, 2], (x_diff, y_diff), velocity)
+                        grid[x_diff, y_diff, 3] = ori[visible, 2] / 360.0
+                        np.minimum.at(grid[:, :, 4], (x_diff, y_diff), calc_ttc)
+                    global_ttc = min(global_ttc, calc_ttc.min())
         velocity = speed_rl / self.k.network.max_speed()
         angle = ori_rl[2] / 180.0 * np.pi
-        ret = np.append(ret, velocity * np.cos(angle))
-        ret = np.append(ret, velocity * np.sin(angle))
-        ret = np.append(ret, global_ttc)
-        return ret
+        obs[-3] = velocity * np.cos(angle)
+        obs[-2] = velocity * np.sin(angle)
+        obs[-1] = global_ttc
+        return obs
+
+    def _fill_sparse_cells(self, cells, x_diff, y_diff, velocity, angle, heading, ttc):
+        """Fill the rows of the occupied cells of the sparse observation, as get_state fills the grid."""
+        index = x_diff * Y_PIXEL + y_diff
+        # the first occurrence in reverse order is the last vehicle of a cell
+        occupied, first_reversed = np.unique(index[::-1], return_index=True)
+        last = len(index) - 1 - first_reversed
+        inverse = np.searchsorted(occupied, index)
+        speed = np.zeros(len(occupied))
+        np.maximum.at(speed, inverse, velocity)
+        cell_ttc = np.ones(len(occupied))
+        np.minimum.at(cell_ttc, inverse, ttc)
+        if len(occupied) > self.max_cells:
+            keep = np.sort(np.argsort(cell_ttc, kind='stable')[:self.max_cells])
+            occupied, last, speed, cell_ttc = occupied[keep], last[keep], speed[keep], cell_ttc[keep]
+        rows = cells[:len(occupied)]
+        rows[:, 0] = 1
+        rows[:, 1] = occupied // Y_PIXEL
+        rows[:, 2] = occupied % Y_PIXEL
+        rows[:, 3] = velocity[last] * np.cos(angle[last])
+        rows[:, 4] = velocity[last] * np.sin(angle[last])
+        rows[:, 5] = speed
+        rows[:, 6] = heading[last]
+        rows[:, 7] = cell_ttc
 
     def additional_command(self):
         """See parent class.
@@ -148,6 +278,10 @@ class CrossRoadRLAccelEnv(Env):
         Define which vehicles are observed for visualization purposes, and
         update the sorting of vehicles using the self.sorted_ids variable.
         """
+        if self.snapshot is not None:
+            self._snapshot_additional_command()
+            return
+
         for veh_id in self.k.vehicle.get_ids():
             if self.k.vehicle.get_type(veh_id) == "av":
                 self.k.vehicle.set_color(veh_id, color=(255, 0, 0))
@@ -155,16 +289,34 @@ class CrossRoadRLAccelEnv(Env):
         # update the "absolute_position" variable
         for veh_id in self.k.vehicle.get_ids():
             this_pos = self.k.vehicle.get_x_by_id(veh_id)
+            self._update_absolute_position(veh_id, this_pos)
 
-            if this_pos == -1001:
-                # in case the vehicle isn't in the network
-                self.absolute_position[veh_id] = -1001
-            else:
-                change = this_pos - self.prev_pos.get(veh_id, this_pos)
-                self.absolute_position[veh_id] = \
-                    (self.absolute_position.get(veh_id, this_pos) + change) \
-                    % self.k.network.length()
-                self.prev_pos[veh_id] = this_pos
+    def _snapshot_additional_command(self):
+        """Perform additional_command reading vehicle state from the snapshot.
+
+        Without rendering the colors are never reset, so each av is colored
+        once instead of sending a TraCI command for it at every step.
+        """
+        snapshot = self.snapshot
+        for veh_id, veh_type in zip(snapshot.ids, snapshot.types):
+            if veh_type == "av" and (self.sim_params.render or veh_id not in self.colored_ids):
+                self.k.vehicle.set_color(veh_id, color=(255, 0, 0))
+                self.colored_ids.add(veh_id)
+
+        for veh_id, this_pos in zip(snapshot.ids, snapshot.x):
+            self._update_absolute_position(veh_id, this_pos)
+
+    def _update_absolute_position(self, veh_id, this_pos):
+        """Update the "absolute_position" variable of a vehicle."""
+        if this_pos == -1001:
+            # in case the vehicle isn't in the network
+            self.absolute_position[veh_id] = -1001
+        else:
+            change = this_pos - self.prev_pos.get(veh_id, this_pos)
+            self.absolute_position[veh_id] = \
+                (self.absolute_position.get(veh_id, this_pos) + change) \
+                % self.k.network.length()
+            self.prev_pos[veh_id] = this_pos
 
     @property
     def sorted_ids(self):
@@ -187,74 +339,106 @@ class CrossRoadRLAccelEnv(Env):
         """Return the absolute position of a vehicle."""
         return self.absolute_position.get(veh_id, -1001)
 
+    @property
+    def episode_result(self):
+        """Return the metrics of the current episode as an AnalysisResult.
+
+        These match what xml_analyzer.analyze computes from the output files,
+        but are collected while simulating.
+        """
+        return self.metrics.result()
+
     def step(self, rl_actions):
         """Advance the environment by one step. """
         crash = False
         passed = False
+        profiler = self.profiler
         for _ in range(self.env_params.sims_per_step):
             self.time_counter += 1
             self.step_counter += 1
 
             # perform acceleration actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_ids()) > 0:
-                accel = []
-                for veh_id in self.k.vehicle.get_controlled_ids():
-                    action = self.k.vehicle.get_acc_controller(
-                        veh_id).get_action(self)
-                    accel.append(action)
-                self.k.vehicle.apply_acceleration(
-                    self.k.vehicle.get_controlled_ids(), accel)
+            with profiler.phase('controllers'):
+                if len(self.k.vehicle.get_controlled_ids()) > 0:
+                    if self.batch_controllers:
+                        accel = batched_controllers.get_actions(self, self.k.vehicle.get_controlled_ids())
+                    else:
+                        accel = []
+                        for veh_id in self.k.vehicle.get_controlled_ids():
+                            action = self.k.vehicle.get_acc_controller(
+                                veh_id).get_action(self)
+                            accel.append(action)
+                    self.k.vehicle.apply_acceleration(
+                        self.k.vehicle.get_controlled_ids(), accel)
 
             # perform lane change actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
-                direction = []
-                for veh_id in self.k.vehicle.get_controlled_lc_ids():
-                    target_lane = self.k.vehicle.get_lane_changing_controller(
-                        veh_id).get_action(self)
-                    direction.append(target_lane)
-                self.k.vehicle.apply_lane_change(
-                    self.k.vehicle.get_controlled_lc_ids(),
-                    direction=direction)
+            with profiler.phase('lane_change'):
+                if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
+                    direction = []
+                    for veh_id in self.k.vehicle.get_controlled_lc_ids():
+                        target_lane = self.k.vehicle.get_lane_changing_controller(
+                            veh_id).get_action(self)
+                        direction.append(target_lane)
+                    self.k.vehicle.apply_lane_change(
+                        self.k.vehicle.get_controlled_lc_ids(),
+                        direction=direction)
 
             # perform (optionally) routing actions for all vehicles in the
             # network, including RL and SUMO-controlled vehicles
-            routing_ids = []
-            routing_actions = []
-            for veh_id in self.k.vehicle.get_ids():
-                if self.k.vehicle.get_routing_controller(veh_id) \
-                        is not None:
-                    routing_ids.append(veh_id)
-                    route_contr = self.k.vehicle.get_routing_controller(
-                        veh_id)
-                    routing_actions.append(route_contr.choose_route(self))
+            with profiler.phase('routing'):
+                routing_ids = []
+                routing_actions = []
+                for veh_id in self.k.vehicle.get_ids():
+                    if self.k.vehicle.get_routing_controller(veh_id) \
+                            is not None:
+                        routing_ids.append(veh_id)
+                        route_contr = self.k.vehicle.get_routing_controller(
+                            veh_id)
+                        routing_actions.append(route_contr.choose_route(self))
 
-            self.k.vehicle.choose_routes(routing_ids, routing_actions)
+                self.k.vehicle.choose_routes(routing_ids, routing_actions)
 
-            self.apply_rl_actions(rl_actions)
+            with profiler.phase('apply_rl_actions'):
+                self.apply_rl_actions(rl_actions)
 
-            self.additional_command()
+            with profiler.phase('additional_command'):
+                self.additional_command()
 
             # advance the simulation in the simulator by one step
-            self.k.simulation.simulation_step()
+            with profiler.phase('simulation_step'):
+                self.k.simulation.simulation_step()
 
             # store new observations in the vehicles and traffic lights class
-            self.k.update(reset=False)
+            with profiler.phase('kernel_update'):
+                self.k.update(reset=False)
+                if self.snapshot is not None:
+                    self.snapshot.update(self.k.vehicle)
 
             # update the colors of vehicles
-            if self.sim_params.render:
-                self.k.vehicle.update_vehicle_colors()
+            with profiler.phase('vehicle_colors'):
+                if self.sim_params.render:
+                    self.k.vehicle.update_vehicle_colors()
 
             # crash encodes whether the simulator experienced a collision
-            crash = self.k.simulation.check_collision()
+            with profiler.phase('check_collision'):
+                crash = self.k.simulation.check_collision()
+
+            # accumulate the success/collision/duration/brake time metrics
+            with profiler.phase('metrics'):
+                self.metrics.update(self, crash)
 
             # stop collecting new simulation steps if there is a collision
             if crash:
                 break
 
             # render a frame
-            self.render()
+            with profiler.phase('render'):
+                self.render()
+                if self.video_encoder is not None:
+                    self.video_encoder.write(self.frame)
 
-        states = self.get_state()
+        with profiler.phase('get_state'):
+            states = self.get_state()
 
         # collect information of the state of the network based on the
         # environment class used
@@ -268,10 +452,13 @@ class CrossRoadRLAccelEnv(Env):
         done = (self.time_counter >= self.env_params.warmup_steps +
                 self.env_params.horizon)  # or crash
 
-        count_av = 0
-        for i in self.k.vehicle.get_ids():
-            if self.k.vehicle.get_type(i) == "av":
-                count_av += 1
+        if self.snapshot is not None:
+            count_av = self.snapshot.count_type("av")
+        else:
+            count_av = 0
+            for i in self.k.vehicle.get_ids():
+                if self.k.vehicle.get_type(i) == "av":
+                    count_av += 1
         if self.step_counter >= self.env_params.warmup_steps + 10 and count_av == 0:
             passed = True
             done = True    # No Reinforcement Learning Vehicles, stop
@@ -280,11 +467,12 @@ class CrossRoadRLAccelEnv(Env):
         infos = {}
 
         # compute the reward
-        if self.env_params.clip_actions:
-            rl_clipped = self.clip_actions(rl_actions)
-            reward = self.compute_reward(rl_clipped, fail=crash, passed=passed)
-        else:
-            reward = self.compute_reward(rl_actions, fail=crash, passed=passed)
+        with profiler.phase('compute_reward'):
+            if self.env_params.clip_actions:
+                rl_clipped = self.clip_actions(rl_actions)
+                reward = self.compute_reward(rl_clipped, fail=crash, passed=passed)
+            else:
+                reward = self.compute_reward(rl_actions, fail=crash, passed=passed)
 
         return next_observation, reward, done, infos
 
@@ -294,7 +482,24 @@ class CrossRoadRLAccelEnv(Env):
         This also includes updating the initial absolute position and previous
         position.
         """
-        obs = super().reset()
+        self.metrics.reset()
+        self.colored_ids.clear()
+        # the warmup steps of the reset read the snapshot before the first
+        # kernel update, so the vehicles of the previous episode must go
+        if self.snapshot is not None:
+            self.snapshot.clear()
+        self.profiler.start_episode()
+        with self.profiler.phase('reset'):
+            if self.simulator == surrogate_sim.SIMULATOR:
+                obs = surrogate_sim.reset_env(self)
+            elif self.warm_state is not None and self.warm_state.ready():
+                obs = self.warm_state.restore(self)
+            else:
+                obs = super().reset()
+                if self.warm_state is not None:
+                    self.warm_state.save(self)
+        if self.snapshot is not None:
+            self.snapshot.update(self.k.vehicle)
 
         self.continuous_low_speed = 0
         for veh_id in self.k.vehicle.get_ids():
@@ -302,3 +507,9 @@ class CrossRoadRLAccelEnv(Env):
             self.prev_pos[veh_id] = self.k.vehicle.get_x_by_id(veh_id)
 
         return obs
+
+    def terminate(self):
+        """See parent class."""
+        if self.warm_state is not None:
+            self.warm_state.close()
+        super().terminate()
@@ -30,6 +30,8 @@ from flow.utils.rllib import get_flow_params
 from flow.utils.rllib import get_rllib_config
 from flow.utils.rllib import get_rllib_pkl
 from random_state import load_random_state
+import sparse_obs_model  # registers the model of the sparse observations
+from video_encoder import VideoEncoder
 
 
 EXAMPLE_USAGE = """
@@ -103,6 +105,8 @@ def visualizer_rllib(args):
     sim_params.tripinfo_path = emission_path if args.gen_emission else None
 
     # pick your rendering mode
+    if args.render_mode is None:
+        args.render_mode = 'drgb' if args.save_render else 'sumo_gui'
     if args.render_mode == 'sumo_web3d':
         sim_params.num_clients = 2
         sim_params.render = False
@@ -113,11 +117,14 @@ def visualizer_rllib(args):
         sim_params.render = False  # will be set to True below
     elif args.render_mode == 'no_render':
         sim_params.render = False
+    # with pyglet rendering the frames are piped into a VideoEncoder instead
+    # of being saved one by one; sumo-gui saves its own screenshots
+    stream_video = args.save_render and args.render_mode != 'sumo_gui'
     if args.save_render:
         if args.render_mode != 'sumo_gui':
             sim_params.render = 'drgb'
             sim_params.pxpm = 4
-        sim_params.save_render = True
+        sim_params.save_render = not stream_video
 
     # Create and register a gym+rllib env
     create_env, env_name = make_create_env(params=flow_params, version=0)
@@ -160,6 +167,11 @@ def visualizer_rllib(args):
     if args.render_mode == 'sumo_gui':
         env.sim_params.render = True  # set to True after initializing agent and env
 
+    if stream_video:
+        video_path = args.video or os.path.join(dir_path, 'video', '{0}.mp4'.format(env.network.name))
+        os.makedirs(os.path.dirname(os.path.abspath(video_path)), exist_ok=True)
+        env.unwrapped.video_encoder = VideoEncoder(video_path, fps=args.video_fps)
+
     if multiagent:
         rets = {}
         # map the agent id to its policy
@@ -245,6 +257,10 @@ def visualizer_rllib(args):
     # terminate the environment
     env.unwrapped.terminate()
 
+    if stream_video:
+        env.unwrapped.video_encoder.close()
+        print('Video saved to {0}, {1} frames'.format(video_path, env.unwrapped.video_encoder.frames))
+
     emission_location = os.path.join(emission_path, env.network.name)
     return emission_location
 
@@ -289,14 +305,27 @@ def create_parser():
     parser.add_argument(
         '--render_mode',
         type=str,
-        default='sumo_gui',
+        default=None,
         help='Pick the render mode. Options include sumo_web3d, '
-             'rgbd and sumo_gui')
+             'drgb, no_render and sumo_gui. Defaults to drgb with '
+             '--save_render, whose frames are streamed into a video, '
+             'and to sumo_gui otherwise.')
     parser.add_argument(
         '--save_render',
         action='store_true',
         help='Saves a rendered video to a file. NOTE: Overrides render_mode '
              'with pyglet rendering.')
+    parser.add_argument(
+        '--video',
+        type=str,
+        default=None,
+        help='Video file the frames of --save_render are encoded to with '
+             'pyglet rendering, video/<network>.mp4 by default.')
+    parser.add_argument(
+        '--video_fps',
+        type=int,
+        default=10,
+        help='Frame rate of the video.')
     parser.add_argument(
         '--horizon',
         type=int,
@@ -310,7 +339,6 @@ if __name__ == '__main__':
     args.result_dir = "/path/to/ray_results/xxx_training/XXX_CrossRoadRLAccelEnv-xxxxx"
     args.checkpoint_num = "100"
     args.horizon = 600
-    args.render_mode = "sumo_gui"
     args.save_render = True
     args.gen_emission = True
     ray.init(num_cpus=1)
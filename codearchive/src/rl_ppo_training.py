@@ -3,6 +3,9 @@ from cross_road_network import CrossRoadNetwork
 from flow.core.params import SumoParams, EnvParams
 from flow.controllers import RLController
 from rl_env import CrossRoadRLAccelEnv, ADDITIONAL_ENV_PARAMS
+from vec_env import CrossRoadVecEnv
+from network_cache import cached_net_params
+from sparse_obs_model import SPARSE_GRID_MODEL
 import json
 
 import ray
@@ -19,16 +22,27 @@ from sumo_parameters import get_net_params, get_initial_config, get_vehicle_para
 if __name__ == "__main__":
     network_name = CrossRoadNetwork
     name = "ppo_training"
+    # read the network from the netconvert output cache instead of
+    # regenerating it at every SUMO restart, see network_cache.py
+    NET_CACHE = False
     net_params = get_net_params(inflow_probability=0.3)
+    if NET_CACHE:
+        cached_net_params(CrossRoadNetwork, net_params)
     initial_config = get_initial_config()
     vehicles = get_vehicle_params(RLController, {}, True)
 
     sumo_params = SumoParams(render=False, sim_step=0.1, restart_instance=True)
     HORIZON = 600
+    # episodes restored from the post-warmup state before restarting SUMO,
+    # 0 restarts SUMO for every episode
+    WARM_STATE_EPISODES = 0
+    # 'sparse' observations only list the occupied cells of the grid, which
+    # the model turns back into the grid, see sparse_obs_model.py
+    OBS_MODE = 'dense'
     env_params = EnvParams(
         horizon=HORIZON,
         warmup_steps=150,
-        additional_params=ADDITIONAL_ENV_PARAMS,
+        additional_params=dict(ADDITIONAL_ENV_PARAMS, warm_state_episodes=WARM_STATE_EPISODES, obs_mode=OBS_MODE),
     )
     env_name = CrossRoadRLAccelEnv
     flow_params = dict(
@@ -46,6 +60,8 @@ if __name__ == "__main__":
     flow_params_for_test['veh'] = get_vehicle_params(RLController, {}, False)
 
     N_CPUS = 2
+    # envs stepped in lockstep by each rollout worker, see vec_env.py
+    N_ENVS_PER_WORKER = 1
     N_ROLLOUTS = 20
 
     ray.init(num_cpus=N_CPUS)
@@ -58,6 +74,8 @@ if __name__ == "__main__":
     config["train_batch_size"] = HORIZON * N_ROLLOUTS
     config["gamma"] = 0.999
     config["horizon"] = HORIZON
+    if OBS_MODE == 'sparse':
+        config["model"]["custom_model"] = SPARSE_GRID_MODEL
     # config["log_level"] = "DEBUG"
 
     # PPO Specific Configs
@@ -84,7 +102,10 @@ if __name__ == "__main__":
     create_env, gym_name = make_create_env(params=flow_params, version=0)
 
     # Register as rllib env with Gym
-    register_env(gym_name, create_env)
+    if N_ENVS_PER_WORKER > 1:
+        register_env(gym_name, lambda env_config: CrossRoadVecEnv(flow_params, N_ENVS_PER_WORKER))
+    else:
+        register_env(gym_name, create_env)
 
     trials = run_experiments({
         flow_params["exp_tag"]: {
@@ -26,12 +26,13 @@ except ImportError:
     from ray.rllib.agents.registry import get_agent_class
 from ray.tune.registry import register_env
 
-from flow.core.util import emission_to_csv
 from flow.utils.registry import make_create_env
 from flow.utils.rllib import get_flow_params
 from flow.utils.rllib import get_rllib_config
 from flow.utils.rllib import get_rllib_pkl
 from random_state import load_random_state
+import sparse_obs_model  # registers the model of the sparse observations
+import emission_columnar
 
 
 EXAMPLE_USAGE = """
@@ -305,12 +306,11 @@ def visualizer_rllib(args):
         emission_path = \
             '{0}/test_time_rollout/{1}'.format(dir_path, emission_filename)
 
-        # convert the emission file into a csv file
-        emission_to_csv(emission_path)
+        # convert the emission file into memory-mappable columns
+        emission_columnar_path = emission_columnar.convert(emission_path)
 
-        # print the location of the emission csv file
-        emission_path_csv = emission_path[:-4] + ".csv"
-        print("\nGenerated emission file at " + emission_path_csv)
+        # print the location of the emission columns
+        print("\nGenerated emission columns at " + emission_columnar_path)
 
         # delete the .xml version of the emission file
         os.remove(emission_path)
@@ -31,6 +31,7 @@ from flow.utils.rllib import get_flow_params
 from flow.utils.rllib import get_rllib_config
 from flow.utils.rllib import get_rllib_pkl
 from random_state import load_random_state
+import sparse_obs_model  # registers the model of the sparse observations
 import xml_analyzer
 
 
@@ -331,10 +332,7 @@ if __name__ == '__main__':
     time_to_retry = 0.1
     while True:
         try:
-            has_collision = xml_analyzer.has_collision(emission_location + '-summary.xml')
-            duration = xml_analyzer.get_duration(emission_location + '-tripinfo.xml')
-            is_success = duration is not None
-            brake_time = xml_analyzer.avg_brake_time(emission_location + '-emission.xml')
+            result = xml_analyzer.analyze(emission_location)
         except Exception as e:
             time.sleep(time_to_retry)
             retry += 1
@@ -345,8 +343,7 @@ if __name__ == '__main__':
             continue
         break
 
-    if has_collision:
-        is_success = False
+    has_collision, is_success, duration, brake_time = result
 
     print_file = None
     to_print = ""
@@ -0,0 +1,57 @@
+"""RLlib model taking the sparse observations of CrossRoadRLAccelEnv."""
+import numpy as np
+
+from gym.spaces.box import Box
+from ray.rllib.models import ModelCatalog
+from ray.rllib.models.tf.tf_modelv2 import TFModelV2
+from ray.rllib.models.tf.fcnet_v2 import FullyConnectedNetwork
+from ray.rllib.utils import try_import_tf
+
+from rl_env import X_PIXEL, Y_PIXEL, INF, SPARSE_CELL_SIZE
+
+tf = try_import_tf()
+
+# name to set as config['model']['custom_model']
+SPARSE_GRID_MODEL = 'sparse_grid'
+
+
+def densify(obs, max_cells):
+    """Return the dense observations of a batch of sparse ones, in the graph; see rl_env.densify_observation."""
+    cells = tf.reshape(obs[:, :-3], [-1, max_cells, SPARSE_CELL_SIZE])
+    index = tf.cast(cells[:, :, 1] * Y_PIXEL + cells[:, :, 2], tf.int32)
+    # (batch, cell, grid) one-hot positions of the valid cells
+    scatter = tf.one_hot(index, X_PIXEL * Y_PIXEL) * cells[:, :, :1]
+    grid = tf.matmul(scatter, cells[:, :, 3:], transpose_a=True)
+    # the ttc channel of the empty cells is 1
+    empty = 1 - tf.reduce_sum(scatter, axis=1)
+    grid += tf.expand_dims(empty, -1) * tf.constant([0, 0, 0, 0, 1], dtype=grid.dtype)
+    return tf.concat([tf.reshape(grid, [-1, X_PIXEL * Y_PIXEL * 5]), obs[:, -3:]], axis=1)
+
+
+class SparseGridModel(TFModelV2):
+    """Fully connected network over the dense grid rebuilt from the sparse observation.
+
+    The grid is only materialized inside the model, so the rollouts, the
+    sample batches and the replay buffers carry the sparse observations,
+    while the network and its options ('fcnet_hiddens', ...) are those of
+    the default model of the dense observation.
+    """
+
+    def __init__(self, obs_space, action_space, num_outputs, model_config, name):
+        super().__init__(obs_space, action_space, num_outputs, model_config, name)
+        self.max_cells = (int(np.prod(obs_space.shape)) - 3) // SPARSE_CELL_SIZE
+        dense_space = Box(low=-INF, high=INF, shape=(X_PIXEL * Y_PIXEL * 5 + 3, ), dtype=np.float32)
+        self.dense_model = FullyConnectedNetwork(dense_space, action_space, num_outputs, model_config,
+                                                 name + '_dense')
+        self.register_variables(self.dense_model.variables())
+
+    def forward(self, input_dict, state, seq_lens):
+        obs = tf.cast(input_dict['obs'], tf.float32)
+        dense = densify(obs, self.max_cells)
+        return self.dense_model.forward({'obs': dense, 'obs_flat': dense}, state, seq_lens)
+
+    def value_function(self):
+        return self.dense_model.value_function()
+
+
+ModelCatalog.register_custom_model(SPARSE_GRID_MODEL, SparseGridModel)
@@ -0,0 +1,144 @@
+"""Wall time profile of the phases of the env step loops."""
+import json
+import time
+
+import numpy as np
+
+# histogram bin edges in seconds: 10 bins per decade from 1us to 10s
+BIN_EDGES = np.logspace(-6, 1, 71)
+
+
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Phase:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.nested = 0.0
+        self.profiler._open.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        self.profiler._open.pop()
+        self.profiler.add(self.name, elapsed - self.nested)
+        if self.profiler._open:
+            self.profiler._open[-1].nested += elapsed
+        return False
+
+
+class _PhaseStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = np.zeros(len(BIN_EDGES) + 1, dtype=np.int64)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.histogram[np.searchsorted(BIN_EDGES, seconds)] += 1
+
+    def percentile(self, q):
+        """Return the upper bin edge below which `q` percent of the calls fall."""
+        rank = np.searchsorted(np.cumsum(self.histogram), q / 100.0 * self.count)
+        return self.max if rank >= len(BIN_EDGES) else min(BIN_EDGES[rank], self.max)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'histogram': self.histogram.tolist(),
+        }
+
+    def merge(self, stats):
+        self.count += stats['count']
+        self.total += stats['total']
+        self.max = max(self.max, stats['max'])
+        self.histogram += np.asarray(stats['histogram'], dtype=np.int64)
+
+
+class StepProfiler:
+    """Per-phase wall time histograms and call counts of an env.
+
+    The envs wrap each phase of `step` and `reset` in `phase(name)`. The
+    calls are accumulated over all episodes in `phases`, and the count and
+    total time of each phase over each episode in `episodes`. A phase
+    opened inside another, such as the warmup steps of a reset, is only
+    counted in itself: the outer phase records its time without the nested
+    ones, so that the shares of `summary` add up. A disabled profiler
+    records nothing, and its phases cost a method call.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.phases = {}
+        self.episodes = []
+        self._open = []
+        self._null_phase = _NullPhase()
+
+    def phase(self, name):
+        """Return a context manager timing phase `name`."""
+        if not self.enabled:
+            return self._null_phase
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        if name not in self.phases:
+            self.phases[name] = _PhaseStats()
+        self.phases[name].add(seconds)
+        if not self.episodes:
+            self.episodes.append({})
+        count, total = self.episodes[-1].get(name, (0, 0.0))
+        self.episodes[-1][name] = count + 1, total + seconds
+
+    def start_episode(self):
+        if self.enabled:
+            self.episodes.append({})
+
+    def to_dict(self):
+        return {
+            'bin_edges': BIN_EDGES.tolist(),
+            'phases': {name: stats.to_dict() for name, stats in self.phases.items()},
+            'episodes': [{name: {'count': count, 'total': total} for name, (count, total) in episode.items()}
+                         for episode in self.episodes if episode],
+        }
+
+    def merge(self, profile):
+        """Add the phases and episodes of `profile`, the to_dict() of another profiler."""
+        for name, stats in profile['phases'].items():
+            if name not in self.phases:
+                self.phases[name] = _PhaseStats()
+            self.phases[name].merge(stats)
+        for episode in profile['episodes']:
+            self.episodes.append({name: (stats['count'], stats['total']) for name, stats in episode.items()})
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    def summary(self):
+        """Return a table of the phases, by decreasing total time."""
+        total = sum(stats.total for stats in self.phases.values())
+        lines = ['{0:<20} {1:>10} {2:>10} {3:>7} {4:>10} {5:>10} {6:>10}'.format(
+            'phase', 'calls', 'total s', 'share', 'mean ms', 'p50 ms', 'p99 ms')]
+        for name, stats in sorted(self.phases.items(), key=lambda item: -item[1].total):
+            lines.append('{0:<20} {1:>10} {2:>10.3f} {3:>6.1f}% {4:>10.4f} {5:>10.4f} {6:>10.4f}'.format(
+                name, stats.count, stats.total, stats.total * 100.0 / total if total else 0,
+                stats.total * 1000.0 / stats.count, stats.percentile(50) * 1000.0,
+                stats.percentile(99) * 1000.0))
+        return '\n'.join(lines)
@@ -0,0 +1,504 @@
+"""NumPy surrogate of the SUMO simulation of CrossRoadNetwork.
+
+The surrogate moves vehicles kinematically along the routes of the network
+and exposes the part of flow's kernel API used by the envs and controllers
+(`env.k.vehicle`, `env.k.network`, `env.k.simulation`), so an env created
+with `simulator=SIMULATOR` runs without starting SUMO.
+
+Model, matching the SUMO setup of this repo:
+
+* each lane is a straight line between the nodes of its edge, shifted by
+  LANE_OFFSET to the right of the travel direction; junctions have no
+  internal lanes;
+* vehicles of the inflows of the network are inserted at the start of their
+  route, with Bernoulli (`probability`) or periodic (`period`) departures,
+  as soon as there is room for them;
+* human vehicles (IDM or Die controllers) follow their leader with IDM;
+  rl vehicles and vehicles with other controllers use the accelerations
+  applied through `apply_acceleration`, and IDM otherwise;
+* like the 'no_collide' speed mode, accelerations are bounded, vehicles
+  never run into their leader but ignore right of way at the junction;
+* vehicles of different routes whose footprints overlap collide and are
+  removed, and `check_collision` reports it for that step.
+"""
+from copy import deepcopy
+
+import numpy as np
+
+from flow.controllers import RLController, IDMController
+
+SIMULATOR = 'numpy'
+
+LANE_OFFSET = 1.6
+VEH_LENGTH = 5.0
+VEH_WIDTH = 1.8
+MAX_ACCEL = 2.6
+MAX_DECEL = 4.5
+MIN_GAP = 2.5
+
+IDM_PARAMS = {
+    'v0': 30,
+    'T': 1,
+    'a': 1,
+    'b': 1.5,
+    'delta': 4,
+    's0': 2,
+}
+
+
+class Route:
+    """Geometry of a route, as consecutive straight edges."""
+
+    def __init__(self, edge_ids, edges, nodes, offset):
+        self.edges = edge_ids
+        self.offset = offset
+        lengths = np.array([edges[e]['length'] for e in edge_ids], dtype=float)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.lengths = lengths
+        self.length = float(lengths.sum())
+        origin, vector = [], []
+        for e in edge_ids:
+            x0, y0 = nodes[edges[e]['from']]
+            x1, y1 = nodes[edges[e]['to']]
+            dx, dy = x1 - x0, y1 - y0
+            norm = np.hypot(dx, dy)
+            # lanes are on the right of the travel direction
+            origin.append((x0 + LANE_OFFSET * dy / norm, y0 - LANE_OFFSET * dx / norm))
+            vector.append((dx, dy))
+        self.origin = np.array(origin)
+        self.vector = np.array(vector)
+        self.angle = np.degrees(np.arctan2(self.vector[:, 0], self.vector[:, 1])) % 360
+
+    def edge_index(self, pos):
+        return np.clip(np.searchsorted(self.starts, pos, side='right') - 1, 0, len(self.edges) - 1)
+
+    def orientation(self, pos):
+        """Return x, y and SUMO angle of vehicles at positions `pos`."""
+        idx = self.edge_index(pos)
+        frac = (pos - self.starts[idx]) / self.lengths[idx]
+        xy = self.origin[idx] + self.vector[idx] * frac[:, None]
+        return xy[:, 0], xy[:, 1], self.angle[idx]
+
+
+class Inflow:
+    """Departure process of one inflow of the network."""
+
+    def __init__(self, params, route, speed_limit):
+        self.name = params['name']
+        self.vtype = params['vtype']
+        self.route = route
+        self.begin = float(params.get('begin', 0))
+        self.end = float(params.get('end', 86400))
+        self.number = params.get('number')
+        self.probability = params.get('probability')
+        self.period = params.get('period')
+        depart_speed = params.get('departSpeed', 0)
+        self.depart_speed = speed_limit if depart_speed == 'max' else float(depart_speed)
+        self.reset()
+
+    def reset(self):
+        self.emitted = 0
+        self.pending = 0
+        self.next_time = self.begin
+
+    def departures(self, time, sim_step, rng):
+        """Return how many vehicles this inflow emits at `time`."""
+        if time < self.begin or time > self.end:
+            return 0
+        if self.number is not None and self.emitted >= int(self.number):
+            return 0
+        count = 0
+        if self.period is not None:
+            while self.next_time <= time + 1e-9:
+                count += 1
+                self.next_time += float(self.period)
+        elif self.probability is not None:
+            count = int(rng.random_sample() < float(self.probability) * sim_step)
+        if self.number is not None:
+            count = min(count, int(self.number) - self.emitted)
+        self.emitted += count
+        return count
+
+
+class SurrogateVehicle:
+    """Vehicle kernel of the surrogate, see flow's TraCIVehicle."""
+
+    def __init__(self, simulation, type_parameters):
+        self.sim = simulation
+        self.type_parameters = type_parameters
+        self.rl_types = set()
+        self.controlled_types = set()
+        self.idm = dict(IDM_PARAMS)
+        for veh_type, params in type_parameters.items():
+            controller = params.get('acceleration_controller')
+            if controller is None:
+                continue
+            if issubclass(controller[0], RLController):
+                self.rl_types.add(veh_type)
+            elif issubclass(controller[0], IDMController):
+                self.idm.update(controller[1])
+            elif controller[0].__name__ != 'DieController':
+                self.controlled_types.add(veh_type)
+        self.clear()
+
+    def clear(self):
+        self.ids = []
+        self.types = []
+        self.index = {}
+        self.route = np.zeros(0, dtype=int)
+        self.pos = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.depart = np.zeros(0)
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.angle = np.zeros(0)
+        self.leader = np.zeros(0, dtype=int)
+        self.accel = {}
+        self.controllers = {}
+        self.arrivals = []
+
+    # state maintenance, driven by SurrogateSimulation
+
+    def _keep(self, mask):
+        self.ids = [veh_id for veh_id, keep in zip(self.ids, mask) if keep]
+        self.types = [veh_type for veh_type, keep in zip(self.types, mask) if keep]
+        self.route = self.route[mask]
+        self.pos = self.pos[mask]
+        self.speed = self.speed[mask]
+        self.depart = self.depart[mask]
+        for veh_id in list(self.controllers):
+            if veh_id not in self.ids:
+                del self.controllers[veh_id]
+
+    def _add(self, veh_id, veh_type, route, pos, speed, time):
+        self.ids.append(veh_id)
+        self.types.append(veh_type)
+        self.route = np.append(self.route, route)
+        self.pos = np.append(self.pos, pos)
+        self.speed = np.append(self.speed, speed)
+        self.depart = np.append(self.depart, time)
+        if veh_type in self.controlled_types:
+            controller = self.type_parameters[veh_type]['acceleration_controller']
+            self.controllers[veh_id] = controller[0](
+                veh_id, car_following_params=self.type_parameters[veh_type].get('car_following_params'),
+                **controller[1])
+
+    def _refresh(self):
+        """Recompute the index, leaders and poses after vehicles moved."""
+        self.index = {veh_id: i for i, veh_id in enumerate(self.ids)}
+        # vehicles never overtake, so on each route the insertion order is
+        # the order from the front to the back of the queue
+        self.leader = np.full(len(self.ids), -1, dtype=int)
+        self.x = np.zeros(len(self.ids))
+        self.y = np.zeros(len(self.ids))
+        self.angle = np.zeros(len(self.ids))
+        for r, route in enumerate(self.sim.routes):
+            members = np.flatnonzero(self.route == r)
+            if len(members) == 0:
+                continue
+            self.leader[members[1:]] = members[:-1]
+            self.x[members], self.y[members], self.angle[members] = route.orientation(self.pos[members])
+
+    def _headway(self):
+        lead = self.leader
+        headway = np.full(len(self.ids), 1e3)
+        has_leader = lead >= 0
+        headway[has_leader] = self.pos[lead[has_leader]] - VEH_LENGTH - self.pos[has_leader]
+        return headway
+
+    def _idm_accel(self):
+        p = self.idm
+        v = self.speed
+        h = np.maximum(self._headway(), 1e-3)
+        lead = self.leader
+        lead_speed = np.where(lead >= 0, self.speed[lead], v)
+        s_star = np.where(lead >= 0,
+                          p['s0'] + np.maximum(0, v * p['T'] + v * (v - lead_speed) / (2 * np.sqrt(p['a'] * p['b']))),
+                          0)
+        return p['a'] * (1 - (v / p['v0']) ** p['delta'] - (s_star / h) ** 2)
+
+    # flow vehicle kernel API
+
+    @property
+    def num_vehicles(self):
+        return len(self.ids)
+
+    def get_ids(self):
+        return list(self.ids)
+
+    def get_human_ids(self):
+        return [veh_id for veh_id, veh_type in zip(self.ids, self.types) if veh_type not in self.rl_types]
+
+    def get_rl_ids(self):
+        return [veh_id for veh_id, veh_type in zip(self.ids, self.types) if veh_type in self.rl_types]
+
+    def get_controlled_ids(self):
+        return [veh_id for veh_id, veh_type in zip(self.ids, self.types) if veh_type in self.controlled_types]
+
+    def get_controlled_lc_ids(self):
+        return []
+
+    def get_observed_ids(self):
+        return []
+
+    def get_type(self, veh_id):
+        return self.types[self.index[veh_id]]
+
+    def get_acc_controller(self, veh_id):
+        return self.controllers.get(veh_id)
+
+    def get_routing_controller(self, veh_id):
+        return None
+
+    def get_lane_changing_controller(self, veh_id):
+        return None
+
+    def _get(self, values, veh_id, error):
+        if isinstance(veh_id, (list, np.ndarray)):
+            return [self._get(values, vehID, error) for vehID in veh_id]
+        i = self.index.get(veh_id)
+        return error if i is None else float(values[i])
+
+    def get_speed(self, veh_id, error=-1001):
+        return self._get(self.speed, veh_id, error)
+
+    def get_orientation(self, veh_id):
+        i = self.index[veh_id]
+        return [float(self.x[i]), float(self.y[i]), float(self.angle[i])]
+
+    def get_route(self, veh_id, error=list()):
+        i = self.index.get(veh_id)
+        return error if i is None else list(self.sim.routes[self.route[i]].edges)
+
+    def get_edge(self, veh_id, error=""):
+        i = self.index.get(veh_id)
+        if i is None:
+            return error
+        route = self.sim.routes[self.route[i]]
+        return route.edges[route.edge_index(self.pos[i:i + 1])[0]]
+
+    def get_position(self, veh_id, error=-1001):
+        i = self.index.get(veh_id)
+        if i is None:
+            return error
+        route = self.sim.routes[self.route[i]]
+        return float(self.pos[i] - route.starts[route.edge_index(self.pos[i:i + 1])[0]])
+
+    def get_lane(self, veh_id, error=-1001):
+        return error if veh_id not in self.index else 0
+
+    def get_length(self, veh_id, error=-1001):
+        return error if veh_id not in self.index else VEH_LENGTH
+
+    def get_x_by_id(self, veh_id):
+        i = self.index.get(veh_id)
+        if i is None:
+            return -1001.
+        return float(self.sim.routes[self.route[i]].offset + self.pos[i])
+
+    def get_leader(self, veh_id, error=""):
+        i = self.index.get(veh_id)
+        if i is None or self.leader[i] < 0:
+            return error
+        return self.ids[self.leader[i]]
+
+    def get_follower(self, veh_id, error=""):
+        i = self.index.get(veh_id)
+        followers = np.flatnonzero(self.leader == i) if i is not None else []
+        return self.ids[followers[0]] if len(followers) else error
+
+    def get_headway(self, veh_id, error=-1001):
+        i = self.index.get(veh_id)
+        return error if i is None else float(self._headway()[i])
+
+    def get_outflow_rate(self, time_span):
+        recent = [t for t in self.arrivals if t >= self.sim.time - time_span]
+        return len(recent) * 3600 / time_span
+
+    def get_inflow_rate(self, time_span):
+        return float(np.sum(self.depart >= self.sim.time - time_span)) * 3600 / time_span
+
+    def apply_acceleration(self, veh_ids, acc):
+        for veh_id, accel in zip(veh_ids, acc):
+            if accel is not None and veh_id in self.index:
+                self.accel[veh_id] = float(accel)
+
+    def apply_lane_change(self, veh_ids, direction):
+        pass
+
+    def choose_routes(self, veh_ids, route_choices):
+        pass
+
+    def set_color(self, veh_id, color):
+        pass
+
+    def update_vehicle_colors(self):
+        pass
+
+
+class SurrogateSimulation:
+    """Simulation kernel of the surrogate: time, inflows and collisions."""
+
+    def __init__(self, network, sim_params):
+        self.sim_step = sim_params.sim_step
+        self.rng = np.random.RandomState(sim_params.seed)
+        net_params = network.net_params
+        additional_params = net_params.additional_params
+        self.speed_limit = additional_params['speed_limit']
+        nodes = {node['id']: (node['x'], node['y']) for node in network.specify_nodes(net_params)}
+        edges = {edge['id']: edge for edge in network.specify_edges(net_params)}
+        self.network_length = float(sum(edge['length'] for edge in edges.values()))
+
+        self.routes = []
+        route_index = {}
+        offset = 0
+        for start_edge, choices in network.specify_routes(net_params).items():
+            route = Route(choices[0][0], edges, nodes, offset)
+            offset += route.length
+            route_index[start_edge] = len(self.routes)
+            self.routes.append(route)
+
+        self.inflows = []
+        for params in net_params.inflows.get():
+            edge = params['edge'] if 'edge' in params else params['route'][len('route'):]
+            self.inflows.append(Inflow(params, route_index[edge], self.speed_limit))
+
+        self.vehicle = None
+        self.time = 0
+        self.collided = False
+
+    def reset(self):
+        self.time = 0
+        self.collided = False
+        for inflow in self.inflows:
+            inflow.reset()
+        self.vehicle.clear()
+        self.vehicle._refresh()
+
+    def simulation_step(self):
+        vehicle = self.vehicle
+        dt = self.sim_step
+
+        accel = vehicle._idm_accel()
+        for veh_id, value in vehicle.accel.items():
+            accel[vehicle.index[veh_id]] = value
+        vehicle.accel = {}
+        accel = np.clip(accel, -MAX_DECEL, MAX_ACCEL)
+        speed = np.clip(vehicle.speed + accel * dt, 0, self.speed_limit)
+        pos = vehicle.pos + speed * dt
+        # never move past the back of the leader
+        for r in range(len(self.routes)):
+            members = np.flatnonzero(vehicle.route == r)
+            if len(members) > 1:
+                rank = np.arange(len(members)) * VEH_LENGTH
+                pos[members] = np.minimum.accumulate(pos[members] + rank) - rank
+        vehicle.speed = np.maximum((pos - vehicle.pos) / dt, 0)
+        vehicle.pos = pos
+        self.time += dt
+
+        lengths = np.array([route.length for route in self.routes])
+        arrived = vehicle.pos > lengths[vehicle.route]
+        vehicle.arrivals.extend([self.time] * int(arrived.sum()))
+        vehicle._keep(~arrived)
+        self._insert_departures()
+        vehicle._refresh()
+
+        colliding = self._colliding()
+        self.collided = bool(colliding.any())
+        if self.collided:
+            vehicle._keep(~colliding)
+            vehicle._refresh()
+
+    def _insert_departures(self):
+        vehicle = self.vehicle
+        for inflow in self.inflows:
+            inflow.pending += inflow.departures(self.time, self.sim_step, self.rng)
+            while inflow.pending > 0:
+                on_route = vehicle.route == inflow.route
+                gap = (vehicle.pos[on_route].min() - VEH_LENGTH if on_route.any() else np.inf) - VEH_LENGTH
+                if gap < MIN_GAP + inflow.depart_speed * self.vehicle.idm['T']:
+                    break
+                veh_id = '{0}.{1}'.format(inflow.name, inflow.emitted - inflow.pending)
+                vehicle._add(veh_id, inflow.vtype, inflow.route, VEH_LENGTH, inflow.depart_speed, self.time)
+                inflow.pending -= 1
+
+    def _colliding(self):
+        """Return which vehicles overlap a vehicle of another route."""
+        vehicle = self.vehicle
+        heading = np.radians(vehicle.angle)
+        dx, dy = np.sin(heading), np.cos(heading)
+        cx = vehicle.x - dx * VEH_LENGTH / 2
+        cy = vehicle.y - dy * VEH_LENGTH / 2
+        ex = np.abs(dx) * VEH_LENGTH / 2 + np.abs(dy) * VEH_WIDTH / 2
+        ey = np.abs(dy) * VEH_LENGTH / 2 + np.abs(dx) * VEH_WIDTH / 2
+        overlap = (np.abs(cx[:, None] - cx[None, :]) < ex[:, None] + ex[None, :]) & \
+            (np.abs(cy[:, None] - cy[None, :]) < ey[:, None] + ey[None, :]) & \
+            (vehicle.route[:, None] != vehicle.route[None, :])
+        return overlap.any(axis=1)
+
+    def check_collision(self):
+        return self.collided
+
+
+class SurrogateNetwork:
+    """Network kernel of the surrogate."""
+
+    def __init__(self, simulation):
+        self.sim = simulation
+
+    def max_speed(self):
+        return self.sim.speed_limit
+
+    def length(self):
+        return self.sim.network_length
+
+
+class SurrogateKernel:
+    """Drop-in for flow's Kernel, backed by the NumPy surrogate."""
+
+    def __init__(self, network, sim_params):
+        self.simulation = SurrogateSimulation(network, sim_params)
+        self.vehicle = SurrogateVehicle(self.simulation, deepcopy(network.vehicles.type_parameters))
+        self.simulation.vehicle = self.vehicle
+        self.network = SurrogateNetwork(self.simulation)
+
+    def update(self, reset):
+        pass
+
+    def reset(self):
+        self.simulation.reset()
+
+    def close(self):
+        pass
+
+
+def init_env(env, env_params, sim_params, network):
+    """Set up the attributes flow's Env.__init__ would, on the surrogate."""
+    env.env_params = env_params
+    env.sim_params = deepcopy(sim_params)
+    env.network = network
+    env.net_params = network.net_params
+    env.initial_config = network.initial_config
+    env.initial_vehicles = network.vehicles
+    env.simulator = SIMULATOR
+    env.sim_step = sim_params.sim_step
+    env.time_counter = 0
+    env.step_counter = 0
+    env.initial_state = {}
+    env.state = None
+    env.obs_var_labels = []
+    env.k = SurrogateKernel(network, sim_params)
+
+
+def reset_env(env):
+    """Reset `env` on the surrogate and run its warmup steps, see Env.reset."""
+    env.time_counter = 0
+    env.step_counter = 0
+    env.k.reset()
+    if getattr(env, 'snapshot', None) is not None:
+        env.snapshot.update(env.k.vehicle)
+    for _ in range(env.env_params.warmup_steps):
+        env.step(rl_actions=None)
+    states = env.get_state()
+    env.state = np.asarray(states).T
+    return np.copy(states)
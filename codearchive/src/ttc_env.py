@@ -7,6 +7,13 @@ from gym.spaces.box import Box
 
 import numpy as np
 
+from episode_metrics import EpisodeMetrics
+from vehicle_snapshot import VehicleSnapshot
+import surrogate_sim
+from warm_state import WarmState
+from step_profiler import StepProfiler
+import batched_controllers
+
 ADDITIONAL_ENV_PARAMS = {
     'max_accel': 2.5,
     'max_decel': 4.5,
@@ -14,10 +21,32 @@ ADDITIONAL_ENV_PARAMS = {
     'sort_vehicles': False
 }
 
+# parameters that may be left out of env_params.additional_params
+OPTIONAL_ENV_PARAMS = {
+    # read vehicle state from a per-step VehicleSnapshot
+    'use_snapshot': False,
+    # reuse a simulation state saved after warmup for this many episodes
+    # before restarting SUMO, see warm_state.WarmState
+    'warm_state_episodes': 0,
+    # record the vehicle trajectories in the episode metrics every this
+    # many steps, see episode_metrics.EpisodeMetrics
+    'trajectory_every': 0,
+    # time the phases of step and reset, see step_profiler.StepProfiler
+    'profile_steps': False,
+    # evaluate the controllers of the controlled vehicles class by class on
+    # arrays, see batched_controllers.get_actions
+    'batch_controllers': False,
+}
+
 
 class CrossRoadAccelEnv(Env):
 
     def __init__(self, env_params, sim_params, network, simulator='traci'):
+        """See parent class.
+
+        With `simulator='numpy'` the env runs on the NumPy surrogate of
+        surrogate_sim instead of SUMO.
+        """
         for p in ADDITIONAL_ENV_PARAMS.keys():
             if p not in env_params.additional_params:
                 raise KeyError(
@@ -25,8 +54,29 @@ class CrossRoadAccelEnv(Env):
 
         self.prev_pos = dict()
         self.absolute_position = dict()
-
-        super().__init__(env_params, sim_params, network, simulator)
+        self.metrics = EpisodeMetrics(sim_params.sim_step, env_params.additional_params.get(
+            'trajectory_every', OPTIONAL_ENV_PARAMS['trajectory_every']))
+        self.snapshot = None
+        if env_params.additional_params.get('use_snapshot', OPTIONAL_ENV_PARAMS['use_snapshot']):
+            self.snapshot = VehicleSnapshot()
+        self.colored_ids = set()
+        # flow's reset overwrites sim_params.seed with a random one before
+        # restarting SUMO, see restart_simulation
+        self.sumo_seed = sim_params.seed
+        self.profiler = StepProfiler(env_params.additional_params.get(
+            'profile_steps', OPTIONAL_ENV_PARAMS['profile_steps']))
+        self.batch_controllers = env_params.additional_params.get(
+            'batch_controllers', OPTIONAL_ENV_PARAMS['batch_controllers'])
+        self.warm_state = None
+        warm_state_episodes = env_params.additional_params.get(
+            'warm_state_episodes', OPTIONAL_ENV_PARAMS['warm_state_episodes'])
+        if warm_state_episodes > 0 and simulator != surrogate_sim.SIMULATOR:
+            self.warm_state = WarmState(warm_state_episodes)
+
+        if simulator == surrogate_sim.SIMULATOR:
+            surrogate_sim.init_env(self, env_params, sim_params, network)
+        else:
+            super().__init__(env_params, sim_params, network, simulator)
 
     @property
     def action_space(self):
@@ -64,6 +114,9 @@ class CrossRoadAccelEnv(Env):
 
     def get_state(self):
         """See class definition."""
+        if self.snapshot is not None and not self.env_params.additional_params['sort_vehicles']:
+            return np.concatenate([self.snapshot.speed / self.k.network.max_speed(),
+                                   self.snapshot.x / self.k.network.length()])
         speed = [self.k.vehicle.get_speed(veh_id) / self.k.network.max_speed()
                  for veh_id in self.sorted_ids]
         pos = [self.k.vehicle.get_x_by_id(veh_id) / self.k.network.length()
@@ -77,6 +130,10 @@ class CrossRoadAccelEnv(Env):
         Define which vehicles are observed for visualization purposes, and
         update the sorting of vehicles using the self.sorted_ids variable.
         """
+        if self.snapshot is not None:
+            self._snapshot_additional_command()
+            return
+
         for veh_id in self.k.vehicle.get_ids():
             if self.k.vehicle.get_type(veh_id) == "av":
                 self.k.vehicle.set_color(veh_id, color=(255, 0, 0))
@@ -84,16 +141,34 @@ class CrossRoadAccelEnv(Env):
         # update the "absolute_position" variable
         for veh_id in self.k.vehicle.get_ids():
             this_pos = self.k.vehicle.get_x_by_id(veh_id)
+            self._update_absolute_position(veh_id, this_pos)
 
-            if this_pos == -1001:
-                # in case the vehicle isn't in the network
-                self.absolute_position[veh_id] = -1001
-            else:
-                change = this_pos - self.prev_pos.get(veh_id, this_pos)
-                self.absolute_position[veh_id] = \
-                    (self.absolute_position.get(veh_id, this_pos) + change) \
-                    % self.k.network.length()
-                self.prev_pos[veh_id] = this_pos
+    def _snapshot_additional_command(self):
+        """Perform additional_command reading vehicle state from the snapshot.
+
+        Without rendering the colors are never reset, so each av is colored
+        once instead of sending a TraCI command for it at every step.
+        """
+        snapshot = self.snapshot
+        for veh_id, veh_type in zip(snapshot.ids, snapshot.types):
+            if veh_type == "av" and (self.sim_params.render or veh_id not in self.colored_ids):
+                self.k.vehicle.set_color(veh_id, color=(255, 0, 0))
+                self.colored_ids.add(veh_id)
+
+        for veh_id, this_pos in zip(snapshot.ids, snapshot.x):
+            self._update_absolute_position(veh_id, this_pos)
+
+    def _update_absolute_position(self, veh_id, this_pos):
+        """Update the "absolute_position" variable of a vehicle."""
+        if this_pos == -1001:
+            # in case the vehicle isn't in the network
+            self.absolute_position[veh_id] = -1001
+        else:
+            change = this_pos - self.prev_pos.get(veh_id, this_pos)
+            self.absolute_position[veh_id] = \
+                (self.absolute_position.get(veh_id, this_pos) + change) \
+                % self.k.network.length()
+            self.prev_pos[veh_id] = this_pos
 
     @property
     def sorted_ids(self):
@@ -116,73 +191,103 @@ class CrossRoadAccelEnv(Env):
         """Return the absolute position of a vehicle."""
         return self.absolute_position.get(veh_id, -1001)
 
+    @property
+    def episode_result(self):
+        """Return the metrics of the current episode as an AnalysisResult.
+
+        These match what xml_analyzer.analyze computes from the output files,
+        but are collected while simulating.
+        """
+        return self.metrics.result()
+
     def step(self, rl_actions):
         """Advance the environment by one step. """
         crash = False
+        profiler = self.profiler
         for _ in range(self.env_params.sims_per_step):
             self.time_counter += 1
             self.step_counter += 1
 
             # perform acceleration actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_ids()) > 0:
-                accel = []
-                for veh_id in self.k.vehicle.get_controlled_ids():
-                    action = self.k.vehicle.get_acc_controller(
-                        veh_id).get_action(self)
-                    accel.append(action)
-                self.k.vehicle.apply_acceleration(
-                    self.k.vehicle.get_controlled_ids(), accel)
+            with profiler.phase('controllers'):
+                if len(self.k.vehicle.get_controlled_ids()) > 0:
+                    if self.batch_controllers:
+                        accel = batched_controllers.get_actions(self, self.k.vehicle.get_controlled_ids())
+                    else:
+                        accel = []
+                        for veh_id in self.k.vehicle.get_controlled_ids():
+                            action = self.k.vehicle.get_acc_controller(
+                                veh_id).get_action(self)
+                            accel.append(action)
+                    self.k.vehicle.apply_acceleration(
+                        self.k.vehicle.get_controlled_ids(), accel)
 
             # perform lane change actions for controlled human-driven vehicles
-            if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
-                direction = []
-                for veh_id in self.k.vehicle.get_controlled_lc_ids():
-                    target_lane = self.k.vehicle.get_lane_changing_controller(
-                        veh_id).get_action(self)
-                    direction.append(target_lane)
-                self.k.vehicle.apply_lane_change(
-                    self.k.vehicle.get_controlled_lc_ids(),
-                    direction=direction)
+            with profiler.phase('lane_change'):
+                if len(self.k.vehicle.get_controlled_lc_ids()) > 0:
+                    direction = []
+                    for veh_id in self.k.vehicle.get_controlled_lc_ids():
+                        target_lane = self.k.vehicle.get_lane_changing_controller(
+                            veh_id).get_action(self)
+                        direction.append(target_lane)
+                    self.k.vehicle.apply_lane_change(
+                        self.k.vehicle.get_controlled_lc_ids(),
+                        direction=direction)
 
             # perform (optionally) routing actions for all vehicles in the
             # network, including RL and SUMO-controlled vehicles
-            routing_ids = []
-            routing_actions = []
-            for veh_id in self.k.vehicle.get_ids():
-                if self.k.vehicle.get_routing_controller(veh_id) \
-                        is not None:
-                    routing_ids.append(veh_id)
-                    route_contr = self.k.vehicle.get_routing_controller(
-                        veh_id)
-                    routing_actions.append(route_contr.choose_route(self))
+            with profiler.phase('routing'):
+                routing_ids = []
+                routing_actions = []
+                for veh_id in self.k.vehicle.get_ids():
+                    if self.k.vehicle.get_routing_controller(veh_id) \
+                            is not None:
+                        routing_ids.append(veh_id)
+                        route_contr = self.k.vehicle.get_routing_controller(
+                            veh_id)
+                        routing_actions.append(route_contr.choose_route(self))
 
-            self.k.vehicle.choose_routes(routing_ids, routing_actions)
+                self.k.vehicle.choose_routes(routing_ids, routing_actions)
 
-            self.apply_rl_actions(rl_actions)
+            with profiler.phase('apply_rl_actions'):
+                self.apply_rl_actions(rl_actions)
 
-            self.additional_command()
+            with profiler.phase('additional_command'):
+                self.additional_command()
 
             # advance the simulation in the simulator by one step
-            self.k.simulation.simulation_step()
+            with profiler.phase('simulation_step'):
+                self.k.simulation.simulation_step()
 
             # store new observations in the vehicles and traffic lights class
-            self.k.update(reset=False)
+            with profiler.phase('kernel_update'):
+                self.k.update(reset=False)
+                if self.snapshot is not None:
+                    self.snapshot.update(self.k.vehicle)
 
             # update the colors of vehicles
-            if self.sim_params.render:
-                self.k.vehicle.update_vehicle_colors()
+            with profiler.phase('vehicle_colors'):
+                if self.sim_params.render:
+                    self.k.vehicle.update_vehicle_colors()
 
             # crash encodes whether the simulator experienced a collision
-            crash = self.k.simulation.check_collision()
+            with profiler.phase('check_collision'):
+                crash = self.k.simulation.check_collision()
+
+            # accumulate the success/collision/duration/brake time metrics
+            with profiler.phase('metrics'):
+                self.metrics.update(self, crash)
 
             # stop collecting new simulation steps if there is a collision
             if crash:
                 break
 
             # render a frame
-            self.render()
+            with profiler.phase('render'):
+                self.render()
 
-        states = self.get_state()
+        with profiler.phase('get_state'):
+            states = self.get_state()
 
         # collect information of the state of the network based on the
         # environment class used
@@ -196,10 +301,13 @@ class CrossRoadAccelEnv(Env):
         done = (self.time_counter >= self.env_params.warmup_steps +
                 self.env_params.horizon)  # or crash
 
-        count_av = 0
-        for i in self.k.vehicle.get_ids():
-            if self.k.vehicle.get_type(i) == "av":
-                count_av += 1
+        if self.snapshot is not None:
+            count_av = self.snapshot.count_type("av")
+        else:
+            count_av = 0
+            for i in self.k.vehicle.get_ids():
+                if self.k.vehicle.get_type(i) == "av":
+                    count_av += 1
         if self.step_counter >= self.env_params.warmup_steps + 10 and count_av == 0:
             done = True    # No Reinforcement Learning Vehicles, stop
 
@@ -207,24 +315,58 @@ class CrossRoadAccelEnv(Env):
         infos = {}
 
         # compute the reward
-        if self.env_params.clip_actions:
-            rl_clipped = self.clip_actions(rl_actions)
-            reward = self.compute_reward(rl_clipped, fail=crash)
-        else:
-            reward = self.compute_reward(rl_actions, fail=crash)
+        with profiler.phase('compute_reward'):
+            if self.env_params.clip_actions:
+                rl_clipped = self.clip_actions(rl_actions)
+                reward = self.compute_reward(rl_clipped, fail=crash)
+            else:
+                reward = self.compute_reward(rl_actions, fail=crash)
 
         return next_observation, reward, done, infos
 
+    def restart_simulation(self, sim_params, render=None):
+        """See parent class.
+
+        A SUMO seed given at construction seeds every instance, instead of
+        the random seed that the reset draws before restarting.
+        """
+        if self.sumo_seed is not None:
+            sim_params.seed = self.sumo_seed
+        super().restart_simulation(sim_params, render)
+
     def reset(self):
         """See parent class.
 
         This also includes updating the initial absolute position and previous
         position.
         """
-        obs = super().reset()
+        self.metrics.reset()
+        self.colored_ids.clear()
+        # the warmup steps of the reset read the snapshot before the first
+        # kernel update, so the vehicles of the previous episode must go
+        if self.snapshot is not None:
+            self.snapshot.clear()
+        self.profiler.start_episode()
+        with self.profiler.phase('reset'):
+            if self.simulator == surrogate_sim.SIMULATOR:
+                obs = surrogate_sim.reset_env(self)
+            elif self.warm_state is not None and self.warm_state.ready():
+                obs = self.warm_state.restore(self)
+            else:
+                obs = super().reset()
+                if self.warm_state is not None:
+                    self.warm_state.save(self)
+        if self.snapshot is not None:
+            self.snapshot.update(self.k.vehicle)
 
         for veh_id in self.k.vehicle.get_ids():
             self.absolute_position[veh_id] = self.k.vehicle.get_x_by_id(veh_id)
             self.prev_pos[veh_id] = self.k.vehicle.get_x_by_id(veh_id)
 
         return obs
+
+    def terminate(self):
+        """See parent class."""
+        if self.warm_state is not None:
+            self.warm_state.close()
+        super().terminate()
@@ -0,0 +1,113 @@
+"""Vectorized wrapper stepping several CrossRoadRLAccelEnv in lockstep."""
+import socket
+from copy import deepcopy
+from multiprocessing import Pipe, Process
+
+import numpy as np
+from ray.rllib.env.vector_env import VectorEnv
+
+from flow.utils.registry import make_create_env
+
+
+def free_ports(num_ports):
+    """Return `num_ports` distinct TCP ports that are currently free."""
+    sockets = []
+    try:
+        for _ in range(num_ports):
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.bind(('', 0))
+            sockets.append(s)
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+
+def _worker(conn, flow_params, index):
+    create_env, _ = make_create_env(params=flow_params, version=index)
+    env = create_env()
+    try:
+        while True:
+            cmd, data = conn.recv()
+            if cmd == 'step':
+                obs, reward, done, info = env.step(data)
+                conn.send((obs, reward, done, info))
+            elif cmd == 'reset':
+                conn.send(env.reset())
+            elif cmd == 'spaces':
+                conn.send((env.observation_space, env.action_space))
+            elif cmd == 'close':
+                break
+    finally:
+        env.terminate()
+        conn.close()
+
+
+class CrossRoadVecEnv(VectorEnv):
+    """Step `num_envs` independent envs of `flow_params` in lockstep.
+
+    Each env lives in its own process with its own SUMO port, so the
+    simulations advance in parallel while observations, rewards and dones
+    come back stacked as `(num_envs, obs_dim)` and `(num_envs,)` arrays for
+    batched policy inference.
+
+    `step` resets finished envs automatically and reports the final
+    observation of the episode in `info['terminal_observation']`. The
+    `vector_reset`, `reset_at` and `vector_step` methods implement RLlib's
+    VectorEnv interface, where RLlib resets finished envs itself.
+    """
+
+    def __init__(self, flow_params, num_envs):
+        self.num_envs = num_envs
+        self.conns = []
+        self.processes = []
+        ports = free_ports(num_envs) if flow_params['simulator'] == 'traci' else [None] * num_envs
+        for index, port in enumerate(ports):
+            params = deepcopy(flow_params)
+            params['sim'].port = port
+            parent_conn, child_conn = Pipe()
+            process = Process(target=_worker, args=(child_conn, params, index), daemon=True)
+            process.start()
+            child_conn.close()
+            self.conns.append(parent_conn)
+            self.processes.append(process)
+        self.conns[0].send(('spaces', None))
+        self.observation_space, self.action_space = self.conns[0].recv()
+
+    def _stacked(self, results):
+        obs, rewards, dones, infos = zip(*results)
+        return np.stack(obs), np.array(rewards, dtype=float), np.array(dones, dtype=bool), list(infos)
+
+    def reset(self):
+        for conn in self.conns:
+            conn.send(('reset', None))
+        return np.stack([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        obs, rewards, dones, infos = self.vector_step(actions)
+        for i in np.flatnonzero(dones):
+            # a copy, as the row of the stacked array is overwritten by the reset
+            infos[i]['terminal_observation'] = obs[i].copy()
+            obs[i] = self.reset_at(i)
+        return obs, rewards, dones, infos
+
+    def vector_reset(self):
+        return list(self.reset())
+
+    def reset_at(self, index):
+        self.conns[index].send(('reset', None))
+        return self.conns[index].recv()
+
+    def vector_step(self, actions):
+        for conn, action in zip(self.conns, actions):
+            conn.send(('step', action))
+        return self._stacked([conn.recv() for conn in self.conns])
+
+    def get_unwrapped(self):
+        return []
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(('close', None))
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,39 @@
+"""Dense per-step snapshot of the vehicle variables read by the envs."""
+import numpy as np
+
+
+class VehicleSnapshot:
+    """Vehicle ids, types, positions, orientations and speeds of one step.
+
+    Flow's TraCI kernel receives these variables through its TraCI
+    subscriptions when the simulation steps. `update` gathers them once per
+    step into arrays aligned with `ids`, so the env methods index arrays
+    instead of calling the kernel again for each vehicle.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Empty the snapshot, until the next update."""
+        self.ids = []
+        self.index = {}
+        self.types = []
+        self.rl_ids = []
+        self.x = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.orientation = np.zeros((0, 3))
+
+    def update(self, vehicle):
+        ids = vehicle.get_ids()
+        self.ids = ids
+        self.index = {veh_id: i for i, veh_id in enumerate(ids)}
+        self.types = [vehicle.get_type(veh_id) for veh_id in ids]
+        self.rl_ids = vehicle.get_rl_ids()
+        self.x = np.array([vehicle.get_x_by_id(veh_id) for veh_id in ids], dtype=float)
+        self.speed = np.array([vehicle.get_speed(veh_id) for veh_id in ids], dtype=float)
+        self.orientation = np.array([vehicle.get_orientation(veh_id) for veh_id in ids],
+                                    dtype=float).reshape((-1, 3))
+
+    def count_type(self, veh_type):
+        return self.types.count(veh_type)
@@ -0,0 +1,94 @@
+"""Encode rendered frames into a video through an ffmpeg subprocess."""
+import queue
+import threading
+import subprocess
+
+import numpy as np
+
+
+class VideoEncoder:
+    """Pipe raw frames into ffmpeg, which encodes them into the video at `path`.
+
+    ffmpeg is started on the first frame, whose size sets the size of the
+    video, and reads the frames as `pix_fmt` (bgr24, the channel order of
+    flow's pyglet frames, or rgb24) on its stdin. A writer thread feeds it
+    from a queue of at most `queue_size` frames, so that rendering and
+    encoding overlap while memory stays bounded; `write` blocks when the
+    queue is full. No frame touches the disk.
+    """
+
+    def __init__(self, path, fps=10, pix_fmt='bgr24', codec='libx264', queue_size=32, ffmpeg='ffmpeg'):
+        self.path = path
+        self.fps = fps
+        self.pix_fmt = pix_fmt
+        self.codec = codec
+        self.ffmpeg = ffmpeg
+        self.frames = 0
+        self.shape = None
+        self.queue = queue.Queue(queue_size)
+        self.proc = None
+        self.thread = None
+        self.error = None
+
+    def _start(self, shape):
+        height, width = shape[:2]
+        command = [
+            self.ffmpeg, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', self.pix_fmt, '-s', '{0}x{1}'.format(width, height),
+            '-r', str(self.fps), '-i', '-',
+            '-an', '-c:v', self.codec, '-pix_fmt', 'yuv420p',
+            # yuv420p needs even dimensions
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+            self.path,
+        ]
+        self.shape = shape
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _feed(self):
+        try:
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                self.proc.stdin.write(data)
+        except Exception as e:
+            self.error = e
+            # keep consuming, so that write never blocks on a dead encoder
+            while self.queue.get() is not None:
+                pass
+        finally:
+            self.proc.stdin.close()
+
+    def write(self, frame):
+        """Queue `frame`, a (height, width, 3) uint8 array, for encoding."""
+        if self.error is not None:
+            raise RuntimeError('Encoding {0} failed'.format(self.path)) from self.error
+        frame = np.asarray(frame)
+        if self.proc is None:
+            self._start(frame.shape)
+        elif frame.shape != self.shape:
+            raise ValueError('Frame of shape {0} in a video of shape {1}'.format(frame.shape, self.shape))
+        # tobytes copies the frame, which the renderer may reuse
+        self.queue.put(np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+        self.frames += 1
+
+    def close(self):
+        """Encode the queued frames and wait for ffmpeg to finish the video."""
+        if self.proc is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        returncode = self.proc.wait()
+        self.proc = None
+        if self.error is not None or returncode != 0:
+            raise RuntimeError('Encoding {0} failed, ffmpeg returned {1}'.format(self.path, returncode)) \
+                from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
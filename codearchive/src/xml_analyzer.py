@@ -1,3 +1,7 @@
+import os
+import time
+from collections import namedtuple
+
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
@@ -6,26 +10,75 @@ except ImportError:
 
 BRAKE_DECEL = 4.0
 
+# root element of each output file of a run, by file suffix
+OUTPUT_ROOTS = {
+    '-summary.xml': 'summary',
+    '-tripinfo.xml': 'tripinfos',
+    '-emission.xml': 'emission-export',
+}
+
+AnalysisResult = namedtuple('AnalysisResult', ['has_collision', 'is_success', 'duration', 'brake_time'])
+
+
+def _is_av(veh_id):
+    return len(veh_id) > 7 and veh_id[0:7] == 'SN_flow'
+
+
+def _iter_elements(path, tag):
+    """Yield every `tag` element of an XML file, freeing it once consumed.
+
+    Elements are cleared from the root after each yield, so memory stays
+    bounded by a single element whatever the size of the file.
+    """
+    context = ET.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, elem in context:
+        if event == 'end' and elem.tag == tag:
+            yield elem
+            root.clear()
+
+
+def is_complete(path, root):
+    """Return whether the XML file at `path` ends with the closing tag of `root`."""
+    closing_tag = '</{0}>'.format(root).encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - len(closing_tag) - 64))
+            return f.read().rstrip().endswith(closing_tag)
+    except FileNotFoundError:
+        return False
+
+
+def wait_complete(emission_location, timeout=60, poll_interval=0.01):
+    """Wait until SUMO has closed every output file of a run.
+
+    SUMO writes the closing tag of its output files when it closes them, so
+    a file ending with it is complete. Raises TimeoutError if some file is
+    still incomplete after `timeout` seconds.
+    """
+    deadline = time.time() + timeout
+    for suffix, root in OUTPUT_ROOTS.items():
+        while not is_complete(emission_location + suffix, root):
+            if time.time() > deadline:
+                raise TimeoutError('{0} is incomplete after {1}s'.format(emission_location + suffix, timeout))
+            time.sleep(poll_interval)
+
 
 def has_collision(summary_path):
-    tree = ET.ElementTree(file=summary_path)
-    root = tree.getroot()
-    collisions = 0
-    for step in root:
-        collisions += int(step.attrib['collisions'])
-    return collisions > 0
-
-
-def avg_brake_time(emission_path):
-    tree = ET.ElementTree(file=emission_path)
-    root = tree.getroot()
-    step = 0.1
+    for step in _iter_elements(summary_path, 'step'):
+        if int(step.attrib['collisions']) > 0:
+            return True
+    return False
+
+
+def avg_brake_time(emission_path, step=0.1):
     last_speed = {}
     brake_time = 0
-    for timestamp in root:
+    for timestamp in _iter_elements(emission_path, 'timestep'):
         for vehicle in timestamp:
             id = vehicle.attrib['id']
-            if len(id) > 7 and id[0:7] == 'SN_flow':
+            if _is_av(id):
                 continue
             speed = float(vehicle.attrib['speed'])
             last = last_speed.get(id, 0)
@@ -40,11 +93,46 @@ def avg_brake_time(emission_path):
 
 
 def get_duration(tripinfo_path):
-    tree = ET.ElementTree(file=tripinfo_path)
-    root = tree.getroot()
-    for tripinfo in root:
-        id = tripinfo.attrib['id']
-        duration = float(tripinfo.attrib['duration'])
-        if len(id) > 7 and id[0:7] == 'SN_flow':
-            return duration
+    for tripinfo in _iter_elements(tripinfo_path, 'tripinfo'):
+        if _is_av(tripinfo.attrib['id']):
+            return float(tripinfo.attrib['duration'])
     return None
+
+
+def trajectory(emission_path, every=1):
+    """Return the (time, id, x, y, speed) rows of every `every`-th timestep."""
+    rows = []
+    for i, timestamp in enumerate(_iter_elements(emission_path, 'timestep')):
+        if i % every:
+            continue
+        time = float(timestamp.attrib['time'])
+        for vehicle in timestamp:
+            rows.append((time, vehicle.attrib['id'], float(vehicle.attrib['x']),
+                         float(vehicle.attrib['y']), float(vehicle.attrib['speed'])))
+    return rows
+
+
+def analyze(emission_location, step=0.1):
+    """Compute all metrics of a run from its summary, tripinfo and emission files.
+
+    Each file is read once, incrementally, so the whole analysis runs in
+    memory bounded by the number of vehicles rather than the file sizes.
+
+    Parameters
+    ----------
+    emission_location : str
+        common prefix of the `-summary.xml`, `-tripinfo.xml` and
+        `-emission.xml` files of the run
+    step : float
+        simulation step of the run, in seconds
+
+    Returns
+    -------
+    AnalysisResult
+        collision flag, success flag, AV duration and average brake time
+    """
+    collision = has_collision(emission_location + '-summary.xml')
+    duration = get_duration(emission_location + '-tripinfo.xml')
+    brake_time = avg_brake_time(emission_location + '-emission.xml', step)
+    is_success = duration is not None and not collision
+    return AnalysisResult(collision, is_success, duration, brake_time)
@@ -0,0 +1,53 @@
+"""Tests of the batch journal."""
+from batch_journal import BatchJournal
+from xml_analyzer import AnalysisResult
+
+SUCCESS = AnalysisResult(has_collision=False, is_success=True, duration=12.5, brake_time=1.0)
+COLLISION = AnalysisResult(has_collision=True, is_success=False, duration=None, brake_time=0.5)
+
+
+def test_reload(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = BatchJournal(path)
+    journal.append(0, SUCCESS)
+    journal.append(2, COLLISION)
+    journal.close()
+
+    journal = BatchJournal(path)
+    assert len(journal) == 2
+    assert 0 in journal and 2 in journal and 1 not in journal
+    assert journal.results[0] == SUCCESS
+    assert journal.results[2] == COLLISION
+    journal.close()
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = BatchJournal(path)
+    journal.append(0, SUCCESS)
+    journal.append(1, COLLISION)
+    journal.close()
+    with open(path) as f:
+        content = f.read()
+    # killed while writing the line of task 1
+    with open(path, 'w') as f:
+        f.write(content[:-10])
+
+    journal = BatchJournal(path)
+    assert list(journal.results) == [0]
+    journal.append(1, COLLISION)
+    journal.close()
+
+    journal = BatchJournal(path)
+    assert journal.results == {0: SUCCESS, 1: COLLISION}
+    journal.close()
+
+
+def test_creates_directory(tmp_path):
+    path = str(tmp_path / 'runs' / 'journal.jsonl')
+    journal = BatchJournal(path)
+    journal.append(0, SUCCESS)
+    journal.close()
+    journal = BatchJournal(path)
+    assert journal.results == {0: SUCCESS}
+    journal.close()
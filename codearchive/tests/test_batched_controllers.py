@@ -0,0 +1,77 @@
+"""Tests of the batched evaluation of the controllers."""
+import types
+
+import pytest
+
+pytest.importorskip('flow')
+
+import numpy as np
+from flow.controllers import IDMController
+from flow.core.params import SumoCarFollowingParams
+
+import batched_controllers
+
+
+class VehicleKernel:
+    """The part of flow's vehicle kernel read by the IDM controllers, over dicts by vehicle id."""
+
+    def __init__(self, speed, leader, headway, edge, controllers):
+        self.speed = speed
+        self.leader = leader
+        self.headway = headway
+        self.edge = edge
+        self.controllers = controllers
+
+    @staticmethod
+    def _get(values, veh_id):
+        if isinstance(veh_id, (list, tuple)):
+            return [values[v] for v in veh_id]
+        return values[veh_id]
+
+    def get_speed(self, veh_id):
+        return self._get(self.speed, veh_id)
+
+    def get_leader(self, veh_id):
+        return self._get(self.leader, veh_id)
+
+    def get_headway(self, veh_id):
+        return self._get(self.headway, veh_id)
+
+    def get_edge(self, veh_id):
+        return self._get(self.edge, veh_id)
+
+    def get_acc_controller(self, veh_id):
+        return self.controllers[veh_id]
+
+
+def make_env(seed=0, vehicles=50, **idm_params):
+    rng = np.random.RandomState(seed)
+    ids = ['human_{0}'.format(i) for i in range(vehicles)]
+    speed = dict(zip(ids, rng.uniform(0, 25, vehicles)))
+    # every other vehicle follows the previous one, the others lead
+    leader = {veh_id: ids[i - 1] if i % 2 else '' for i, veh_id in enumerate(ids)}
+    headway = dict(zip(ids, rng.uniform(0, 60, vehicles)))
+    headway[ids[1]] = 0.0
+    edge = {veh_id: 'WE' for veh_id in ids}
+    edge[ids[2]] = ':M_0'
+    controllers = {veh_id: IDMController(veh_id, car_following_params=SumoCarFollowingParams(), **idm_params)
+                   for veh_id in ids}
+    vehicle = VehicleKernel(speed, leader, headway, edge, controllers)
+    return types.SimpleNamespace(k=types.SimpleNamespace(vehicle=vehicle)), ids
+
+
+@pytest.mark.parametrize('idm_params', [{}, {'v0': 20, 'T': 1.5, 'a': 2, 'b': 3, 'delta': 2, 's0': 3}])
+def test_idm_accel_matches_controller(idm_params):
+    env, ids = make_env(**idm_params)
+    controllers = [env.k.vehicle.get_acc_controller(veh_id) for veh_id in ids]
+    expected = [controller.get_accel(env) for controller in controllers]
+    np.testing.assert_allclose(batched_controllers._idm_group(env, ids, controllers), expected, rtol=1e-12)
+
+
+def test_get_actions_leaves_junction_to_sumo():
+    env, ids = make_env()
+    accel = batched_controllers.get_actions(env, ids)
+    assert accel[2] is None
+    for veh_id, value in zip(ids, accel):
+        if value is not None:
+            assert value == pytest.approx(env.k.vehicle.get_acc_controller(veh_id).get_accel(env), rel=1e-12)
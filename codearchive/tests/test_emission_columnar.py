@@ -0,0 +1,72 @@
+"""Tests of the columnar conversion of the emission files."""
+import os
+
+import numpy as np
+
+import xml_analyzer
+from emission_columnar import convert, columnar_path, ColumnarEmission, META_FILE
+
+EMISSION = """<?xml version="1.0" encoding="UTF-8"?>
+<emission-export>
+    <timestep time="0.10">
+        <vehicle id="human_0" eclass="HBEFA3/PC_G_EU4" CO2="2624.72" x="3.20" y="100.50" angle="90.00" type="human" speed="10.00" lane="WE_0" route="routeWE" pos="5.00"/>
+        <vehicle id="SN_flow.0" eclass="HBEFA3/PC_G_EU4" CO2="0.00" x="198.40" y="5.00" angle="0.00" type="av" speed="0.00" lane="SN_0" route="routeSN" pos="5.00"/>
+    </timestep>
+    <timestep time="0.20">
+        <vehicle id="human_0" eclass="HBEFA3/PC_G_EU4" CO2="2700.00" x="4.20" y="100.50" angle="90.00" type="human" speed="10.10" lane="WE_0" route="routeWE" pos="6.00"/>
+    </timestep>
+    <timestep time="0.30">
+    </timestep>
+    <timestep time="0.40">
+        <vehicle id="SN_flow.0" eclass="HBEFA3/PC_G_EU4" CO2="1.50" x="198.40" y="5.30" angle="0.00" type="av" speed="3.00" lane="SN_0" route="routeSN" pos="5.30"/>
+        <vehicle id="WE_flow.1" x="1.00" y="100.50" type="human" speed="8.00" lane="WE_0" route="routeWE" pos="1.00"/>
+    </timestep>
+</emission-export>
+"""
+
+
+def write_emission(tmp_path, text=EMISSION):
+    path = str(tmp_path / 'cross_road_network-emission.xml')
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_round_trip(tmp_path):
+    path = write_emission(tmp_path)
+    directory = convert(path, chunk_rows=2)
+    assert directory == columnar_path(path) == str(tmp_path / 'cross_road_network-emission')
+
+    emission = ColumnarEmission(directory)
+    rows = xml_analyzer.trajectory(path)
+    assert len(emission) == len(rows) == 5
+    time, ids, x, y, speed = zip(*rows)
+    np.testing.assert_array_equal(emission['time'], time)
+    assert list(emission.strings('id')) == list(ids)
+    np.testing.assert_allclose(emission['x'], x, rtol=1e-6)
+    np.testing.assert_allclose(emission['y'], y, rtol=1e-6)
+    np.testing.assert_allclose(emission['speed'], speed, rtol=1e-6)
+    assert emission['x'].dtype == np.float32 and emission['time'].dtype == np.float64
+    assert list(emission.strings('route')) == ['routeWE', 'routeSN', 'routeWE', 'routeSN', 'routeWE']
+
+
+def test_missing_attributes(tmp_path):
+    emission = ColumnarEmission(convert(write_emission(tmp_path)))
+    # the last vehicle has no eclass nor CO2
+    assert emission.strings('eclass')[-1] == ''
+    assert np.isnan(emission['CO2'][-1])
+    assert 'CO2' in emission and 'waiting' not in emission
+
+
+def test_empty_emission(tmp_path):
+    path = write_emission(tmp_path, '<emission-export>\n    <timestep time="0.10"/>\n</emission-export>\n')
+    emission = ColumnarEmission(convert(path))
+    assert len(emission) == 0
+
+
+def test_reconversion_replaces_columns(tmp_path):
+    path = write_emission(tmp_path)
+    directory = convert(path)
+    assert os.path.exists(os.path.join(directory, META_FILE))
+    convert(path, chunk_rows=1)
+    assert len(ColumnarEmission(directory)) == 5
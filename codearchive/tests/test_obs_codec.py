@@ -0,0 +1,98 @@
+"""Tests of the compact storage of the replay observations."""
+import pytest
+
+pytest.importorskip('ray')
+
+import numpy as np
+
+import obs_codec
+from rl_env import X_PIXEL, Y_PIXEL, SPARSE_CELL_SIZE
+
+
+def dense_observation(rng, vehicles=10):
+    grid = np.zeros((X_PIXEL * Y_PIXEL, 5))
+    grid[:, 4] = 1
+    cells = rng.choice(X_PIXEL * Y_PIXEL, vehicles, replace=False)
+    speed = rng.uniform(0, 1.1, vehicles)
+    heading = rng.uniform(0, 1, vehicles)
+    grid[cells, 0] = speed * np.cos(2 * np.pi * heading)
+    grid[cells, 1] = speed * np.sin(2 * np.pi * heading)
+    grid[cells, 2] = speed
+    grid[cells, 3] = heading
+    grid[cells, 4] = rng.uniform(0, 1, vehicles)
+    return np.concatenate([grid.ravel(), [0.3, -0.2, 0.7]])
+
+
+def sparse_observation(rng, max_cells=8, vehicles=5):
+    cells = np.zeros((max_cells, SPARSE_CELL_SIZE))
+    cells[:vehicles, 0] = 1
+    cells[:vehicles, 1] = rng.randint(0, X_PIXEL, vehicles)
+    cells[:vehicles, 2] = rng.randint(0, Y_PIXEL, vehicles)
+    cells[:vehicles, 3:5] = rng.uniform(-1, 1, (vehicles, 2))
+    cells[:vehicles, 5:] = rng.uniform(0, 1, (vehicles, 3))
+    return np.concatenate([cells.ravel(), [0.3, -0.2, 0.7]])
+
+
+def test_uint8_round_trip():
+    rng = np.random.RandomState(0)
+    codec = obs_codec.ObservationCodec('uint8')
+    obs = dense_observation(rng)
+    encoded = codec.encode(obs)
+    assert encoded.dtype == np.uint8
+    decoded = codec.decode(encoded)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_less(np.abs(decoded - obs), codec.scale / 2 + 1e-6)
+    # the empty cells, zeros and ones, are exact
+    assert np.all(decoded[obs == 0] == 0)
+    assert np.all(decoded[obs == 1] == 1)
+
+
+def test_uint8_clips_out_of_bounds():
+    codec = obs_codec.ObservationCodec('uint8')
+    obs = np.zeros(len(codec.low))
+    obs[0] = 5.0
+    obs[2] = -1.0
+    decoded = codec.decode(codec.encode(obs))
+    assert decoded[0] == pytest.approx(codec.high[0])
+    assert decoded[2] == pytest.approx(codec.low[2])
+
+
+def test_sparse_indices_are_exact():
+    rng = np.random.RandomState(1)
+    codec = obs_codec.ObservationCodec('uint8', max_cells=8)
+    obs = sparse_observation(rng)
+    decoded = codec.decode(codec.encode(obs))
+    cells = obs[:-3].reshape(8, SPARSE_CELL_SIZE)
+    decoded_cells = decoded[:-3].reshape(8, SPARSE_CELL_SIZE)
+    np.testing.assert_array_equal(decoded_cells[:, :3], cells[:, :3])
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float16'])
+def test_float_codecs(dtype):
+    obs = dense_observation(np.random.RandomState(2))
+    codec = obs_codec.ObservationCodec(dtype)
+    decoded = codec.decode(codec.encode(obs))
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, obs, atol=1e-3 if dtype == 'float16' else 1e-7)
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        obs_codec.ObservationCodec('int4')
+
+
+def test_replay_buffer_shares_next_observations():
+    rng = np.random.RandomState(3)
+    codec = obs_codec.ObservationCodec('uint8')
+    buffer = obs_codec.CompactReplayBuffer(100, codec)
+    episode = [dense_observation(rng) for _ in range(11)]
+    for obs_t, obs_tp1 in zip(episode[:-1], episode[1:]):
+        buffer.add(obs_t, 1, 0.0, obs_tp1, False, None)
+    storage = buffer._storage
+    for first, second in zip(storage[:-1], storage[1:]):
+        assert first[3] is second[0]
+
+    obses_t, _, _, obses_tp1, _ = buffer._encode_sample([0, 4])
+    np.testing.assert_array_equal(obses_t, codec.decode(np.stack([codec.encode(episode[0]),
+                                                                  codec.encode(episode[4])])))
+    np.testing.assert_array_equal(obses_tp1[1], codec.decode(codec.encode(episode[5])))
@@ -0,0 +1,56 @@
+"""Tests of the statistics and search spaces of the parameter sweep."""
+import argparse
+
+import pytest
+
+pytest.importorskip('flow')
+
+import param_sweep
+from xml_analyzer import AnalysisResult
+
+
+def test_wilson_interval():
+    low, high = param_sweep.wilson_interval(15, 30)
+    assert low == pytest.approx(0.3315, abs=1e-4)
+    assert high == pytest.approx(0.6685, abs=1e-4)
+    # symmetric around one half, and within [0, 1] at the extremes
+    assert low + high == pytest.approx(1.0)
+    low, high = param_sweep.wilson_interval(0, 30)
+    assert low == 0.0 and 0 < high < 0.15
+    low, high = param_sweep.wilson_interval(30, 30)
+    assert 0.85 < low < 1 and high == 1.0
+    assert param_sweep.wilson_interval(0, 0) == (0.0, 1.0)
+
+
+def test_wilson_interval_narrows_with_tasks():
+    widths = [high - low for low, high in (param_sweep.wilson_interval(tasks // 10, tasks)
+                                           for tasks in (30, 100, 1000))]
+    assert widths == sorted(widths, reverse=True)
+
+
+def test_parse_param():
+    assert param_sweep.parse_param('ttc_threshold=3,3.5,4') == ('ttc_threshold', [3, 3.5, 4])
+    assert param_sweep.parse_param('t_c=4:8') == ('t_c', (4.0, 8.0))
+    with pytest.raises(argparse.ArgumentTypeError):
+        param_sweep.parse_param('ttc_threshold')
+
+
+def test_grid_configs():
+    configs = param_sweep.grid_configs({'a': [1, 2], 'b': [0.1, 0.3, 0.5]})
+    assert len(configs) == 6
+    assert {'a': 2, 'b': 0.3} in configs
+    with pytest.raises(ValueError):
+        param_sweep.grid_configs({'a': (1.0, 2.0)})
+
+
+def test_early_stop():
+    configs = [param_sweep.SweepConfig({'a': value}) for value in range(3)]
+    for config, collisions in zip(configs, (2, 25, 5)):
+        for task in range(50):
+            collision = task < collisions
+            config.stats.add(AnalysisResult(collision, not collision, None if collision else 10.0, 1.0))
+    stopped = param_sweep.early_stop(configs, min_tasks=30)
+    assert stopped == [configs[1]]
+    assert configs[1].stopped and not configs[0].stopped and not configs[2].stopped
+    assert param_sweep.early_stop(configs, min_tasks=30) == []
+    assert param_sweep.early_stop(configs, min_tasks=100) == []
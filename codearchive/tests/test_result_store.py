@@ -0,0 +1,81 @@
+"""Tests of the chunked NPZ result store."""
+import os
+import random
+
+import numpy as np
+
+from random_state import derive_seeds
+from result_store import ResultStore, ResultReader
+from xml_analyzer import AnalysisResult
+
+COLLISION = AnalysisResult(has_collision=True, is_success=False, duration=None, brake_time=0.5)
+SUCCESS = AnalysisResult(has_collision=False, is_success=True, duration=12.5, brake_time=1.0)
+TIMEOUT = AnalysisResult(has_collision=False, is_success=False, duration=None, brake_time=2.0)
+
+
+def trajectory(task):
+    return [(0.1 * step, 'veh{0}'.format(task), float(step), float(task), 10.0) for step in range(3)]
+
+
+def write_store(directory, tasks, chunk_size=2):
+    store = ResultStore(directory, chunk_size=chunk_size)
+    for task, result in tasks:
+        store.add(task, result, derive_seeds(7, task), trajectory(task))
+    store.close()
+
+
+def test_write_and_read(tmp_path):
+    results = [SUCCESS, COLLISION, TIMEOUT, COLLISION, SUCCESS]
+    # tasks finish out of order in a pool
+    write_store(str(tmp_path), [(task, results[task]) for task in (3, 0, 4, 1, 2)])
+    assert len(os.listdir(str(tmp_path))) == 3
+
+    reader = ResultReader(str(tmp_path))
+    assert len(reader) == 5
+    np.testing.assert_array_equal(reader.tasks['task'], np.arange(5))
+    assert reader.record(0)['is_success']
+    assert reader.record(0)['duration'] == 12.5
+    assert np.isnan(reader.record(1)['duration'])
+    assert reader.random_state(3) == derive_seeds(7, 3)
+
+    rows = reader.trajectory(4)
+    assert len(rows) == 3
+    assert set(rows['vehicle']) == {b'veh4'}
+    np.testing.assert_allclose(rows['x'], [0, 1, 2])
+
+
+def test_select(tmp_path):
+    results = [SUCCESS, COLLISION, TIMEOUT, COLLISION, SUCCESS]
+    write_store(str(tmp_path), list(enumerate(results)))
+    reader = ResultReader(str(tmp_path))
+    np.testing.assert_array_equal(reader.select('collision'), [1, 3])
+    np.testing.assert_array_equal(reader.select('success'), [0, 4])
+    np.testing.assert_array_equal(reader.select('timeout'), [2])
+
+
+def test_random_state_round_trip(tmp_path):
+    state = random.getstate()
+    store = ResultStore(str(tmp_path))
+    store.add(0, SUCCESS, state)
+    store.close()
+    reader = ResultReader(str(tmp_path))
+    assert reader.random_state(0) == state
+    assert len(reader.trajectory(0)) == 0
+
+
+def test_reopened_store_appends_chunks(tmp_path):
+    write_store(str(tmp_path), [(0, SUCCESS), (1, COLLISION)])
+    write_store(str(tmp_path), [(2, TIMEOUT)])
+    reader = ResultReader(str(tmp_path))
+    np.testing.assert_array_equal(reader.tasks['task'], [0, 1, 2])
+
+
+def test_partial_chunk_is_ignored(tmp_path):
+    write_store(str(tmp_path), [(0, SUCCESS), (1, COLLISION)])
+    # a chunk being written when the run was killed
+    with open(os.path.join(str(tmp_path), '.tmp-chunk-00001.npz'), 'wb') as f:
+        f.write(b'PK\x03\x04')
+    assert len(ResultReader(str(tmp_path))) == 2
+    write_store(str(tmp_path), [(2, TIMEOUT)])
+    assert os.path.exists(os.path.join(str(tmp_path), 'chunk-00001.npz'))
+    assert len(ResultReader(str(tmp_path))) == 3
@@ -0,0 +1,56 @@
+"""Tests of the observations of CrossRoadRLAccelEnv."""
+import pytest
+
+pytest.importorskip('flow')
+
+import numpy as np
+from flow.core.params import SumoParams, EnvParams
+from flow.controllers import RLController
+
+import rl_env
+import surrogate_sim
+from cross_road_network import CrossRoadNetwork
+from sumo_parameters import get_net_params, get_initial_config, get_vehicle_params
+
+
+def make_rl_env(**env_options):
+    network = CrossRoadNetwork(name='test_network', vehicles=get_vehicle_params(RLController, {}, True),
+                               net_params=get_net_params(0.5), initial_config=get_initial_config())
+    env_params = EnvParams(horizon=600, warmup_steps=150,
+                           additional_params=dict(rl_env.ADDITIONAL_ENV_PARAMS, **env_options))
+    return rl_env.CrossRoadRLAccelEnv(env_params, SumoParams(sim_step=0.1, seed=1), network,
+                                      surrogate_sim.SIMULATOR)
+
+
+def observations(env, episodes=2):
+    rng = np.random.RandomState(0)
+    result = []
+    for _ in range(episodes):
+        result.append(env.reset())
+        done = False
+        while not done:
+            obs, _, done, _ = env.step(rng.choice([0, 1, 2, 3, 3, 3]))
+            result.append(obs)
+    return np.array(result)
+
+
+def test_sparse_observation_densifies_to_dense():
+    dense = observations(make_rl_env(obs_mode='dense'))
+    env = make_rl_env(obs_mode='sparse', max_cells=rl_env.X_PIXEL * rl_env.Y_PIXEL)
+    sparse = observations(env)
+    assert sparse.shape[1:] == env.observation_space.shape
+    assert len(sparse) == len(dense)
+    np.testing.assert_array_equal(rl_env.densify_observation(sparse), dense)
+    np.testing.assert_array_equal(rl_env.densify_observation(sparse[10]), dense[10])
+
+
+def test_sparse_observation_lists_occupied_cells():
+    env = make_rl_env(obs_mode='sparse', max_cells=4)
+    sparse = observations(env, episodes=1)
+    cells = sparse[:, :-3].reshape((len(sparse), 4, rl_env.SPARSE_CELL_SIZE))
+    valid = cells[:, :, 0]
+    assert set(np.unique(valid)) <= {0, 1}
+    assert valid.any()
+    # the valid cells come first, the padding is all zeros
+    assert np.all(np.diff(valid, axis=1) <= 0)
+    assert np.all(cells[valid == 0] == 0)
@@ -0,0 +1,37 @@
+"""Tests of the step profiler."""
+import time
+
+from step_profiler import StepProfiler
+
+
+def test_nested_phases_are_counted_once():
+    profiler = StepProfiler()
+    profiler.start_episode()
+    with profiler.phase('reset'):
+        time.sleep(0.01)
+        for _ in range(3):
+            with profiler.phase('step'):
+                time.sleep(0.01)
+    reset, step = profiler.phases['reset'], profiler.phases['step']
+    assert step.count == 3 and reset.count == 1
+    assert 0.03 <= step.total < 0.06
+    assert 0.01 <= reset.total < 0.025
+    assert profiler.episodes[-1]['reset'][1] == reset.total
+
+
+def test_merge_and_disabled():
+    first, second = StepProfiler(), StepProfiler()
+    for profiler in (first, second):
+        profiler.start_episode()
+        with profiler.phase('step'):
+            pass
+    first.merge(second.to_dict())
+    assert first.phases['step'].count == 2
+    assert len(first.episodes) == 2
+    assert 'step' in first.summary()
+
+    disabled = StepProfiler(enabled=False)
+    disabled.start_episode()
+    with disabled.phase('step'):
+        pass
+    assert disabled.phases == {} and disabled.episodes == []
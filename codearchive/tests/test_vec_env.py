@@ -0,0 +1,67 @@
+"""Tests of the vectorized env wrapper."""
+import types
+
+import pytest
+
+pytest.importorskip('ray')
+pytest.importorskip('flow')
+
+import numpy as np
+
+import vec_env
+
+
+class CountingEnv:
+    """Env whose observation is its step count, and whose episodes last `index + 2` steps."""
+
+    def __init__(self, index):
+        self.episode_steps = index + 2
+        self.steps = 0
+        self.observation_space = 'observation_space'
+        self.action_space = 'action_space'
+
+    def reset(self):
+        self.steps = 0
+        return np.full(3, -1.0)
+
+    def step(self, action):
+        self.steps += 1
+        return np.full(3, float(self.steps)), float(action), self.steps >= self.episode_steps, {}
+
+    def terminate(self):
+        pass
+
+
+def make_create_env(params, version):
+    return (lambda: CountingEnv(version)), 'CountingEnv-v{0}'.format(version)
+
+
+@pytest.fixture
+def vec(monkeypatch):
+    # the workers are forked, and inherit the patched factory
+    monkeypatch.setattr(vec_env, 'make_create_env', make_create_env)
+    flow_params = {'simulator': 'numpy', 'sim': types.SimpleNamespace(port=None)}
+    env = vec_env.CrossRoadVecEnv(flow_params, 2)
+    yield env
+    env.close()
+
+
+def test_step_keeps_terminal_observation(vec):
+    np.testing.assert_array_equal(vec.reset(), np.full((2, 3), -1.0))
+    obs, rewards, dones, infos = vec.step([1, 2])
+    np.testing.assert_array_equal(obs, [[1, 1, 1], [1, 1, 1]])
+    np.testing.assert_array_equal(rewards, [1, 2])
+    assert not dones.any()
+
+    # the first env finishes its episode and is reset, the second goes on
+    obs, _, dones, infos = vec.step([0, 0])
+    np.testing.assert_array_equal(dones, [True, False])
+    np.testing.assert_array_equal(infos[0]['terminal_observation'], [2, 2, 2])
+    np.testing.assert_array_equal(obs[0], [-1, -1, -1])
+    np.testing.assert_array_equal(obs[1], [2, 2, 2])
+    assert 'terminal_observation' not in infos[1]
+
+
+def test_spaces(vec):
+    assert vec.observation_space == 'observation_space'
+    assert vec.action_space == 'action_space'